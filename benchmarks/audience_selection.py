@@ -0,0 +1,140 @@
+"""
+Latency of select_campaign_audience as the customer base grows.
+
+Seeds a scratch schema with synthetic customers, RFM scores and a campaign that already
+emailed half of the At Risk segment, then times pages of the audience query at the start
+and in the middle of the audience. With keyset pagination the latency of a page should stay
+flat as the number of customers grows, so the middle pages at the largest size must take at
+most --max-ratio times as long as at the smallest, or the script exits non-zero. The public
+tables are only read, to copy their definitions and indexes, so run migration-indexes.sql first.
+
+    uv run python benchmarks/audience_selection.py --sizes 10000 100000
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import sys
+import time
+from uuid import UUID
+
+from dotenv import load_dotenv
+from sqlalchemy import text
+from ralph.my_mcp.servers.audience import select_audience_page
+from ralph.my_mcp.servers.db import create_db_engine
+
+
+SCHEMA = "audience_benchmark"
+CAMPAIGN_ID = UUID("00000000-0000-0000-0000-000000000001")
+
+# The pages checked to stay flat as the customers grow
+MIDDLE_PAGES = ["segment, middle page", "not emailed, middle"]
+
+SEED_SQL = [
+    f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE",
+    f"CREATE SCHEMA {SCHEMA}",
+    f"CREATE TABLE {SCHEMA}.customers (LIKE public.customers INCLUDING ALL)",
+    f"CREATE TABLE {SCHEMA}.rfm (LIKE public.rfm INCLUDING ALL)",
+    f"CREATE TABLE {SCHEMA}.marketing_campaigns (LIKE public.marketing_campaigns INCLUDING ALL)",
+    f"CREATE TABLE {SCHEMA}.campaign_emails (LIKE public.campaign_emails INCLUDING ALL)",
+    f"""
+    INSERT INTO {SCHEMA}.customers ("Customer ID", "Country", "Name", "Email")
+    SELECT g, 'United Kingdom', 'Customer ' || g, CASE WHEN g % 50 = 0 THEN NULL ELSE 'customer' || g || '@example.com' END
+    FROM generate_series(1, :customers) g
+    """,
+    f"""
+    INSERT INTO {SCHEMA}.rfm ("Customer ID", recency, frequency, monetary, "R", "F", "M", "RFM_Score", "Segment")
+    SELECT g, (random() * 700)::bigint, (random() * 50)::bigint, random() * 5000, r, f, m, r * 100 + f * 10 + m,
+           CASE WHEN r = 5 AND f = 5 AND m = 5 THEN 'Champion'
+                WHEN r = 5 THEN 'Recent Customer'
+                WHEN f = 5 THEN 'Frequent Buyer'
+                WHEN m = 5 THEN 'Big Spender'
+                WHEN r = 1 THEN 'At Risk'
+                ELSE 'Others' END
+    FROM (
+        SELECT g, 1 + floor(random() * 5)::int AS r, 1 + floor(random() * 5)::int AS f, 1 + floor(random() * 5)::int AS m
+        FROM generate_series(1, :customers) g
+    ) scores
+    """,
+    f"""
+    INSERT INTO {SCHEMA}.marketing_campaigns (id, name, type, description)
+    VALUES ('{CAMPAIGN_ID}', 'Benchmark win-back', 're-engagement', 'Seeded by audience_selection.py')
+    """,
+    f"""
+    INSERT INTO {SCHEMA}.campaign_emails (campaign_id, customer_id, subject, body)
+    SELECT '{CAMPAIGN_ID}', "Customer ID", 'We miss you', '<p>Come back</p>'
+    FROM {SCHEMA}.rfm WHERE "Segment" = 'At Risk' AND "Customer ID" % 2 = 0
+    """,
+    f"ANALYZE {SCHEMA}.customers, {SCHEMA}.rfm, {SCHEMA}.marketing_campaigns, {SCHEMA}.campaign_emails",
+]
+
+
+def scenarios(customers: int) -> dict[str, dict]:
+    return {
+        "segment, first page": {"segments": ["At Risk"]},
+        "segment, middle page": {"segments": ["At Risk"], "after_customer_id": customers // 2},
+        "not emailed, first": {"segments": ["At Risk"], "exclude_emailed_for_campaign": CAMPAIGN_ID},
+        "not emailed, middle": {"segments": ["At Risk"], "exclude_emailed_for_campaign": CAMPAIGN_ID, "after_customer_id": customers // 2},
+        "R 1-2 and M 4-5": {"r_scores": [1, 2], "m_scores": [4, 5]},
+    }
+
+
+async def measure(conn, filters: dict, limit: int, runs: int) -> float:
+    await select_audience_page(conn, limit=limit, **filters)
+    timings = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        await select_audience_page(conn, limit=limit, **filters)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+async def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Time select_campaign_audience on seeded databases of growing size.")
+    parser.add_argument("--uri", default=os.getenv("SUPABASE_URI"), help="Postgres connection string.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 100_000], help="Numbers of customers to seed.")
+    parser.add_argument("--limit", type=int, default=100, help="Customers per page.")
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--max-ratio", type=float, default=2.0, help="Slowdown of the middle pages allowed from the smallest size to the largest.")
+    parser.add_argument("--keep", action="store_true", help=f"Keep the {SCHEMA} schema of the last size.")
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.uri)
+    results = {}
+    try:
+        for size in args.sizes:
+            async with engine.begin() as conn:
+                for statement in SEED_SQL:
+                    await conn.execute(text(statement), {"customers": size} if ":customers" in statement else {})
+
+            async with engine.connect() as conn:
+                await conn.execute(text(f"SET search_path TO {SCHEMA}"))
+                for name, filters in scenarios(size).items():
+                    results.setdefault(name, {})[size] = await measure(conn, filters, args.limit, args.runs)
+                await conn.rollback()
+
+        print(f"{'scenario':<24}" + "".join(f"{f'{size:,} ms':>14}" for size in args.sizes))
+        for name, timings in results.items():
+            print(f"{name:<24}" + "".join(f"{timings[size] * 1000:>14.2f}" for size in args.sizes))
+
+        smallest, largest = min(args.sizes), max(args.sizes)
+        failed = 0
+        print()
+        for name in MIDDLE_PAGES:
+            ratio = results[name][largest] / results[name][smallest]
+            ok = ratio <= args.max_ratio
+            failed += not ok
+            print(f"{name}: {largest:,} customers take {ratio:.2f}x as long as {smallest:,}, {'ok' if ok else f'FAILED, over {args.max_ratio}x'}")
+    finally:
+        if not args.keep:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,456 @@
+"""
+End-to-end benchmark of full campaign runs, without the NVIDIA endpoint, Supabase or Slack.
+
+Seeds a `ralph_benchmark` database on a local Postgres from the migrations and db/data/*.csv,
+copying the customers, their RFM scores and their transactions until there are enough
+customers for the largest campaign. Each scenario then runs in its own process: the graph of
+`build_graph()` with a scripted model, the real query and marketing MCP servers against the
+seeded database, and benchmarks/stub_slack_server.py.
+
+Scenarios:
+    segment_analysis    Segment sizes and spend, then the profiles of the top champions.
+    loyalty_100         A loyalty campaign to 100, 1,000 or 10,000 customers, sent page by page
+    loyalty_1000        with select_campaign_audience and send_templated_campaign_emails, then
+    loyalty_10000       announced on Slack.
+    interrupt_resume    A campaign with approvals: the campaign is approved, the first send gets
+                        feedback through human_tool_review_node, the revised send is approved.
+
+Reports the startup of the MCP servers, the latency of the run, graph steps, LLM and tool calls,
+database statements sent by the MCP servers, emails written and the peak RSS of the agent
+and of the servers. Results are compared with benchmarks/baselines/campaign_e2e.json and the
+script exits with status 1 when a count grows or a timing or memory figure grows by more than
+the tolerance. Timings depend on the machine, record a baseline on the machine you compare on.
+
+    uv run python benchmarks/campaign_e2e.py --uri postgresql://postgres@localhost:5432/postgres
+    uv run python benchmarks/campaign_e2e.py --uri ... --scenarios loyalty_1000 --update-baseline
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import math
+import os
+import resource
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+from fakes import ScriptedChatModel
+from langchain_core.messages import AIMessage, HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+from langgraph.types import Command
+from ralph.graph import build_graph
+from ralph.metrics import configure_tracing
+from ralph.my_mcp.servers.audience import MAX_AUDIENCE_PAGE_SIZE
+from ralph.my_mcp.registry import MCPToolRegistry
+from sqlalchemy.engine import make_url
+import psycopg2
+
+
+ROOT = Path(__file__).resolve().parent.parent
+SERVERS_DIR = ROOT / "src" / "ralph" / "my_mcp" / "servers"
+BASELINE_PATH = Path(__file__).resolve().parent / "baselines" / "campaign_e2e.json"
+
+DATABASE = "ralph_benchmark"
+MIGRATIONS = [
+    "migration-create-tables.sql", "migration-table-versions.sql", "migration-indexes.sql",
+    "migration-incremental-rfm.sql", "migration-email-outbox.sql", "migration-campaign-performance.sql",
+]
+TABLES = ["customers", "items", "transactions", "rfm"]
+# Offsets of the IDs of copied customers and invoices, above any ID in the CSVs
+CUSTOMER_ID_OFFSET = 1_000_000
+INVOICE_OFFSET = 10_000_000
+
+# Metrics compared with the baseline: counts must not grow, timings and memory may grow by the tolerance
+COUNT_METRICS = ["steps", "llm_calls", "tool_calls", "tool_errors", "db_statements", "emails", "interrupts"]
+RELATIVE_METRICS = ["startup_s", "latency_s", "agent_rss_mb", "servers_rss_mb"]
+# Timings below this many seconds apart are noise
+MIN_TIMING_DIFFERENCE = 0.05
+
+
+# ----------------------------
+# Database
+# ----------------------------
+
+def database_uri(uri: str) -> str:
+    return make_url(uri).set(database=DATABASE).render_as_string(hide_password=False)
+
+
+def seed_database(uri: str, customers: int, reseed: bool = False) -> str:
+    """
+    Create and seed the benchmark database with at least `customers` customers, unless it already is.
+
+    Returns:
+        The connection string of the benchmark database.
+    """
+    seed = f"customers={customers} migrations={len(MIGRATIONS)}"
+    admin = psycopg2.connect(uri)
+    admin.autocommit = True
+    try:
+        with admin.cursor() as cur:
+            cur.execute(
+                "SELECT shobj_description(oid, 'pg_database') FROM pg_database WHERE datname = %s",
+                (DATABASE,),
+            )
+            row = cur.fetchone()
+            if row is not None and row[0] == seed and not reseed:
+                return database_uri(uri)
+            print(f"Seeding {DATABASE} with {customers:,} customers...", file=sys.stderr)
+            cur.execute(f"DROP DATABASE IF EXISTS {DATABASE}")
+            cur.execute(f"CREATE DATABASE {DATABASE}")
+    finally:
+        admin.close()
+
+    conn = psycopg2.connect(database_uri(uri))
+    try:
+        with conn, conn.cursor() as cur:
+            for migration in MIGRATIONS:
+                cur.execute((ROOT / "db" / migration).read_text())
+            for table in TABLES:
+                with open(ROOT / "db" / "data" / f"{table}.csv") as f:
+                    columns = ", ".join(f'"{column}"' for column in f.readline().strip().split(","))
+                    cur.copy_expert(f"COPY {table} ({columns}) FROM STDIN WITH (FORMAT csv)", f)
+
+            cur.execute("SELECT count(*) FROM customers")
+            copies = math.ceil(customers / cur.fetchone()[0]) - 1
+            # Copies keep the names, segments and purchase histories of the originals, under new IDs
+            cur.execute(f"""
+                INSERT INTO customers ("Customer ID", "Country", "Name", "Email")
+                SELECT c."Customer ID" + k * {CUSTOMER_ID_OFFSET}, c."Country", c."Name", replace(c."Email", '@', '+' || k || '@')
+                FROM customers c, generate_series(1, %(copies)s) k
+            """, {"copies": copies})
+            cur.execute(f"""
+                INSERT INTO rfm ("Customer ID", recency, frequency, monetary, "R", "F", "M", "RFM_Score", "Segment")
+                SELECT r."Customer ID" + k * {CUSTOMER_ID_OFFSET}, recency, frequency, monetary, "R", "F", "M", "RFM_Score", "Segment"
+                FROM rfm r, generate_series(1, %(copies)s) k
+            """, {"copies": copies})
+            cur.execute(f"""
+                INSERT INTO transactions ("Invoice", "InvoiceDate", "StockCode", "Quantity", "Price", "TotalPrice", "Customer ID")
+                SELECT t."Invoice" + k * {INVOICE_OFFSET}, "InvoiceDate", "StockCode", "Quantity", "Price", "TotalPrice",
+                       t."Customer ID" + k * {CUSTOMER_ID_OFFSET}
+                FROM transactions t, generate_series(1, %(copies)s) k
+            """, {"copies": copies})
+            cur.execute("REFRESH MATERIALIZED VIEW customer_summary")
+            cur.execute(f"COMMENT ON DATABASE {DATABASE} IS %s", (seed,))
+        conn.autocommit = True
+        with conn.cursor() as cur:
+            cur.execute("VACUUM ANALYZE")
+    finally:
+        conn.close()
+    return database_uri(uri)
+
+
+def reset_campaigns(uri: str) -> None:
+    conn = psycopg2.connect(uri)
+    try:
+        with conn, conn.cursor() as cur:
+            cur.execute("TRUNCATE marketing_campaigns, campaign_emails, campaign_performance, campaign_segment_performance")
+    finally:
+        conn.close()
+
+
+def count_emails(uri: str) -> int:
+    conn = psycopg2.connect(uri)
+    try:
+        with conn.cursor() as cur:
+            cur.execute("SELECT count(*) FROM campaign_emails")
+            return cur.fetchone()[0]
+    finally:
+        conn.close()
+
+
+# ----------------------------
+# Scenarios
+# ----------------------------
+
+LOYAL_SEGMENTS = ["Champion", "Frequent Buyer", "Big Spender", "Recent Customer", "Others"]
+SUBJECT = "{{ first_name | Hi there }}, thank you for being with us"
+BODY = (
+    "<p>Hi {{ first_name | there }},</p>"
+    "<p>Thank you for your loyalty! As one of our {{ segment }} customers, enjoy 20% off "
+    "{{ recommendation | our new arrivals }} with code THANKYOU20.</p>"
+)
+
+_tool_call_ids = iter(range(1, 1_000_000))
+
+
+def call_tools(*calls: tuple[str, dict], content: str = "") -> AIMessage:
+    return AIMessage(content=content, tool_calls=[
+        {"name": name, "args": args, "id": f"call_{next(_tool_call_ids)}", "type": "tool_call"}
+        for name, args in calls
+    ])
+
+
+def segment_analysis():
+    yield call_tools(
+        ("query", {"sql": 'SELECT "Segment", COUNT(*) AS customers, ROUND(AVG(monetary)::numeric, 2) AS avg_spend '
+                          'FROM rfm GROUP BY "Segment" ORDER BY customers DESC'}),
+        ("query", {"sql": 'SELECT "Country", COUNT(*) AS customers FROM customers GROUP BY "Country" ORDER BY customers DESC LIMIT 10'}),
+        content="Let me look at the segments and where our customers are.",
+    )
+    [page] = yield call_tools(("select_campaign_audience", {"segments": ["Champion"], "limit": 10}))
+    customer_ids = [customer["customer_id"] for customer in json.loads(page)["customers"]]
+    yield call_tools(("get_customer_profiles", {"customer_ids": customer_ids}))
+    yield AIMessage(content="Champions are our smallest but most valuable segment, and most customers are in the United Kingdom.")
+
+
+def loyalty_campaign(recipients: int):
+    def script():
+        [campaign_id] = yield call_tools(("create_campaign", {
+            "name": f"Loyalty thank you ({recipients:,})",
+            "type": "loyalty",
+            "description": "Thank loyal customers with 20% off.",
+        }))
+        [page] = yield call_tools(("select_campaign_audience", {"segments": LOYAL_SEGMENTS, "limit": min(MAX_AUDIENCE_PAGE_SIZE, recipients)}))
+        page = json.loads(page)
+        yield call_tools(("preview_campaign_email", {
+            "subject_template": SUBJECT,
+            "body_template": BODY,
+            "customer_id": page["customers"][0]["customer_id"],
+        }))
+
+        sent = 0
+        while True:
+            customer_ids = [customer["customer_id"] for customer in page["customers"]][:recipients - sent]
+            [result] = yield call_tools(("send_templated_campaign_emails", {
+                "campaign_id": campaign_id,
+                "subject_template": SUBJECT,
+                "body_template": BODY,
+                "customer_ids": customer_ids,
+            }))
+            sent += json.loads(result)["queued"]
+            if sent >= recipients or page["next_after_customer_id"] is None:
+                break
+            [page] = yield call_tools(("select_campaign_audience", {
+                "segments": LOYAL_SEGMENTS,
+                "limit": min(MAX_AUDIENCE_PAGE_SIZE, recipients - sent),
+                "after_customer_id": page["next_after_customer_id"],
+            }))
+            page = json.loads(page)
+
+        yield call_tools(("slack_post_message", {
+            "channel_id": "C0000000001",
+            "text": f"The loyalty campaign went out to {sent:,} customers.",
+        }))
+        yield AIMessage(content=f"Done! The loyalty campaign was sent to {sent:,} customers and announced on Slack.")
+    return script
+
+
+def interrupt_resume():
+    [campaign_id] = yield call_tools(("create_campaign", {
+        "name": "Win back",
+        "type": "re-engagement",
+        "description": "Win back customers at risk with 15% off.",
+    }))
+    [page] = yield call_tools(("select_campaign_audience", {"segments": ["At Risk"], "limit": 20}))
+    customer_ids = [customer["customer_id"] for customer in json.loads(page)["customers"]]
+    send = {
+        "campaign_id": campaign_id,
+        "subject_template": "{{ first_name | Hi there }}, we have not seen you in a while and we miss you a lot",
+        "body_template": "<p>Come back for 15% off {{ favourite_item | your favourites }} with code COMEBACK15.</p>",
+        "customer_ids": customer_ids,
+    }
+    # Answered with feedback by the reviewer instead of being run
+    yield call_tools(("send_templated_campaign_emails", send))
+    yield call_tools(("send_templated_campaign_emails", {**send, "subject_template": "{{ first_name | Hi there }}, we miss you"}))
+    yield AIMessage(content="The win-back emails went out with the shorter subject line.")
+
+
+# Each scenario: the request, the script, whether tool calls need approval and the answers to the approvals
+SCENARIOS = {
+    "segment_analysis": ("How do our customer segments compare?", segment_analysis, True, []),
+    **{
+        f"loyalty_{recipients}": (f"Send a loyalty campaign to {recipients:,} customers.", loyalty_campaign(recipients), True, [])
+        for recipients in (100, 1000, 10_000)
+    },
+    "interrupt_resume": ("Win back the customers at risk.", interrupt_resume, False, [
+        {"action": "continue"},
+        {"action": "feedback", "data": "The subject line is too long, make it shorter."},
+        {"action": "continue"},
+    ]),
+}
+
+
+# ----------------------------
+# Runs
+# ----------------------------
+
+def server_connections(uri: str, trace_path: str) -> dict[str, dict]:
+    env = {"SUPABASE_URI": uri, "METRICS_TRACE_PATH": trace_path}
+    if os.getenv("PYTHONPATH"):
+        env["PYTHONPATH"] = os.environ["PYTHONPATH"]
+    scripts = {
+        "postgres": SERVERS_DIR / "query_server.py",
+        "marketing": SERVERS_DIR / "marketing_server.py",
+        "slack": Path(__file__).resolve().parent / "stub_slack_server.py",
+    }
+    return {
+        name: {"command": sys.executable, "args": [str(script)], "env": env, "transport": "stdio"}
+        for name, script in scripts.items()
+    }
+
+
+def read_spans(trace_path: str) -> list[dict]:
+    with open(trace_path) as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+async def run_scenario(name: str, uri: str, llm_latency: float) -> dict:
+    """
+    Run one scenario in this process and measure it.
+    """
+    request, script, yolo_mode, reviews = SCENARIOS[name]
+    work_dir = tempfile.mkdtemp(prefix="campaign_e2e_")
+    trace_path = os.path.join(work_dir, "trace.jsonl")
+    configure_tracing(trace_path)
+
+    start = time.perf_counter()
+    registry = MCPToolRegistry(server_connections(uri, trace_path), schema_cache_path=Path(work_dir) / "schemas.json")
+    try:
+        tools = await registry.get_tools()
+        startup = time.perf_counter() - start
+
+        model = ScriptedChatModel(script=script(), latency=llm_latency)
+        graph = await build_graph(checkpointer=MemorySaver(), model=model, tools=tools)
+        config = {"configurable": {"thread_id": name}, "recursion_limit": 1000}
+
+        start = time.perf_counter()
+        graph_input = {"messages": [HumanMessage(content=request)], "yolo_mode": yolo_mode}
+        steps = interrupts = 0
+        while graph_input is not None:
+            async for update in graph.astream(graph_input, config, stream_mode="updates"):
+                steps += sum(1 for node in update if node != "__interrupt__")
+            thread_state = await graph.aget_state(config)
+            graph_input = None
+            if thread_state.interrupts:
+                graph_input = Command(resume=reviews[interrupts])
+                interrupts += 1
+        latency = time.perf_counter() - start
+    finally:
+        await registry.aclose()
+
+    spans = read_spans(trace_path)
+    shutil.rmtree(work_dir, ignore_errors=True)
+    own = [record for record in spans if record["pid"] == os.getpid()]
+    return {
+        "startup_s": round(startup, 3),
+        "latency_s": round(latency, 3),
+        "steps": steps,
+        "llm_calls": sum(record["kind"] == "llm" for record in own),
+        "tool_calls": sum(record["kind"] == "tool" for record in own),
+        "tool_errors": sum(record["kind"] == "tool" and record["status"] == "error" for record in own),
+        "db_statements": sum(record["kind"] == "db" for record in spans if record["pid"] != os.getpid()),
+        "emails": count_emails(uri),
+        "interrupts": interrupts,
+        # ru_maxrss is in KiB on Linux. The servers have exited, so they count as children.
+        "agent_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "servers_rss_mb": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+
+def run_in_subprocess(name: str, uri: str, llm_latency: float) -> dict:
+    reset_campaigns(uri)
+    process = subprocess.run(
+        [sys.executable, __file__, "--run-scenario", name, "--database-uri", uri, "--llm-latency", str(llm_latency)],
+        stdout=subprocess.PIPE,
+        text=True,
+    )
+    if process.returncode != 0:
+        raise RuntimeError(f"Scenario {name} failed with exit code {process.returncode}")
+    return json.loads(process.stdout.strip().splitlines()[-1])
+
+
+def median_result(runs: list[dict]) -> dict:
+    result = dict(runs[0])
+    for metric in RELATIVE_METRICS:
+        result[metric] = round(statistics.median(run[metric] for run in runs), 3)
+    return result
+
+
+# ----------------------------
+# Baselines
+# ----------------------------
+
+def compare(results: dict[str, dict], baseline: dict[str, dict], tolerance: float) -> list[str]:
+    """
+    Get the regressions of the results against the baseline.
+    """
+    regressions = []
+    for name, result in results.items():
+        expected = baseline.get(name)
+        if expected is None:
+            continue
+        for metric in COUNT_METRICS:
+            if result[metric] > expected.get(metric, result[metric]):
+                regressions.append(f"{name}: {metric} went from {expected[metric]:,} to {result[metric]:,}")
+        for metric in RELATIVE_METRICS:
+            if metric not in expected:
+                continue
+            limit = expected[metric] * (1 + tolerance)
+            if metric.endswith("_s"):
+                limit = max(limit, expected[metric] + MIN_TIMING_DIFFERENCE)
+            if result[metric] > limit:
+                regressions.append(f"{name}: {metric} went from {expected[metric]} to {result[metric]}")
+    return regressions
+
+
+def print_results(results: dict[str, dict], baseline: dict[str, dict]) -> None:
+    columns = ["startup_s", "latency_s", "steps", "llm_calls", "tool_calls", "db_statements", "emails", "agent_rss_mb", "servers_rss_mb"]
+    print(f"{'scenario':<18}" + "".join(f"{column:>15}" for column in columns))
+    for name, result in results.items():
+        print(f"{name:<18}" + "".join(f"{result[column]:>15,}" for column in columns))
+        if name in baseline:
+            print(f"{'  baseline':<18}" + "".join(f"{baseline[name].get(column, ''):>15,}" for column in columns))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run full campaigns end to end against a seeded local database.")
+    parser.add_argument("--uri", default=os.getenv("BENCHMARK_POSTGRES_URI", "postgresql://postgres@localhost:5432/postgres"),
+                        help=f"Postgres server to create the {DATABASE} database on.")
+    parser.add_argument("--scenarios", nargs="+", default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument("--customers", type=int, default=13_000, help="Customers to seed, enough for the loyalty_10000 audience.")
+    parser.add_argument("--reseed", action="store_true", help="Seed the database again even if it is already seeded.")
+    parser.add_argument("--runs", type=int, default=1, help="Runs per scenario, timings and memory are the median.")
+    parser.add_argument("--llm-latency", type=float, default=0.0, help="Seconds each scripted LLM call takes.")
+    parser.add_argument("--baseline", type=Path, default=BASELINE_PATH)
+    parser.add_argument("--update-baseline", action="store_true", help="Save the results of the scenarios run as the baseline.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Growth of timings and memory over the baseline that is accepted.")
+    parser.add_argument("--output", type=Path, help="Write the results to this JSON file.")
+    parser.add_argument("--run-scenario", help=argparse.SUPPRESS)
+    parser.add_argument("--database-uri", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.run_scenario:
+        print(json.dumps(asyncio.run(run_scenario(args.run_scenario, args.database_uri, args.llm_latency))))
+        return
+
+    uri = seed_database(args.uri, args.customers, reseed=args.reseed)
+    results = {}
+    for name in args.scenarios:
+        results[name] = median_result([run_in_subprocess(name, uri, args.llm_latency) for _ in range(args.runs)])
+    reset_campaigns(uri)
+
+    baseline = json.loads(args.baseline.read_text()) if args.baseline.exists() else {}
+    print_results(results, baseline)
+    if args.output:
+        args.output.write_text(json.dumps(results, indent=2) + "\n")
+
+    if args.update_baseline:
+        args.baseline.parent.mkdir(parents=True, exist_ok=True)
+        args.baseline.write_text(json.dumps({**baseline, **results}, indent=2) + "\n")
+        print(f"Saved the baseline to {args.baseline}")
+        return
+
+    regressions = compare(results, baseline, args.tolerance)
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+"""
+Checkpoint write and read latency of src/ralph/checkpoint.py as the message history grows.
+
+Runs turns of the graph with a stub LLM on a thread seeded with a history of each size, on the
+backends of `open_checkpointer`, and times the calls the graph makes to the backend: the writes of
+each turn (checkpoints and pending writes) and the read of the thread's latest checkpoint at the
+start of the next one. Writes run in the background of the turn and can overlap, so their summed
+time can exceed the turn. Reads are timed through the thread cache of CachedCheckpointSaver, which
+only checks the latest checkpoint ID with the backend, and straight from the backend.
+
+    uv run python benchmarks/checkpoint_latency.py --sizes 100 1000 5000
+    uv run python benchmarks/checkpoint_latency.py --postgres-uri postgresql://postgres@localhost:5432/postgres
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+from fakes import FakeStreamingChatModel
+from graph_overhead import make_history
+from langchain_core.messages import HumanMessage
+from ralph.checkpoint import open_checkpointer
+from ralph.graph import build_graph
+
+
+def time_calls(saver, names: list[str], timings: list[float]) -> None:
+    """
+    Record the seconds spent in the given async methods of the backend in `timings`.
+    """
+    for name in names:
+        method = getattr(saver, name)
+
+        async def timed(*args, method=method, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await method(*args, **kwargs)
+            finally:
+                timings.append(time.perf_counter() - start)
+
+        setattr(saver, name, timed)
+
+
+async def measure(uri: str, size: int, turns: int) -> dict:
+    """
+    Returns:
+        The median milliseconds of a turn, of the writes of a turn, and of a read with and without the cache.
+    """
+    model = FakeStreamingChatModel(reply="Done.", first_token_delay=0, token_delay=0)
+    async with open_checkpointer(uri, keep_last=0) as checkpointer:
+        # A budget larger than any history measured, so no turn is summarised
+        graph = await build_graph(checkpointer=checkpointer, model=model, tools=[], token_budget=10**9)
+        config = {"configurable": {"thread_id": f"checkpoint-latency-{size}-{time.time_ns()}"}}
+        await graph.aupdate_state(config, {"messages": make_history(size)})
+
+        writes = []
+        time_calls(checkpointer.saver, ["aput", "aput_writes"], writes)
+        result = {"turn": [], "write": [], "cached read": [], "backend read": []}
+        for _ in range(turns):
+            writes.clear()
+            start = time.perf_counter()
+            await graph.ainvoke({"messages": [HumanMessage(content="And now?")]}, config)
+            result["turn"].append(time.perf_counter() - start)
+            result["write"].append(sum(writes))
+
+            start = time.perf_counter()
+            await checkpointer.aget_tuple(config)
+            result["cached read"].append(time.perf_counter() - start)
+            start = time.perf_counter()
+            await checkpointer.saver.aget_tuple(config)
+            result["backend read"].append(time.perf_counter() - start)
+
+        await checkpointer.adelete_thread(config["configurable"]["thread_id"])
+    return {name: statistics.median(timings) * 1000 for name, timings in result.items()}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure checkpoint latency as the history grows.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000], help="History sizes to measure.")
+    parser.add_argument("--turns", type=int, default=5, help="Turns measured per size.")
+    parser.add_argument("--postgres-uri", help="Also measure a Postgres backend, its checkpoint tables are created if missing.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        backends = {"sqlite": str(Path(directory) / "checkpoints.sqlite")}
+        if args.postgres_uri:
+            backends["postgres"] = args.postgres_uri
+
+        print(f"{'backend':<9} {'messages':>9} {'ms/turn':>9} {'writes ms':>10} {'cached read ms':>15} {'backend read ms':>16}")
+        for backend, uri in backends.items():
+            for size in args.sizes:
+                result = await measure(uri, size, args.turns)
+                print(
+                    f"{backend:<9} {size:>9,} {result['turn']:>9.2f} {result['write']:>10.2f}"
+                    f" {result['cached read']:>15.2f} {result['backend read']:>16.2f}"
+                )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+"""
+Customer profiles from get_customer_profiles against the raw SQL the agent used to run for them.
+
+Seeds the `ralph_benchmark` database like benchmarks/campaign_e2e.py, then fetches the profiles
+of growing numbers of customers three ways: with the per-customer queries Ralph ran through the
+`query` tool (customer, RFM scores, last purchase and top items), with the profile query of a
+cold CustomerProfileCache, and from a warm cache. The query send_templated_campaign_emails fetches
+its recipients with is timed too, and checked to give the same template variables as the profiles.
+Only database time is measured, the raw SQL path also costs an LLM round-trip per query in a real
+conversation.
+
+    uv run python benchmarks/customer_profiles.py --uri postgresql://postgres@localhost:5432/postgres
+    uv run python benchmarks/customer_profiles.py --uri ... --sizes 1 10 100 1000
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+from campaign_e2e import seed_database
+from sqlalchemy import event, text
+from ralph.my_mcp.servers.db import create_db_engine, create_session_factory
+from ralph.my_mcp.servers.profiles import CustomerProfileCache
+from ralph.my_mcp.servers.templates import customer_variables, fetch_recipients
+
+
+# The queries Ralph ran for each recipient before writing an email
+RAW_SQL = {
+    "customer": text('SELECT "Name", "Email", "Country" FROM customers WHERE "Customer ID" = :customer_id'),
+    "rfm": text('SELECT recency, frequency, monetary, "RFM_Score", "Segment" FROM rfm WHERE "Customer ID" = :customer_id'),
+    "last_purchase": text('SELECT MAX("InvoiceDate") AS last_purchase FROM transactions WHERE "Customer ID" = :customer_id'),
+    "top_items": text("""
+        SELECT t."StockCode", i."Description", SUM(t."TotalPrice") AS spend
+        FROM transactions t
+        LEFT JOIN items i ON i."StockCode" = t."StockCode"
+        WHERE t."Customer ID" = :customer_id
+        GROUP BY t."StockCode", i."Description"
+        ORDER BY spend DESC
+        LIMIT 3
+    """),
+}
+
+
+async def raw_profiles(session, customer_ids: list[int]) -> dict[int, dict]:
+    profiles = {}
+    for customer_id in customer_ids:
+        profile = {}
+        for name, query in RAW_SQL.items():
+            rows = (await session.execute(query, {"customer_id": customer_id})).mappings().all()
+            profile[name] = [dict(row) for row in rows]
+        profiles[customer_id] = profile
+    return profiles
+
+
+def matches(profile: dict, raw: dict) -> bool:
+    last_purchase = raw["last_purchase"][0]["last_purchase"]
+    return (
+        profile["segment"] == raw["rfm"][0]["Segment"]
+        and profile["last_purchase_date"] == (last_purchase.date().isoformat() if last_purchase else None)
+        and [round(item["spend"], 2) for item in profile["top_items"]] == [round(item["spend"], 2) for item in raw["top_items"]]
+    )
+
+
+async def measure(session_factory, fetch, runs: int, statements: list) -> tuple[float, int, object]:
+    """
+    Time `fetch(session)` over `runs` runs.
+
+    Returns:
+        The median seconds, the statements of one run and the result of the last run.
+    """
+    timings = []
+    for _ in range(runs):
+        async with session_factory() as session:
+            statements.clear()
+            start = time.perf_counter()
+            result = await fetch(session)
+            timings.append(time.perf_counter() - start)
+    return statistics.median(timings), len(statements), result
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare customer profiles with the raw per-customer SQL.")
+    parser.add_argument("--uri", required=True, help="Connection string of a local Postgres the benchmark database can be created on.")
+    parser.add_argument("--customers", type=int, default=13_000, help="Customers to seed the benchmark database with.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 100, 500], help="Numbers of customers to get profiles for.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--reseed", action="store_true", help="Recreate the benchmark database.")
+    args = parser.parse_args()
+
+    uri = seed_database(args.uri, args.customers, args.reseed)
+    engine = create_db_engine(uri)
+    session_factory = create_session_factory(engine)
+    statements = []
+    event.listen(engine.sync_engine, "before_cursor_execute", lambda *_: statements.append(1))
+    try:
+        async with session_factory() as session:
+            customer_ids = list((await session.execute(text('SELECT "Customer ID" FROM rfm'))).scalars())
+        random.seed(0)
+
+        print(f"{'customers':>9} {'raw SQL ms':>11} {'stmts':>6} {'cold ms':>9} {'stmts':>6} {'warm ms':>9} {'stmts':>6} {'speedup':>8} {'recipients ms':>14}  match")
+        for size in args.sizes:
+            sample = random.sample(customer_ids, min(size, len(customer_ids)))
+            cache = CustomerProfileCache()
+
+            async def cold(session):
+                cache.clear()
+                cache.versions = {}
+                return await cache.get(session, sample)
+
+            raw_s, raw_statements, raw = await measure(session_factory, lambda session: raw_profiles(session, sample), args.runs, statements)
+            cold_s, cold_statements, profiles = await measure(session_factory, cold, args.runs, statements)
+            warm_s, warm_statements, _ = await measure(session_factory, lambda session: cache.get(session, sample), args.runs, statements)
+            recipients_s, _, recipients = await measure(session_factory, lambda session: fetch_recipients(session, sample), args.runs, statements)
+            match = (
+                len(profiles) == len(sample) == len(recipients)
+                and all(matches(profile, raw[profile["customer_id"]]) for profile in profiles)
+                and all(customer_variables(profile, {}) == customer_variables(recipients[profile["customer_id"]], {}) for profile in profiles)
+            )
+            print(
+                f"{len(sample):>9,} {raw_s * 1000:>11.1f} {raw_statements:>6,} {cold_s * 1000:>9.1f} {cold_statements:>6}"
+                f" {warm_s * 1000:>9.2f} {warm_statements:>6} {raw_s / cold_s:>7.1f}x {recipients_s * 1000:>14.1f}  {'yes' if match else 'NO'}"
+            )
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
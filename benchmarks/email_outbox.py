@@ -0,0 +1,195 @@
+"""
+Throughput of the email outbox against a local SMTP stand-in.
+
+Seeds a scratch schema with customers spread over many domains and a campaign with pending
+emails, starts benchmarks/fake_smtp.py, then drains the outbox with src/ralph/my_mcp/servers/outbox.py
+once per number of SMTP connections, resetting the emails in between. The stand-in bounces and
+defers a share of the recipients, so the runs include bounces and retries. For comparison, a
+sample of the emails is also sent the way the tools would inline: one new connection per email,
+one email at a time. The public tables are only read, to copy their definitions and indexes, so
+run migration-email-outbox.sql first.
+
+    uv run python benchmarks/email_outbox.py --uri postgresql://postgres@localhost:5432/postgres
+    uv run python benchmarks/email_outbox.py --uri ... --emails 10000 --connections 8 --domain-rate 50
+    uv run python benchmarks/email_outbox.py --uri ... --emails 300 --domains 1 --domain-rate 50 --lease 2
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import os
+import subprocess
+import sys
+import time
+from uuid import UUID
+
+from dotenv import load_dotenv
+from sqlalchemy import event, text
+from ralph.my_mcp.servers.db import create_db_engine, create_session_factory
+from ralph.my_mcp.servers.outbox import OutboxEmail, OutboxWorker, SMTPConnectionPool, build_message
+import aiosmtplib
+
+
+SCHEMA = "outbox_benchmark"
+CAMPAIGN_ID = UUID("00000000-0000-0000-0000-000000000002")
+FROM_ADDRESS = "marketing@example.com"
+
+SEED_SQL = [
+    f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE",
+    f"CREATE SCHEMA {SCHEMA}",
+    f"CREATE TABLE {SCHEMA}.customers (LIKE public.customers INCLUDING ALL)",
+    f"CREATE TABLE {SCHEMA}.marketing_campaigns (LIKE public.marketing_campaigns INCLUDING ALL)",
+    f"CREATE TABLE {SCHEMA}.campaign_emails (LIKE public.campaign_emails INCLUDING ALL)",
+    f"""
+    INSERT INTO {SCHEMA}.customers ("Customer ID", "Country", "Name", "Email")
+    SELECT g, 'United Kingdom', 'Customer ' || g,
+           CASE WHEN g % 1000 = 0 THEN NULL ELSE 'customer' || g || '@domain' || g % :domains || '.example' END
+    FROM generate_series(1, :emails) g
+    """,
+    f"""
+    INSERT INTO {SCHEMA}.marketing_campaigns (id, name, type, description)
+    VALUES ('{CAMPAIGN_ID}', 'Benchmark loyalty', 'loyalty', 'Seeded by email_outbox.py')
+    """,
+    f"""
+    INSERT INTO {SCHEMA}.campaign_emails (campaign_id, customer_id, subject, body, status)
+    SELECT '{CAMPAIGN_ID}', "Customer ID", 'Thank you, ' || "Name",
+           '<p>Dear ' || "Name" || ',</p><p>Thank you for being one of our best customers.</p>' || repeat('<p>Our new arrivals are in.</p>', 20),
+           'pending'
+    FROM {SCHEMA}.customers
+    """,
+    f"ANALYZE {SCHEMA}.customers, {SCHEMA}.campaign_emails",
+]
+
+RESET_SQL = f"""
+UPDATE {SCHEMA}.campaign_emails
+SET status = 'pending', attempts = 0, next_attempt_at = now(), sent_at = NULL, last_error = NULL
+"""
+
+STATUS_SQL = f"SELECT status, count(*), sum(attempts) FROM {SCHEMA}.campaign_emails GROUP BY status"
+
+
+def start_smtp_server(port: int, bounce_rate: float, defer_rate: float, latency: float) -> subprocess.Popen:
+    process = subprocess.Popen(
+        [
+            sys.executable, str(Path(__file__).resolve().parent / "fake_smtp.py"), "--port", str(port),
+            "--bounce-rate", str(bounce_rate), "--defer-rate", str(defer_rate), "--latency", str(latency),
+        ],
+        stderr=subprocess.PIPE,
+        text=True,
+    )
+    line = process.stderr.readline()
+    if not line.startswith("Listening"):
+        process.kill()
+        raise RuntimeError(f"The SMTP stand-in did not start: {line}{process.stderr.read()}")
+    return process
+
+
+async def drain(session_factory, port: int, connections: int, args) -> tuple[float, dict]:
+    pool = SMTPConnectionPool(size=connections, hostname="127.0.0.1", port=port, start_tls=False, timeout=30)
+    worker = OutboxWorker(
+        session_factory,
+        pool,
+        FROM_ADDRESS,
+        batch_size=args.batch_size,
+        domain_rate=args.domain_rate,
+        domain_burst=args.domain_burst,
+        # Retries are due right away, so the drain ends with every email sent or bounced
+        retry_delay=0,
+        lease=args.lease,
+    )
+    start = time.perf_counter()
+    await worker.run(drain=True)
+    elapsed = time.perf_counter() - start
+
+    async with session_factory() as session:
+        statuses = {status: (count, attempts) for status, count, attempts in (await session.execute(text(STATUS_SQL))).all()}
+        await session.execute(text(RESET_SQL))
+        await session.commit()
+    return elapsed, statuses
+
+
+async def send_inline(session_factory, port: int, sample: int) -> float:
+    """
+    Send `sample` emails one by one, each over a new connection, as a tool sending inline would.
+    """
+    async with session_factory() as session:
+        rows = (await session.execute(text(f"""
+            SELECT e.id, e.subject, e.body, 0, c."Email"
+            FROM {SCHEMA}.campaign_emails e JOIN {SCHEMA}.customers c ON c."Customer ID" = e.customer_id
+            WHERE c."Email" IS NOT NULL
+            LIMIT :sample
+        """), {"sample": sample})).all()
+
+    start = time.perf_counter()
+    for row in rows:
+        try:
+            email = OutboxEmail(*row)
+            await aiosmtplib.send(
+                build_message(email, FROM_ADDRESS), sender=FROM_ADDRESS, recipients=[email.address],
+                hostname="127.0.0.1", port=port, start_tls=False,
+            )
+        except aiosmtplib.SMTPException:
+            pass
+    return time.perf_counter() - start
+
+
+async def main():
+    load_dotenv()
+    parser = argparse.ArgumentParser(description="Measure the delivery throughput of the email outbox.")
+    parser.add_argument("--uri", default=os.getenv("SUPABASE_URI"), help="Postgres connection string.")
+    parser.add_argument("--emails", type=int, default=100_000, help="Pending emails to seed.")
+    parser.add_argument("--domains", type=int, default=50, help="Recipient domains the customers are spread over.")
+    parser.add_argument("--connections", type=int, nargs="+", default=[1, 4, 8, 16], help="SMTP connection counts to run with.")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--domain-rate", type=float, default=0, help="Emails per second per domain, 0 for no limit.")
+    parser.add_argument("--domain-burst", type=int, default=20)
+    parser.add_argument("--lease", type=float, default=300.0, help="Seconds a claimed email is reserved, shorter than a domain's queue to check that leases are renewed.")
+    parser.add_argument("--bounce-rate", type=float, default=0.01)
+    parser.add_argument("--defer-rate", type=float, default=0.02)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the SMTP stand-in takes per email.")
+    parser.add_argument("--inline-sample", type=int, default=1000, help="Emails sent inline for comparison, 0 to skip.")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--keep", action="store_true", help=f"Keep the {SCHEMA} schema.")
+    args = parser.parse_args()
+
+    engine = create_db_engine(args.uri)
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def use_schema(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute(f"SET search_path TO {SCHEMA}")
+        cursor.close()
+
+    session_factory = create_session_factory(engine)
+    smtp = start_smtp_server(args.port, args.bounce_rate, args.defer_rate, args.latency)
+    try:
+        print(f"Seeding {args.emails:,} pending emails...", file=sys.stderr)
+        async with engine.begin() as conn:
+            for statement in SEED_SQL:
+                await conn.execute(text(statement), {"emails": args.emails, "domains": args.domains} if ":emails" in statement else {})
+
+        print(f"{'connections':>11} {'seconds':>9} {'emails/s':>9} {'sent':>8} {'bounced':>8} {'pending':>8} {'attempts':>9}")
+        for connections in args.connections:
+            elapsed, statuses = await drain(session_factory, args.port, connections, args)
+            count = lambda status: statuses.get(status, (0, 0))[0]
+            attempts = sum(attempts or 0 for _, attempts in statuses.values())
+            print(
+                f"{connections:>11} {elapsed:>9.2f} {args.emails / elapsed:>9,.0f} {count('sent'):>8,} {count('bounced'):>8,} "
+                f"{count('pending') + count('sending'):>8,} {attempts:>9,}"
+            )
+
+        if args.inline_sample:
+            elapsed = await send_inline(session_factory, args.port, args.inline_sample)
+            rate = args.inline_sample / elapsed
+            print(f"Inline, one connection per email: {rate:,.0f} emails/s, {args.emails / rate:,.0f} s for {args.emails:,} emails")
+    finally:
+        smtp.terminate()
+        print(smtp.communicate()[1].strip(), file=sys.stderr)
+        if not args.keep:
+            async with engine.begin() as conn:
+                await conn.execute(text(f"DROP SCHEMA IF EXISTS {SCHEMA} CASCADE"))
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,97 @@
+"""
+Throughput of campaign email rendering in ralph/my_mcp/servers/templates.py.
+
+Renders a typical HTML template for synthetic customer profiles and reports emails per
+second for the compiled, cached template, for compiling the template for every email, and
+for building the variables from the profiles. No database is needed.
+
+    uv run python benchmarks/email_rendering.py --emails 100000
+"""
+
+import argparse
+import random
+import time
+
+from ralph.my_mcp.servers.templates import EmailTemplate, compile_template, customer_variables, render_email
+
+
+SUBJECT = "{{ first_name | Hi there }}, we saved something for you 💌"
+
+BODY = """<html>
+<body style="font-family: Arial, sans-serif; color: #333;">
+  <p>Hi {{ first_name | there }},</p>
+  <p>It has been a while since you picked up your <strong>{{ last_item }}</strong> on {{ last_purchase_date }}.
+  We think you'd love our {{ recommendation | new arrivals }} too!</p>
+  <p>As one of our {{ segment }} customers in {{ country }}, here is 15% off your next order with code <strong>COMEBACK15</strong>.</p>
+  <p><a href="https://example.com/shop?utm_campaign=win-back" style="background: #e63946; color: #fff; padding: 10px 16px;">Shop now</a></p>
+  <p>Thanks for being part of our story,<br>The Team</p>
+</body>
+</html>"""
+
+ITEMS = ["WHITE HANGING HEART T-LIGHT HOLDER", "REGENCY CAKESTAND 3 TIER", "JUMBO BAG RED RETROSPOT",
+         "PARTY BUNTING", "LUNCH BAG RED RETROSPOT", "ASSORTED COLOUR BIRD ORNAMENT", "SET OF 3 CAKE TINS PANTRY DESIGN"]
+SEGMENTS = ["At Risk", "Champion", "Big Spender", "Frequent Buyer", "Recent Customer", "Others"]
+
+
+def make_profiles(count: int) -> list[dict]:
+    rng = random.Random(0)
+    profiles = []
+    for i in range(count):
+        top_items = [
+            {"description": item, "last_purchased": f"2011-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}"}
+            for item in rng.sample(ITEMS, 3)
+        ]
+        profiles.append({
+            "customer_id": i,
+            "name": f"Customer {i} O'Brien & Sons",
+            "email": f"customer{i}@example.com",
+            "country": "United Kingdom",
+            "segment": rng.choice(SEGMENTS),
+            "last_purchase_date": max(item["last_purchased"] for item in top_items),
+            "top_items": top_items,
+        })
+    return profiles
+
+
+def rate(count: int, seconds: float) -> str:
+    return f"{count / seconds:>12,.0f} emails/s   ({seconds * 1000:,.0f} ms)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark campaign email rendering.")
+    parser.add_argument("--emails", type=int, default=100_000, help="Number of emails to render.")
+    args = parser.parse_args()
+
+    profiles = make_profiles(args.emails)
+    best_sellers = {segment: ITEMS[::-1] for segment in SEGMENTS}
+
+    start = time.perf_counter()
+    variables = [customer_variables(profile, best_sellers) for profile in profiles]
+    variables_time = time.perf_counter() - start
+
+    subject, body = compile_template(SUBJECT), compile_template(BODY)
+    start = time.perf_counter()
+    emails = [render_email(subject, body, values) for values in variables]
+    cached_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for values in variables:
+        render_email(compile_template(SUBJECT), compile_template(BODY), values)
+    lookup_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for values in variables:
+        render_email(EmailTemplate(SUBJECT), EmailTemplate(BODY), values)
+    uncached_time = time.perf_counter() - start
+
+    print(f"Emails:                           {args.emails:,}")
+    print(f"Build variables from profiles:   {rate(args.emails, variables_time)}")
+    print(f"Render, compiled template:       {rate(args.emails, cached_time)}")
+    print(f"Render, cache lookup per email:  {rate(args.emails, lookup_time)}")
+    print(f"Render, compile per email:       {rate(args.emails, uncached_time)}")
+    print(f"Example subject: {emails[0][0]}")
+    print(f"Example body:\n{emails[0][1]}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""
+Load test of engagement ingestion, src/ralph/my_mcp/servers/engagement.py.
+
+Seeds the `ralph_benchmark` database like benchmarks/campaign_e2e.py, adds a campaign with
+delivered emails, then starts the tracking app with uvicorn in its own process and posts open
+and click events to POST /events at a fixed rate, in batches as an email provider's webhook
+would. Requests are sent on schedule whether or not earlier ones have been answered, so a server
+that falls behind shows as growing latency rather than a lower rate. Once the load stops, the
+rollups are polled until they count every email that got an accepted event, then checked against
+a full count of campaign_emails.
+
+    uv run python benchmarks/engagement_load.py --uri postgresql://postgres@localhost:5432/postgres
+    uv run python benchmarks/engagement_load.py --uri ... --rate 20000 --duration 60 --emails 500000
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import subprocess
+import sys
+import time
+from uuid import UUID
+
+from campaign_e2e import seed_database
+from sqlalchemy import text
+from ralph.my_mcp.servers.db import create_db_engine, create_session_factory
+from ralph.my_mcp.servers.performance import get_campaign_performance
+import httpx
+
+
+CAMPAIGN_ID = UUID("00000000-0000-0000-0000-000000000003")
+
+SEED_SQL = [
+    f"DELETE FROM marketing_campaigns WHERE id = '{CAMPAIGN_ID}'",
+    f"""
+    INSERT INTO marketing_campaigns (id, name, type, description)
+    VALUES ('{CAMPAIGN_ID}', 'Benchmark engagement', 'loyalty', 'Seeded by engagement_load.py')
+    """,
+    # Customers are emailed several times over when there are more emails than customers
+    f"""
+    INSERT INTO campaign_emails (campaign_id, customer_id, subject, body, status, sent_at)
+    SELECT '{CAMPAIGN_ID}', c."Customer ID", 'Thank you', '<p>Thank you</p>', 'sent', now()
+    FROM generate_series(0, :emails - 1) g
+    JOIN (SELECT "Customer ID", row_number() OVER (ORDER BY "Customer ID") - 1 AS n FROM customers) c
+      ON c.n = g % (SELECT count(*) FROM customers)
+    """,
+    "ANALYZE campaign_emails",
+]
+
+FULL_COUNT_SQL = text("""
+SELECT count(*) AS emails,
+       count(*) FILTER (WHERE status IN ('sent', 'opened', 'clicked')) AS delivered,
+       count(opened_at) AS opened,
+       count(clicked_at) AS clicked
+FROM campaign_emails
+WHERE campaign_id = :campaign_id
+""")
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+def start_tracking_app(uri: str, port: int) -> subprocess.Popen:
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "ralph.my_mcp.servers.engagement:app", "--port", str(port), "--log-level", "warning"],
+        env={**os.environ, "SUPABASE_URI": uri},
+    )
+
+
+async def wait_until_ready(client: httpx.AsyncClient, process: subprocess.Popen) -> None:
+    while True:
+        if process.poll() is not None:
+            raise RuntimeError(f"The tracking app exited with status {process.returncode}")
+        try:
+            await client.get("/metrics")
+            return
+        except httpx.TransportError:
+            await asyncio.sleep(0.1)
+
+
+async def post_events(client: httpx.AsyncClient, events: list[dict], load: dict) -> None:
+    start = time.perf_counter()
+    try:
+        response = await client.post("/events", json=events)
+        status = response.status_code
+    except httpx.TransportError:
+        status = 0
+    load["latencies"].append(time.perf_counter() - start)
+    if status != 200:
+        # A batch the server turned away is retried whole by a real sender, so none of it counts
+        load["errors"].append(status)
+        return
+    for event in events:
+        load["opened"].add(event["email_id"])
+        if event["type"] == "click":
+            load["clicked"].add(event["email_id"])
+
+
+async def generate_load(client: httpx.AsyncClient, email_ids: list[str], args) -> tuple[dict, float]:
+    """
+    Post batches of random events on a fixed schedule.
+
+    Returns:
+        The requests, their latencies and errors, the IDs of the emails opened and clicked, and the elapsed time.
+    """
+    interval = args.batch / args.rate
+    requests = int(args.duration / interval)
+    load = {"requests": requests, "latencies": [], "errors": [], "opened": set(), "clicked": set()}
+    tasks = []
+
+    start = time.perf_counter()
+    for i in range(requests):
+        delay = start + i * interval - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        now = time.time()
+        events = [
+            {"email_id": random.choice(email_ids), "type": "click" if random.random() < args.click_share else "open", "timestamp": now}
+            for _ in range(args.batch)
+        ]
+        tasks.append(asyncio.create_task(post_events(client, events, load)))
+    await asyncio.gather(*tasks)
+    return load, time.perf_counter() - start
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test engagement ingestion against a local Postgres.")
+    parser.add_argument("--uri", required=True, help="Connection string of a local Postgres the benchmark database can be created on.")
+    parser.add_argument("--customers", type=int, default=13_000, help="Customers to seed the benchmark database with.")
+    parser.add_argument("--emails", type=int, default=200_000, help="Delivered emails of the benchmark campaign.")
+    parser.add_argument("--rate", type=float, default=10_000, help="Events per second.")
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of load.")
+    parser.add_argument("--batch", type=int, default=100, help="Events per request.")
+    parser.add_argument("--click-share", type=float, default=0.2, help="Share of events that are clicks.")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--reseed", action="store_true", help="Recreate the benchmark database.")
+    args = parser.parse_args()
+
+    uri = seed_database(args.uri, args.customers, args.reseed)
+    engine = create_db_engine(uri)
+    session_factory = create_session_factory(engine)
+    server = None
+    try:
+        async with engine.begin() as conn:
+            for statement in SEED_SQL:
+                await conn.execute(text(statement), {"emails": args.emails} if ":emails" in statement else {})
+            email_ids = [str(email_id) for email_id in (await conn.execute(
+                text("SELECT id FROM campaign_emails WHERE campaign_id = :campaign_id"), {"campaign_id": CAMPAIGN_ID}
+            )).scalars()]
+
+        server = start_tracking_app(uri, args.port)
+        async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=httpx.Limits(max_connections=64), timeout=60) as client:
+            await wait_until_ready(client, server)
+            load, elapsed = await generate_load(client, email_ids, args)
+
+        # Time until the rollups count every email that got an accepted event. Requests turned away
+        # with a 503 may still have had some of their events buffered, so the rollups can count more.
+        stop = time.perf_counter()
+        async with session_factory() as session:
+            while True:
+                performance = await get_campaign_performance(session, CAMPAIGN_ID)
+                await session.commit()
+                if performance["opened"] >= len(load["opened"]) and performance["clicked"] >= len(load["clicked"]):
+                    break
+                if time.perf_counter() - stop > 60:
+                    break
+                await asyncio.sleep(0.05)
+            lag = time.perf_counter() - stop
+
+            start = time.perf_counter()
+            await get_campaign_performance(session, CAMPAIGN_ID)
+            rollup_ms = (time.perf_counter() - start) * 1000
+            start = time.perf_counter()
+            full = (await session.execute(FULL_COUNT_SQL, {"campaign_id": CAMPAIGN_ID})).mappings().one()
+            full_count_ms = (time.perf_counter() - start) * 1000
+
+        latencies = load["latencies"]
+        events = load["requests"] * args.batch
+        segment_opened = sum(segment["opened"] for segment in performance["segments"])
+        consistent = (
+            performance["opened"] == full["opened"] == segment_opened
+            and performance["clicked"] == full["clicked"]
+            and performance["delivered"] == full["delivered"]
+        )
+        caught_up = performance["opened"] >= len(load["opened"]) and performance["clicked"] >= len(load["clicked"])
+        print(f"Events:               {events:,} in {elapsed:.1f} s, {events / elapsed:,.0f}/s (target {args.rate:,.0f}/s)")
+        print(f"Requests:             {load['requests']:,} of {args.batch} events, {len(load['errors'])} failed")
+        print(f"Latency p50 / p99:    {statistics.median(latencies) * 1000:.1f} / {percentile(latencies, 0.99) * 1000:.1f} ms")
+        print(f"Rollups caught up:    {f'{lag * 1000:,.0f} ms after the last request' if caught_up else 'NO, events are missing'}")
+        print(f"Emails opened:        {performance['opened']:,} of {args.emails:,}, clicked {performance['clicked']:,}")
+        print(f"Rollups match counts: {'yes' if consistent else f'NO, full count {dict(full)}'}")
+        print(f"Report from rollups:  {rollup_ms:.1f} ms, full count of campaign_emails {full_count_ms:.1f} ms")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
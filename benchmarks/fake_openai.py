@@ -0,0 +1,146 @@
+"""
+Fake OpenAI-compatible chat completions endpoint for load tests.
+
+Streams a fixed reply and misbehaves on purpose: requests beyond `--capacity` in flight are
+rejected with 429, a share of the other requests is rejected at random, and a share is slow
+to send its first token.
+
+    uv run python benchmarks/fake_openai.py --port 8766 --capacity 32 --error-rate 0.05 --slow-rate 0.05
+
+Endpoints:
+    POST /v1/chat/completions    Chat completions, streamed or not.
+    GET  /stats                  Counts of requests, rejections and the most requests seen in flight.
+    POST /stats/reset            Reset the counts.
+"""
+
+import argparse
+import asyncio
+import json
+import random
+import time
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Route
+
+
+def create_app(
+        capacity: int = 32,
+        error_rate: float = 0.0,
+        slow_rate: float = 0.0,
+        slow_delay: float = 2.0,
+        first_token_delay: float = 0.2,
+        token_delay: float = 0.01,
+        tokens: int = 50
+        ) -> Starlette:
+    stats = {"requests": 0, "rejected_capacity": 0, "rejected_random": 0, "slow": 0, "completed": 0, "max_in_flight": 0}
+    state = {"in_flight": 0}
+    reply = ["token "] * tokens
+
+    def chunk(delta: dict, finish_reason=None) -> str:
+        return "data: " + json.dumps({
+            "id": "chatcmpl-fake",
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": "fake",
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }) + "\n\n"
+
+    def too_many_requests() -> JSONResponse:
+        return JSONResponse(
+            {"error": {"message": "Too many requests", "type": "rate_limit_error"}},
+            status_code=429,
+            headers={"retry-after": "0"},
+        )
+
+    async def chat_completions(request: Request):
+        body = await request.json()
+        stats["requests"] += 1
+        if state["in_flight"] >= capacity:
+            stats["rejected_capacity"] += 1
+            return too_many_requests()
+        if random.random() < error_rate:
+            stats["rejected_random"] += 1
+            return too_many_requests()
+
+        delay = first_token_delay
+        if random.random() < slow_rate:
+            stats["slow"] += 1
+            delay += slow_delay
+
+        state["in_flight"] += 1
+        stats["max_in_flight"] = max(stats["max_in_flight"], state["in_flight"])
+
+        if not body.get("stream"):
+            try:
+                await asyncio.sleep(delay + token_delay * len(reply))
+            finally:
+                state["in_flight"] -= 1
+            stats["completed"] += 1
+            return JSONResponse({
+                "id": "chatcmpl-fake",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": "fake",
+                "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(reply)}, "finish_reason": "stop"}],
+                "usage": {"prompt_tokens": 100, "completion_tokens": len(reply), "total_tokens": 100 + len(reply)},
+            })
+
+        async def events():
+            try:
+                await asyncio.sleep(delay)
+                yield chunk({"role": "assistant", "content": ""})
+                for token in reply:
+                    yield chunk({"content": token})
+                    await asyncio.sleep(token_delay)
+                yield chunk({}, finish_reason="stop")
+                yield "data: [DONE]\n\n"
+                stats["completed"] += 1
+            finally:
+                state["in_flight"] -= 1
+
+        return StreamingResponse(events(), media_type="text/event-stream")
+
+    async def get_stats(request: Request) -> JSONResponse:
+        return JSONResponse(stats)
+
+    async def reset_stats(request: Request) -> JSONResponse:
+        for key in stats:
+            stats[key] = 0
+        return JSONResponse(stats)
+
+    return Starlette(routes=[
+        Route("/v1/chat/completions", chat_completions, methods=["POST"]),
+        Route("/stats", get_stats, methods=["GET"]),
+        Route("/stats/reset", reset_stats, methods=["POST"]),
+    ])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake OpenAI-compatible endpoint that injects 429s and slow responses.")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--capacity", type=int, default=32, help="Requests in flight above which requests are rejected with 429.")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests rejected with 429 at random.")
+    parser.add_argument("--slow-rate", type=float, default=0.0, help="Share of requests slow to send their first token.")
+    parser.add_argument("--slow-delay", type=float, default=2.0, help="Extra seconds before the first token of a slow request.")
+    parser.add_argument("--first-token-delay", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.01)
+    parser.add_argument("--tokens", type=int, default=50)
+    args = parser.parse_args()
+
+    import uvicorn
+    app = create_app(
+        capacity=args.capacity,
+        error_rate=args.error_rate,
+        slow_rate=args.slow_rate,
+        slow_delay=args.slow_delay,
+        first_token_delay=args.first_token_delay,
+        token_delay=args.token_delay,
+        tokens=args.tokens,
+    )
+    uvicorn.run(app, host="127.0.0.1", port=args.port, log_level="warning")
+
+
+if __name__ == "__main__":
+    main()
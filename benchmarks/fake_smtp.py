@@ -0,0 +1,73 @@
+"""
+Local SMTP stand-in for the outbox, so deliveries can be tested without a mail provider.
+
+Accepts every email and keeps only a count, unless told to bounce or defer some recipients:
+bounced recipients get a 550 reply, deferred ones a 451 reply, as a real server would send for
+unknown mailboxes and greylisting.
+
+    uv run python benchmarks/fake_smtp.py --port 8025 --bounce-rate 0.01 --defer-rate 0.02
+"""
+
+from aiosmtpd.controller import Controller
+import argparse
+import asyncio
+import random
+import signal
+import sys
+
+
+class CountingHandler:
+    def __init__(self, bounce_rate: float = 0.0, defer_rate: float = 0.0, latency: float = 0.0):
+        self.bounce_rate = bounce_rate
+        self.defer_rate = defer_rate
+        self.latency = latency
+        self.received = 0
+        self.bounced = 0
+        self.deferred = 0
+
+    async def handle_RCPT(self, server, session, envelope, address, rcpt_options):
+        draw = random.random()
+        if draw < self.bounce_rate:
+            self.bounced += 1
+            return "550 5.1.1 Mailbox unavailable"
+        if draw < self.bounce_rate + self.defer_rate:
+            self.deferred += 1
+            return "451 4.7.1 Try again later"
+        envelope.rcpt_tos.append(address)
+        return "250 OK"
+
+    async def handle_DATA(self, server, session, envelope):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.received += len(envelope.rcpt_tos)
+        return "250 Message accepted for delivery"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local SMTP server that accepts and counts emails.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8025)
+    parser.add_argument("--bounce-rate", type=float, default=0.0, help="Share of recipients rejected with a 550.")
+    parser.add_argument("--defer-rate", type=float, default=0.0, help="Share of recipients rejected with a 451.")
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds to wait before accepting each email.")
+    args = parser.parse_args()
+
+    # Blocked before the server thread starts, so only sigwait receives them
+    signals = {signal.SIGINT, signal.SIGTERM}
+    signal.pthread_sigmask(signal.SIG_BLOCK, signals)
+    handler = CountingHandler(args.bounce_rate, args.defer_rate, args.latency)
+    controller = Controller(handler, hostname=args.host, port=args.port, server_hostname="fake-smtp.local")
+    controller.start()
+    print(f"Listening on {args.host}:{args.port}", file=sys.stderr, flush=True)
+    try:
+        signal.sigwait(signals)
+    finally:
+        controller.stop()
+        print(
+            f"Received {handler.received:,} emails, bounced {handler.bounced:,}, deferred {handler.deferred:,}",
+            file=sys.stderr,
+        )
+
+
+if __name__ == "__main__":
+    main()
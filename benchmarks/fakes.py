@@ -0,0 +1,114 @@
+"""
+Fakes shared by the benchmarks, so the agent can be run without the NVIDIA endpoint or MCP servers.
+"""
+
+from typing import Any, AsyncIterator, Iterator, List, Optional
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, ToolMessage
+from langchain_core.messages.utils import count_tokens_approximately
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from pydantic import PrivateAttr
+from ralph.streaming import message_text
+import asyncio
+import time
+
+
+class FakeStreamingChatModel(BaseChatModel):
+    """
+    Chat model that streams a fixed reply one token at a time, waiting `token_delay` seconds between tokens
+    and `first_token_delay` seconds before the first one, like a hosted model would.
+    """
+
+    reply: str = "Hi! I'm Ralph, your CRM marketing assistant. " * 8
+    first_token_delay: float = 0.2
+    token_delay: float = 0.01
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-streaming"
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        return self
+
+    def tokens(self) -> List[str]:
+        return [token + " " for token in self.reply.split()]
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.first_token_delay + self.token_delay * len(self.tokens()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self.tokens())))])
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.first_token_delay + self.token_delay * len(self.tokens()))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(self.tokens())))])
+
+    def _stream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> Iterator[ChatGenerationChunk]:
+        time.sleep(self.first_token_delay)
+        for token in self.tokens():
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            time.sleep(self.token_delay)
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        await asyncio.sleep(self.first_token_delay)
+        for token in self.tokens():
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(self.token_delay)
+
+
+def tool_results(messages: List[BaseMessage]) -> List[str]:
+    """
+    Get the results of the tool calls of the last AI message, in the order they were called.
+    A tool call answered with human feedback instead of being run gets the feedback as its result.
+    """
+    for i in range(len(messages) - 1, -1, -1):
+        if isinstance(messages[i], AIMessage):
+            answers = {message.tool_call_id: message_text(message.content) for message in messages[i + 1:] if isinstance(message, ToolMessage)}
+            return [answers.get(tool_call["id"], "") for tool_call in messages[i].tool_calls]
+    return []
+
+
+class ScriptedChatModel(BaseChatModel):
+    """
+    Chat model that plays a script, like a model that always makes the same decisions.
+
+    The script is a generator of AI messages. Whenever a message calls tools, the generator is
+    sent the results of those calls, so later steps can use IDs returned by earlier ones.
+    Each call waits `latency` seconds, and reports approximate token usage.
+    """
+
+    # A generator of AIMessage that is sent lists of tool results, kept as is by pydantic
+    script: Any
+    latency: float = 0.0
+    _started: bool = PrivateAttr(default=False)
+
+    @property
+    def _llm_type(self) -> str:
+        return "fake-scripted"
+
+    def bind_tools(self, tools: Any, **kwargs: Any):
+        return self
+
+    def next_message(self, messages: List[BaseMessage]) -> ChatResult:
+        message = self.script.send(tool_results(messages) if self._started else None)
+        self._started = True
+        input_tokens = count_tokens_approximately(messages)
+        output_tokens = count_tokens_approximately([message])
+        message = message.model_copy(update={"usage_metadata": {
+            "input_tokens": input_tokens,
+            "output_tokens": output_tokens,
+            "total_tokens": input_tokens + output_tokens,
+        }})
+        return ChatResult(generations=[ChatGeneration(message=message)])
+
+    def _generate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        time.sleep(self.latency)
+        return self.next_message(messages)
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        await asyncio.sleep(self.latency)
+        return self.next_message(messages)
@@ -0,0 +1,60 @@
+"""
+Micro-benchmark of the per-turn overhead of the graph as the message history grows.
+
+The LLM is a stub that answers instantly, so the time measured is spent in the graph
+itself: state validation, reducers, context preparation and checkpointing.
+
+    uv run python benchmarks/graph_overhead.py --sizes 10 100 1000 5000
+"""
+
+from langchain_core.messages import AIMessage, HumanMessage, ToolMessage
+from langgraph.checkpoint.memory import MemorySaver
+from ralph.graph import build_graph
+from fakes import FakeStreamingChatModel
+import argparse
+import asyncio
+import statistics
+import time
+
+
+def make_history(size: int) -> list:
+    """
+    A tool-heavy conversation: a question, then tool calls and their results.
+    """
+    messages = [HumanMessage(content="Analyse the At Risk segment.")]
+    i = 0
+    while len(messages) < size:
+        messages.append(AIMessage(content="", tool_calls=[{"id": f"call_{i}", "name": "query", "args": {"sql": "select 1"}}]))
+        messages.append(ToolMessage(content=f"[{{\"count\": {i}}}]", name="query", tool_call_id=f"call_{i}"))
+        i += 1
+    return messages[:size]
+
+
+async def measure(size: int, turns: int) -> float:
+    model = FakeStreamingChatModel(reply="Done.", first_token_delay=0, token_delay=0)
+    # A budget larger than any history measured, so no turn is summarised
+    graph = await build_graph(checkpointer=MemorySaver(), model=model, tools=[], token_budget=10**9)
+    config = {"configurable": {"thread_id": f"overhead-{size}"}}
+    await graph.aupdate_state(config, {"messages": make_history(size)})
+
+    timings = []
+    for _ in range(turns):
+        start = time.perf_counter()
+        await graph.ainvoke({"messages": [HumanMessage(content="And now?")]}, config)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Measure the per-turn overhead of the graph.")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000, 5000], help="History sizes to measure.")
+    parser.add_argument("--turns", type=int, default=5, help="Turns measured per size.")
+    args = parser.parse_args()
+
+    print(f"{'messages':>10} {'ms/turn':>10}")
+    for size in args.sizes:
+        print(f"{size:>10} {await measure(size, args.turns) * 1000:>10.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,100 @@
+"""
+Import time of the MCP config, the graph and frontend/chat_local.py, in fresh processes.
+
+Each module is imported in a new interpreter run with `python -X importtime`, a few times, and
+the median wall time of the import is reported along with the share of it spent importing
+ralph.my_mcp.config, as -X importtime counts it. The config itself is then loaded with
+`load_mcp_config`, or read from the module attribute in trees that resolved it on import. With
+--baseline, the same is measured on the tree of an earlier revision, extracted with git archive,
+to compare the config loaded on import with the lazily loaded one.
+
+    uv run python benchmarks/import_time.py
+    uv run python benchmarks/import_time.py --baseline 73b4286^ --runs 10
+"""
+
+from pathlib import Path
+import argparse
+import os
+import re
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+
+ROOT = Path(__file__).resolve().parent.parent
+TARGETS = ["ralph.my_mcp.config", "ralph.graph", "chat_local"]
+CONFIG_MODULE = "ralph.my_mcp.config"
+
+# Imports the module given as argument, then loads the MCP config, and prints both times in seconds
+CHILD = """
+import importlib, sys, time
+start = time.perf_counter()
+# -X importtime only logs imports made through __import__
+__import__(sys.argv[1])
+imported = time.perf_counter() - start
+module = sys.modules[sys.argv[1]]
+config = importlib.import_module("ralph.my_mcp.config")
+start = time.perf_counter()
+config.load_mcp_config() if hasattr(config, "load_mcp_config") else config.mcp_config
+print(imported, time.perf_counter() - start, module.__file__)
+"""
+
+IMPORTTIME_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \|\s*(\S+)")
+
+
+def measure(tree: Path, target: str) -> dict:
+    """
+    Import `target` in a fresh interpreter with the sources of `tree`.
+
+    Returns:
+        The seconds of the import, of the config module within it, and of loading the config afterwards.
+    """
+    env = {**os.environ, "PYTHONPATH": os.pathsep.join([str(tree / "src"), str(tree / "frontend")])}
+    process = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD, target],
+        cwd=tree, env=env, capture_output=True, text=True, check=True,
+    )
+    # Trees that load the config on import may print warnings before the times
+    imported, load_config, path = process.stdout.splitlines()[-1].split()
+    if not Path(path).resolve().is_relative_to(tree.resolve()):
+        raise RuntimeError(f"{target} was imported from {path}, not from {tree}")
+    config_us = next(int(cumulative) for cumulative, name in IMPORTTIME_LINE.findall(process.stderr) if name == CONFIG_MODULE)
+    return {"import": float(imported), "config module": config_us / 1e6, "load config": float(load_config)}
+
+
+def extract_revision(revision: str, directory: Path) -> Path:
+    archive = directory / "baseline.tar"
+    subprocess.run(["git", "archive", "--output", str(archive), revision], cwd=ROOT, check=True)
+    with tarfile.open(archive) as tar:
+        tar.extractall(directory / "baseline", filter="data")
+    return directory / "baseline"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the import time of the MCP config and the graph.")
+    parser.add_argument("--runs", type=int, default=5, help="Fresh processes per module.")
+    parser.add_argument("--baseline", help="Git revision to compare the working tree with.")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        trees = {"current": ROOT}
+        if args.baseline:
+            trees[args.baseline] = extract_revision(args.baseline, Path(directory))
+
+        print(f"{'tree':<10} {'module':<20} {'import ms':>10} {'config module ms':>17} {'load config ms':>15}")
+        for name, tree in trees.items():
+            for target in TARGETS:
+                # The first run fills the file cache and the bytecode caches, it isn't counted
+                measure(tree, target)
+                runs = [measure(tree, target) for _ in range(args.runs)]
+                median = {key: statistics.median(run[key] for run in runs) * 1000 for key in runs[0]}
+                print(
+                    f"{name:<10} {target:<20} {median['import']:>10.1f} {median['config module']:>17.1f}"
+                    f" {median['load config']:>15.2f}"
+                )
+
+
+if __name__ == "__main__":
+    main()
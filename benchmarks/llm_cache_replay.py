@@ -0,0 +1,164 @@
+"""
+Replay check of the LLM response cache in ralph/llm_cache.py, as used by the graph.
+
+Runs the same conversation through the graph several times with a fake LLM that counts its
+calls, and checks when the answers come from the cache: a replay in a new thread, after another
+process changed a CRM table, from the SQLite file after a restart and while the table versions
+can't be read. Each run must give the same replies. Two sessions are also interleaved, one
+answering while the other reads newer table versions, and the older answer must not be served
+at the newer versions. The cache counters must show on /metrics. Exits non-zero if any check fails.
+
+    uv run python benchmarks/llm_cache_replay.py
+"""
+
+from typing import Any, AsyncIterator, List, Optional
+import asyncio
+import sys
+import tempfile
+import time
+
+from fakes import FakeStreamingChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langgraph.checkpoint.memory import MemorySaver
+from pydantic import PrivateAttr
+from ralph.graph import build_graph
+from ralph.llm_cache import LLMCache
+from ralph.metrics import render_prometheus
+
+
+QUESTIONS = ["How many customers are champions?", "And how many are at risk?", "Thanks, that's all."]
+
+
+class CountingChatModel(FakeStreamingChatModel):
+    """
+    Fake model that answers with the question it was asked and counts its calls.
+    """
+
+    _calls: int = PrivateAttr(default=0)
+
+    def answer(self, messages: List[BaseMessage]) -> str:
+        self._calls += 1
+        return f"You asked: {messages[-1].content}"
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=self.answer(messages)))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        content = self.answer(messages)
+        chunk = ChatGenerationChunk(message=AIMessageChunk(content=content))
+        if run_manager:
+            await run_manager.on_llm_new_token(content, chunk=chunk)
+        yield chunk
+
+
+async def run_conversation(cache: LLMCache) -> tuple[int, list[str]]:
+    """
+    Returns:
+        The number of calls that reached the model, and the replies.
+    """
+    model = CountingChatModel(cache=cache)
+    graph = await build_graph(checkpointer=MemorySaver(), model=model, tools=[], llm_cache=cache)
+    config = {"configurable": {"thread_id": f"replay-{time.perf_counter_ns()}"}}
+    replies = []
+    for question in QUESTIONS:
+        state = await graph.ainvoke({"messages": [HumanMessage(content=question)]}, config)
+        replies.append(state["messages"][-1].content)
+    return model._calls, replies
+
+
+async def interleaved_sessions(change_data: bool) -> bool:
+    """
+    Session A looks up a prompt, then session B looks up another one, after changing the data or
+    not, and only then A stores its answer.
+
+    Returns:
+        Whether A's answer is served afterwards.
+    """
+    versions = {"rfm": 1}
+
+    async def read_versions() -> dict[str, int]:
+        return dict(versions)
+
+    cache = LLMCache(read_versions=read_versions)
+    a_looked_up, b_looked_up = asyncio.Event(), asyncio.Event()
+
+    async def session_a():
+        await cache.alookup("prompt of A", "model")
+        a_looked_up.set()
+        await b_looked_up.wait()
+        await cache.aupdate("prompt of A", "model", [ChatGeneration(message=AIMessage(content="Answer of A"))])
+
+    async def session_b():
+        await a_looked_up.wait()
+        if change_data:
+            versions["rfm"] += 1
+        await cache.alookup("prompt of B", "model")
+        b_looked_up.set()
+
+    await asyncio.gather(session_a(), session_b())
+    return await cache.alookup("prompt of A", "model") is not None
+
+
+async def main():
+    versions = {"customers": 1, "rfm": 1}
+    readable = True
+
+    async def read_versions() -> dict[str, int]:
+        if not readable:
+            raise ConnectionError("database unavailable")
+        return dict(versions)
+
+    with tempfile.NamedTemporaryFile(suffix=".sqlite") as file:
+        cache = LLMCache(path=file.name, read_versions=read_versions)
+        _, expected = await run_conversation(cache)
+
+        def change_data():
+            versions["rfm"] += 1
+
+        def restart():
+            nonlocal cache
+            cache = LLMCache(path=file.name, read_versions=read_versions)
+
+        def lose_database():
+            nonlocal readable
+            readable = False
+
+        # What happens before each replay, and the model calls expected
+        scenarios = [
+            ("replay in a new thread", None, 0),
+            ("rfm changed by another process", change_data, len(QUESTIONS)),
+            ("replay after the change", None, 0),
+            ("restart, from the SQLite file", restart, 0),
+            ("table versions unreadable", lose_database, len(QUESTIONS)),
+        ]
+        failed = 0
+        print(f"{'scenario':<32} {'model calls':>11} {'expected':>8}  result")
+        for name, before, expected_calls in scenarios:
+            if before:
+                before()
+            calls, replies = await run_conversation(cache)
+            ok = calls == expected_calls and replies == expected
+            failed += not ok
+            print(f"{name:<32} {calls:>11} {expected_calls:>8}  {'ok' if ok else f'FAILED, {replies}'}")
+
+    print()
+    for name, change_data, expected in [
+        ("interleaved, rfm changed", True, False),
+        ("interleaved, unchanged", False, True),
+    ]:
+        served = await interleaved_sessions(change_data)
+        ok = served == expected
+        failed += not ok
+        print(f"{name:<32} answer of A served: {'yes' if served else 'no'}, {'ok' if ok else 'FAILED'}")
+
+    metrics = render_prometheus()
+    exported = 'ralph_llm_cache_lookups_total{outcome="hit"}' in metrics and "ralph_llm_cache_entries" in metrics
+    failed += not exported
+    print(f"\nCache counters on /metrics: {'yes' if exported else 'NO'}, this cache: {cache.stats()}")
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,99 @@
+"""
+Check of hedged LLM calls in ralph/llm_client.py, as seen by a client of the graph.
+
+Runs the graph with a fake streaming LLM whose first request is slow to start, so the client
+sends a hedge, and streams the events as the server does. Each scenario checks that the text
+the client receives is exactly one reply, whichever request wins. Exits non-zero if any fails.
+
+    uv run python benchmarks/llm_hedging.py
+"""
+
+from typing import Any, AsyncIterator, List, Optional
+import asyncio
+import sys
+import time
+
+from fakes import FakeStreamingChatModel
+from langchain_core.messages import AIMessage, AIMessageChunk, BaseMessage, HumanMessage
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+from langgraph.checkpoint.memory import MemorySaver
+from pydantic import PrivateAttr
+from ralph.graph import build_graph
+from ralph.llm_client import LLMClient
+from ralph.streaming import TextDelta, graph_events
+
+
+HEDGE_AFTER = 0.1
+
+# The reply, the delay before its first token and the delay between its tokens, of the primary request and of the hedge
+SCENARIOS = {
+    # The hedge streams slowly, the primary starts while it is still streaming and wins
+    "primary starts during the hedge": [("Primary reply, streamed in full.", 0.3, 0.01), ("Hedge reply that is still streaming.", 0.05, 0.2)],
+    "hedge finishes first": [("Primary reply that never starts.", 5.0, 0.01), ("Hedge reply, returned whole.", 0.05, 0.01)],
+    "no hedge": [("Primary reply, before the hedge is due.", 0.01, 0.01)],
+}
+
+
+class HedgedChatModel(FakeStreamingChatModel):
+    """
+    Fake model that answers each request with the next of `calls`, the first being the primary request.
+    """
+
+    calls: List[Any]
+    _count: int = PrivateAttr(default=0)
+
+    def next_call(self) -> tuple[str, float, float]:
+        call = self.calls[min(self._count, len(self.calls) - 1)]
+        self._count += 1
+        return call
+
+    async def _agenerate(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> ChatResult:
+        reply, first_token_delay, token_delay = self.next_call()
+        tokens = [token + " " for token in reply.split()]
+        await asyncio.sleep(first_token_delay + token_delay * len(tokens))
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content="".join(tokens)))])
+
+    async def _astream(self, messages: List[BaseMessage], stop: Optional[List[str]] = None, run_manager=None, **kwargs: Any) -> AsyncIterator[ChatGenerationChunk]:
+        reply, first_token_delay, token_delay = self.next_call()
+        await asyncio.sleep(first_token_delay)
+        for token in (token + " " for token in reply.split()):
+            chunk = ChatGenerationChunk(message=AIMessageChunk(content=token))
+            if run_manager:
+                await run_manager.on_llm_new_token(token, chunk=chunk)
+            yield chunk
+            await asyncio.sleep(token_delay)
+
+
+async def run_scenario(calls: list) -> dict:
+    model = HedgedChatModel(calls=calls)
+    llm_client = LLMClient(max_retries=0, hedge_after=HEDGE_AFTER)
+    graph = await build_graph(checkpointer=MemorySaver(), model=model, tools=[], llm_client=llm_client)
+    config = {"configurable": {"thread_id": f"hedging-{time.perf_counter_ns()}"}}
+    graph_input = {"messages": [HumanMessage(content="Briefly introduce yourself.")]}
+
+    text = ""
+    async for event in graph_events(graph_input, graph, config=config):
+        if isinstance(event, TextDelta):
+            text += event.text
+    replies = {"".join(token + " " for token in reply.split()): name for (reply, _, _), name in zip(calls, ("primary", "hedge"))}
+    return {"text": text, "winner": replies.get(text), "stats": llm_client.stats}
+
+
+async def main():
+    failed = 0
+    print(f"{'scenario':<32} {'hedged':>6} {'winner':>8}  text received")
+    for name, calls in SCENARIOS.items():
+        result = await run_scenario(calls)
+        # The text is one whole reply, and the reply of the request the client says won
+        expected = "hedge" if result["stats"]["hedges_won"] else "primary"
+        ok = result["winner"] == expected
+        failed += not ok
+        outcome = "ok" if ok else f"FAILED, {result['text']!r}"
+        print(f"{name:<32} {result['stats']['hedged']:>6} {result['winner'] or '-':>8}  {outcome}")
+    if failed:
+        print(f"\n{failed} of {len(SCENARIOS)} scenarios received a reply other than the winning one")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
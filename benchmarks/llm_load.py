@@ -0,0 +1,118 @@
+"""
+Load test of the LLM client in ralph/llm_client.py against a fake OpenAI-compatible endpoint.
+
+Starts benchmarks/fake_openai.py in a separate process, with a limited capacity, random 429s
+and slow responses, then runs many graph turns at once with different client settings.
+Reports completed and failed turns, throughput, latency and the 429s the endpoint sent.
+
+    uv run python benchmarks/llm_load.py --sessions 200 --capacity 32 --error-rate 0.05 --slow-rate 0.05
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import subprocess
+import sys
+import time
+
+from langchain_core.messages import HumanMessage
+from langchain_openai import ChatOpenAI
+from langgraph.checkpoint.memory import MemorySaver
+from ralph.graph import build_graph
+from ralph.llm_client import LLMClient, get_http_client
+from ralph.streaming import TextDelta, graph_events
+import httpx
+
+
+# Client settings compared by the load test
+CLIENTS = {
+    "no retries": dict(max_retries=0, max_concurrency=100_000),
+    "retries": dict(max_retries=6, base_delay=0.2, max_concurrency=100_000),
+    "retries + adaptive": dict(max_retries=6, base_delay=0.2, max_concurrency=256),
+    "+ hedging": dict(max_retries=6, base_delay=0.2, max_concurrency=256, hedge_after=1.0),
+}
+
+
+async def run_turn(graph, session: int) -> dict:
+    config = {"configurable": {"thread_id": f"load-{session}-{time.perf_counter_ns()}"}}
+    graph_input = {"messages": [HumanMessage(content="Briefly introduce yourself.")]}
+    start = time.perf_counter()
+    first_token = None
+    try:
+        async for event in graph_events(graph_input, graph, config=config):
+            if first_token is None and isinstance(event, TextDelta):
+                first_token = time.perf_counter() - start
+    except Exception as e:
+        return {"ok": False, "error": type(e).__name__, "total": time.perf_counter() - start}
+    return {"ok": True, "ttft": first_token, "total": time.perf_counter() - start}
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else float("nan")
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test the LLM client against a fake endpoint.")
+    parser.add_argument("--sessions", type=int, default=200, help="Graph turns run at once.")
+    parser.add_argument("--port", type=int, default=8766)
+    parser.add_argument("--capacity", type=int, default=32, help="Requests the endpoint serves at once before sending 429.")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Share of requests rejected with 429 at random.")
+    parser.add_argument("--slow-rate", type=float, default=0.05, help="Share of requests slow to send their first token.")
+    parser.add_argument("--slow-delay", type=float, default=3.0)
+    parser.add_argument("--tokens", type=int, default=20, help="Tokens in each reply.")
+    parser.add_argument("--clients", nargs="+", default=list(CLIENTS), choices=list(CLIENTS))
+    args = parser.parse_args()
+
+    server = subprocess.Popen([
+        sys.executable, str(Path(__file__).resolve().parent / "fake_openai.py"),
+        "--port", str(args.port),
+        "--capacity", str(args.capacity),
+        "--error-rate", str(args.error_rate),
+        "--slow-rate", str(args.slow_rate),
+        "--slow-delay", str(args.slow_delay),
+        "--tokens", str(args.tokens),
+    ])
+    base_url = f"http://127.0.0.1:{args.port}"
+    try:
+        async with httpx.AsyncClient(base_url=base_url) as stats_client:
+            for _ in range(100):
+                try:
+                    await stats_client.get("/stats")
+                    break
+                except httpx.TransportError:
+                    await asyncio.sleep(0.1)
+
+            model = ChatOpenAI(
+                model="fake",
+                base_url=f"{base_url}/v1",
+                api_key="fake",
+                http_async_client=get_http_client(),
+                max_retries=0,
+            )
+
+            print(f"{'client':<20} {'ok':>5} {'failed':>7} {'turns/s':>8} {'p50 s':>6} {'p95 s':>6} {'TTFT p95':>9} {'429s':>6} {'hedged':>7}")
+            for name in args.clients:
+                llm_client = LLMClient(**CLIENTS[name])
+                graph = await build_graph(checkpointer=MemorySaver(), model=model, tools=[], llm_client=llm_client)
+                await stats_client.post("/stats/reset")
+
+                start = time.perf_counter()
+                results = await asyncio.gather(*(run_turn(graph, session) for session in range(args.sessions)))
+                elapsed = time.perf_counter() - start
+                stats = (await stats_client.get("/stats")).json()
+
+                ok = [result for result in results if result["ok"]]
+                print(
+                    f"{name:<20} {len(ok):>5} {len(results) - len(ok):>7} {len(ok) / elapsed:>8.1f}"
+                    f" {percentile([r['total'] for r in ok], 0.5):>6.2f} {percentile([r['total'] for r in ok], 0.95):>6.2f}"
+                    f" {percentile([r['ttft'] for r in ok if r['ttft'] is not None], 0.95):>9.2f}"
+                    f" {stats['rejected_capacity'] + stats['rejected_random']:>6} {llm_client.stats['hedged']:>7}"
+                )
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
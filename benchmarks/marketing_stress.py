@@ -0,0 +1,113 @@
+"""
+Stress test of the marketing MCP server's write tools against the shared connection pool.
+
+Seeds the `ralph_benchmark` database like benchmarks/campaign_e2e.py, then calls the
+create_campaign and send_campaign_email tools of src/ralph/my_mcp/servers/marketing_server.py
+directly, many at a time, as concurrent conversations would. Each level of concurrency runs a
+fixed number of calls of each tool and reports the throughput and the p50 and p99 latency.
+Calls beyond the pool size and overflow wait for a connection, which shows as latency.
+The campaigns created are deleted at the end, with their emails.
+
+    uv run python benchmarks/marketing_stress.py --uri postgresql://postgres@localhost:5432/postgres
+    uv run python benchmarks/marketing_stress.py --uri ... --concurrency 1 50 200 --pool-size 10 --statement-cache-size 0
+"""
+
+import argparse
+import asyncio
+import os
+import random
+import statistics
+import time
+
+from campaign_e2e import seed_database
+from sqlalchemy import text
+
+
+CAMPAIGN_NAME = "Benchmark stress"
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def run_calls(call, calls: int, concurrency: int) -> tuple[float, list[float], int]:
+    """
+    Run `call(i)` for i in range(calls), at most `concurrency` at a time.
+
+    Returns:
+        The elapsed seconds, the latency of each successful call and the number of failed calls.
+    """
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    errors = 0
+
+    async def timed(i: int):
+        nonlocal errors
+        async with semaphore:
+            start = time.perf_counter()
+            try:
+                await call(i)
+            except Exception:
+                errors += 1
+                return
+            latencies.append(time.perf_counter() - start)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(timed(i) for i in range(calls)))
+    return time.perf_counter() - start, latencies, errors
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Stress test create_campaign and send_campaign_email.")
+    parser.add_argument("--uri", required=True, help="Connection string of a local Postgres the benchmark database can be created on.")
+    parser.add_argument("--customers", type=int, default=13_000, help="Customers to seed the benchmark database with.")
+    parser.add_argument("--calls", type=int, default=1000, help="Calls of each tool per level of concurrency.")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 10, 50, 100], help="Calls in flight at once.")
+    parser.add_argument("--pool-size", type=int, help="DB_POOL_SIZE of the server, from the environment by default.")
+    parser.add_argument("--max-overflow", type=int, help="DB_MAX_OVERFLOW of the server, from the environment by default.")
+    parser.add_argument("--statement-cache-size", type=int, help="DB_STATEMENT_CACHE_SIZE of the server, from the environment by default.")
+    parser.add_argument("--reseed", action="store_true", help="Recreate the benchmark database.")
+    args = parser.parse_args()
+
+    # The server builds its engine when imported, from the environment
+    os.environ["SUPABASE_URI"] = seed_database(args.uri, args.customers, args.reseed)
+    for name, value in [("DB_POOL_SIZE", args.pool_size), ("DB_MAX_OVERFLOW", args.max_overflow), ("DB_STATEMENT_CACHE_SIZE", args.statement_cache_size)]:
+        if value is not None:
+            os.environ[name] = str(value)
+    from ralph.my_mcp.servers import marketing_server
+
+    try:
+        async with marketing_server.SessionLocal() as session:
+            customer_ids = list((await session.execute(text('SELECT "Customer ID" FROM customers'))).scalars())
+        random.seed(0)
+        campaign_ids = []
+
+        async def create_campaign(i: int):
+            campaign_ids.append(await marketing_server.create_campaign(CAMPAIGN_NAME, "loyalty", f"Call {i}"))
+
+        async def send_campaign_email(i: int):
+            await marketing_server.send_campaign_email(
+                campaign_ids[i % len(campaign_ids)], random.choice(customer_ids), "Thank you", f"<p>Thank you, email {i}</p>"
+            )
+
+        print(
+            f"Pool size {marketing_server.engine.pool.size()}, overflow {os.getenv('DB_MAX_OVERFLOW', '10')},"
+            f" {args.calls:,} calls of each tool per level"
+        )
+        print(f"{'tool':<20} {'concurrency':>11} {'calls/s':>9} {'p50 ms':>8} {'p99 ms':>8} {'errors':>7}")
+        for concurrency in args.concurrency:
+            for name, call in [("create_campaign", create_campaign), ("send_campaign_email", send_campaign_email)]:
+                elapsed, latencies, errors = await run_calls(call, args.calls, concurrency)
+                p50 = statistics.median(latencies) * 1000 if latencies else float("nan")
+                p99 = percentile(latencies, 0.99) * 1000 if latencies else float("nan")
+                print(f"{name:<20} {concurrency:>11} {len(latencies) / elapsed:>9,.0f} {p50:>8.1f} {p99:>8.1f} {errors:>7}")
+    finally:
+        async with marketing_server.SessionLocal() as session:
+            await session.execute(text("DELETE FROM marketing_campaigns WHERE name = :name"), {"name": CAMPAIGN_NAME})
+            await session.commit()
+        await marketing_server.engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,82 @@
+"""
+Startup of the MCP tools with a cold and a warm schema cache, src/ralph/my_mcp/registry.py.
+
+Seeds the `ralph_benchmark` database like benchmarks/campaign_e2e.py and uses the same servers:
+the query and marketing servers and the stub Slack server. Each run creates a new registry and
+times `get_tools`, first with an empty schema cache, which starts every server to read its tools,
+then with the cache the cold run wrote, which starts none. The first tool call of a warm run
+starts its server, so it is timed too, as is the same call on the running server.
+
+    uv run python benchmarks/mcp_startup.py --uri postgresql://postgres@localhost:5432/postgres
+    uv run python benchmarks/mcp_startup.py --uri ... --runs 10
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import statistics
+import tempfile
+import time
+
+from campaign_e2e import seed_database, server_connections
+from ralph.my_mcp.registry import MCPToolRegistry
+
+
+# A cheap call of the query server
+FIRST_CALL = ("describe_table", {"table": "customers"})
+
+
+async def measure(connections: dict, schema_cache_path: Path) -> dict:
+    """
+    Time one startup with the schema cache at `schema_cache_path`.
+
+    Returns:
+        The seconds of get_tools, of the first tool call and of a second call, and the servers running after get_tools.
+    """
+    registry = MCPToolRegistry(connections, schema_cache_path=schema_cache_path, health_check_interval=0)
+    try:
+        start = time.perf_counter()
+        tools = {tool.name: tool for tool in await registry.get_tools()}
+        get_tools = time.perf_counter() - start
+        servers = sum(server.alive for server in registry.servers.values())
+
+        name, arguments = FIRST_CALL
+        start = time.perf_counter()
+        await tools[name].ainvoke(arguments)
+        first_call = time.perf_counter() - start
+        start = time.perf_counter()
+        await tools[name].ainvoke(arguments)
+        second_call = time.perf_counter() - start
+    finally:
+        await registry.aclose()
+    return {"get_tools": get_tools, "first_call": first_call, "second_call": second_call, "servers": servers}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare MCP tool startup with a cold and a warm schema cache.")
+    parser.add_argument("--uri", required=True, help="Connection string of a local Postgres the benchmark database can be created on.")
+    parser.add_argument("--customers", type=int, default=13_000, help="Customers to seed the benchmark database with.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--reseed", action="store_true", help="Recreate the benchmark database.")
+    args = parser.parse_args()
+
+    uri = seed_database(args.uri, args.customers, args.reseed)
+    with tempfile.TemporaryDirectory() as directory:
+        connections = server_connections(uri, str(Path(directory) / "trace.jsonl"))
+        results = {"cold": [], "warm": []}
+        for run in range(args.runs):
+            schema_cache_path = Path(directory) / f"schemas-{run}.json"
+            results["cold"].append(await measure(connections, schema_cache_path))
+            results["warm"].append(await measure(connections, schema_cache_path))
+
+    print(f"{'schema cache':<13} {'get_tools ms':>13} {'servers started':>16} {'first call ms':>14} {'next call ms':>13}")
+    for name, runs in results.items():
+        median = {key: statistics.median(run[key] for run in runs) for key in runs[0]}
+        print(
+            f"{name:<13} {median['get_tools'] * 1000:>13.1f} {median['servers']:>16.0f}"
+            f" {median['first_call'] * 1000:>14.1f} {median['second_call'] * 1000:>13.1f}"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,90 @@
+"""
+Report the prompt tokens sent per assistant turn on a set of recorded conversations.
+
+Compares the system prompt with every section, the prompt built for the tools that are
+loaded when Slack is skipped, and the same prompt with the schema fetched on demand through
+`describe_table`. For the latter, the conversations are replayed with a `describe_table`
+call before the first query that reads each table.
+
+    uv run python benchmarks/prompt_tokens.py
+"""
+
+from pathlib import Path
+import argparse
+import json
+import re
+import statistics
+
+from langchain_core.messages import AIMessage, BaseMessage, SystemMessage, ToolMessage, convert_to_messages
+from langchain_core.messages.utils import count_tokens_approximately
+from ralph.prompts import DB_SCHEMA, MARKETING_TOOLS, build_system_prompt, ralph_system_prompt
+
+
+DEFAULT_CONVERSATIONS = Path(__file__).resolve().parent / "data" / "conversations.json"
+
+# The tools loaded when the Slack server is skipped
+TOOLS_WITHOUT_SLACK = ["query", "get_customer_profiles", *MARKETING_TOOLS]
+
+# The inline schema of each table, standing in for the output of describe_table
+TABLE_SCHEMAS = {
+    match.group(1): match.group(0)
+    for match in re.finditer(r"create (?:materialized view|table) public\.(\w+) \(.*?\n\)[^;]*;", DB_SCHEMA, re.S)
+}
+
+
+def with_describe_calls(messages: list[BaseMessage]) -> list[BaseMessage]:
+    """
+    Insert a describe_table call before the first query that reads each table.
+    """
+    described = set()
+    replayed = []
+    for message in messages:
+        if isinstance(message, AIMessage):
+            sql = " ".join(call["args"].get("sql", "") for call in message.tool_calls if call["name"] == "query")
+            tables = [table for table in TABLE_SCHEMAS if table not in described and re.search(rf"\b{table}\b", sql)]
+            for table in tables:
+                call_id = f"describe_{table}"
+                replayed.append(AIMessage(content="", tool_calls=[{"id": call_id, "name": "describe_table", "args": {"table": table}}]))
+                replayed.append(ToolMessage(content=TABLE_SCHEMAS[table], tool_call_id=call_id, name="describe_table"))
+                described.add(table)
+        replayed.append(message)
+    return replayed
+
+
+def turn_tokens(system_prompt: str, messages: list[BaseMessage]) -> list[int]:
+    """
+    Count the prompt tokens of every assistant turn, i.e. the system prompt and the history before each AI message.
+    """
+    return [
+        count_tokens_approximately([SystemMessage(content=system_prompt)] + messages[:i])
+        for i, message in enumerate(messages)
+        if isinstance(message, AIMessage)
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Report prompt tokens per turn on recorded conversations.")
+    parser.add_argument("--conversations", type=Path, default=DEFAULT_CONVERSATIONS, help="JSON file of recorded conversations.")
+    args = parser.parse_args()
+
+    conversations = json.loads(args.conversations.read_text())
+    variants = {
+        "all sections": (ralph_system_prompt, False),
+        "loaded tools": (build_system_prompt(TOOLS_WITHOUT_SLACK), False),
+        "describe_table": (build_system_prompt(TOOLS_WITHOUT_SLACK + ["describe_table"], inline_schema=False), True),
+    }
+
+    print(f"{'variant':<16} {'system':>7} {'turns':>6} {'mean/turn':>10} {'total':>8}")
+    for name, (system_prompt, describe) in variants.items():
+        tokens = []
+        for conversation in conversations:
+            messages = convert_to_messages(conversation["messages"])
+            if describe:
+                messages = with_describe_calls(messages)
+            tokens += turn_tokens(system_prompt, messages)
+        system_tokens = count_tokens_approximately([SystemMessage(content=system_prompt)])
+        print(f"{name:<16} {system_tokens:>7} {len(tokens):>6} {statistics.mean(tokens):>10,.0f} {sum(tokens):>8,}")
+
+
+if __name__ == "__main__":
+    main()
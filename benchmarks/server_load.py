@@ -0,0 +1,91 @@
+"""
+Load test for frontend/server.py.
+
+Starts the server in-process with a fake streaming LLM and no MCP tools, then opens
+many concurrent sessions that each send one message and read the streamed reply.
+Reports time to first token and token throughput.
+
+    uv run python benchmarks/server_load.py --sessions 200
+"""
+
+from pathlib import Path
+import argparse
+import asyncio
+import json
+import statistics
+import sys
+import time
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "frontend"))
+
+from fakes import FakeStreamingChatModel
+from langgraph.checkpoint.memory import MemorySaver
+from ralph.graph import build_graph
+from server import create_app
+import httpx
+import uvicorn
+
+
+async def run_session(client: httpx.AsyncClient, message: str) -> dict:
+    thread_id = (await client.post("/threads")).json()["thread_id"]
+
+    start = time.perf_counter()
+    first_token = None
+    tokens = 0
+    async with client.stream("POST", f"/threads/{thread_id}/messages", json={"content": message}) as response:
+        event = None
+        async for line in response.aiter_lines():
+            if line.startswith("event: "):
+                event = line[len("event: "):]
+            elif line.startswith("data: ") and event == "text":
+                if first_token is None:
+                    first_token = time.perf_counter() - start
+                tokens += len(json.loads(line[len("data: "):])["text"].split())
+            elif line.startswith("data: ") and event == "error":
+                raise RuntimeError(line)
+
+    return {"ttft": first_token, "total": time.perf_counter() - start, "tokens": tokens}
+
+
+def percentile(values: list[float], p: float) -> float:
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))]
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Load test the agent server with a fake LLM.")
+    parser.add_argument("--sessions", type=int, default=100, help="Number of concurrent sessions.")
+    parser.add_argument("--first-token-delay", type=float, default=0.2, help="Seconds the fake LLM takes to start replying.")
+    parser.add_argument("--token-delay", type=float, default=0.01, help="Seconds between tokens of the fake LLM.")
+    parser.add_argument("--port", type=int, default=8765)
+    args = parser.parse_args()
+
+    model = FakeStreamingChatModel(first_token_delay=args.first_token_delay, token_delay=args.token_delay)
+    graph = await build_graph(checkpointer=MemorySaver(), model=model, tools=[])
+
+    server = uvicorn.Server(uvicorn.Config(create_app(graph), port=args.port, log_level="warning"))
+    server_task = asyncio.create_task(server.serve())
+    while not server.started:
+        await asyncio.sleep(0.01)
+
+    limits = httpx.Limits(max_connections=args.sessions * 2)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{args.port}", limits=limits, timeout=300) as client:
+        start = time.perf_counter()
+        results = await asyncio.gather(*(run_session(client, "Briefly introduce yourself.") for _ in range(args.sessions)))
+        elapsed = time.perf_counter() - start
+
+    server.should_exit = True
+    await server_task
+
+    ttfts = [result["ttft"] for result in results]
+    tokens = sum(result["tokens"] for result in results)
+    print(f"Sessions:           {args.sessions}")
+    print(f"Wall time:          {elapsed:.2f} s")
+    print(f"Tokens/sec:         {tokens / elapsed:,.0f}")
+    print(f"TTFT median:        {statistics.median(ttfts) * 1000:.0f} ms")
+    print(f"TTFT p95:           {percentile(ttfts, 0.95) * 1000:.0f} ms")
+    print(f"Session time p95:   {percentile([result['total'] for result in results], 0.95) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
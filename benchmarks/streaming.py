@@ -0,0 +1,71 @@
+"""
+Benchmark of the streaming pipeline in ralph/streaming.py.
+
+Runs the graph with a fake streaming LLM and no MCP tools, and writes every event to
+/dev/null with a flush, as chat_local.py does with the terminal. Compares streaming every
+delta on its own with coalescing, reporting chunks/sec through the pipeline, the number of
+writes, time to first token and total time.
+
+    uv run python benchmarks/streaming.py --tokens 2000 --token-delay 0.001
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import statistics
+import time
+
+from fakes import FakeStreamingChatModel
+from langchain_core.messages import HumanMessage
+from langgraph.checkpoint.memory import MemorySaver
+from ralph.graph import build_graph
+from ralph.streaming import event_data, stream_graph_events
+
+
+async def measure(graph, max_delay: float, tokens: int, sink) -> dict:
+    config = {"configurable": {"thread_id": f"bench-{time.perf_counter_ns()}"}}
+    graph_input = {"messages": [HumanMessage(content="Briefly introduce yourself.")]}
+
+    start = time.perf_counter()
+    first_token = None
+    writes = 0
+    async for event in stream_graph_events(graph_input, graph, max_delay=max_delay, config=config):
+        if first_token is None:
+            first_token = time.perf_counter() - start
+        # Serialise and flush each event, like a server-sent event or a terminal print
+        sink.write(f"event: {event.event}\ndata: {json.dumps(event_data(event))}\n\n")
+        sink.flush()
+        writes += 1
+
+    total = time.perf_counter() - start
+    return {"ttft": first_token, "total": total, "writes": writes, "chunks_per_sec": tokens / total}
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Benchmark streaming with and without coalescing.")
+    parser.add_argument("--tokens", type=int, default=2000, help="Number of tokens in the reply.")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="Seconds between tokens of the fake LLM.")
+    parser.add_argument("--delays", type=float, nargs="+", default=[0.0, 0.01, 0.05], help="Coalescing windows to compare, in seconds.")
+    parser.add_argument("--runs", type=int, default=3)
+    args = parser.parse_args()
+
+    model = FakeStreamingChatModel(reply="token " * args.tokens, first_token_delay=0.0, token_delay=args.token_delay)
+    graph = await build_graph(checkpointer=MemorySaver(), model=model, tools=[], token_budget=10**9)
+
+    print(f"{'window':>8} {'chunks/s':>10} {'writes':>8} {'TTFT ms':>8} {'total ms':>9}")
+    with open(os.devnull, "w") as sink:
+        await measure(graph, 0.0, args.tokens, sink)  # warm up
+        for max_delay in args.delays:
+            results = [await measure(graph, max_delay, args.tokens, sink) for _ in range(args.runs)]
+            print(
+                f"{max_delay * 1000:>6.0f}ms"
+                f" {statistics.median(r['chunks_per_sec'] for r in results):>10,.0f}"
+                f" {statistics.median(r['writes'] for r in results):>8.0f}"
+                f" {statistics.median(r['ttft'] for r in results) * 1000:>8.1f}"
+                f" {statistics.median(r['total'] for r in results) * 1000:>9.0f}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,48 @@
+"""
+Stub of the Slack MCP server for benchmarks, so runs don't need a Slack workspace.
+
+Offers the Slack tools the agent uses, with the names and arguments of
+@modelcontextprotocol/server-slack, and keeps posted messages in memory.
+"""
+
+from mcp.server.fastmcp import FastMCP
+import json
+import time
+
+
+CHANNELS = [
+    {"id": "C0000000001", "name": "marketing", "is_channel": True, "num_members": 12},
+    {"id": "C0000000002", "name": "general", "is_channel": True, "num_members": 48},
+]
+
+messages: list[dict] = []
+
+mcp = FastMCP("slack")
+
+
+@mcp.tool()
+async def slack_list_channels(limit: int = 100, cursor: str | None = None) -> str:
+    """List public channels in the workspace.
+
+    Args:
+        limit: Maximum number of channels to return.
+        cursor: Pagination cursor for the next page of results.
+    """
+    return json.dumps({"ok": True, "channels": CHANNELS[:limit], "response_metadata": {"next_cursor": ""}})
+
+
+@mcp.tool()
+async def slack_post_message(channel_id: str, text: str) -> str:
+    """Post a new message to a Slack channel.
+
+    Args:
+        channel_id: The ID of the channel to post to.
+        text: The message text to post.
+    """
+    message = {"channel": channel_id, "text": text, "ts": f"{time.time():.6f}"}
+    messages.append(message)
+    return json.dumps({"ok": True, **message})
+
+
+if __name__ == "__main__":
+    mcp.run(transport="stdio")
@@ -0,0 +1,117 @@
+"""
+The tool executor node of ralph/tool_executor.py against LangGraph's prebuilt ToolNode.
+
+Both nodes run, as the only node of a graph on AgentState, the tool calls of the same AI
+message, with stub tools that sleep like MCP calls do, and the median time over a few runs is
+reported along with the number of error results, or "raised" when the exception of a tool failed
+the graph run.
+The scenarios cover the overhead per call, many slow calls at once, where the executor runs at
+most --max-concurrency of them at a time, a tool that hangs, which the executor stops after
+--timeout seconds, and a tool that fails.
+
+    uv run python benchmarks/tool_execution.py
+    uv run python benchmarks/tool_execution.py --calls 1 8 32 --max-concurrency 32
+"""
+
+import argparse
+import asyncio
+import statistics
+import time
+
+from langchain_core.messages import AIMessage
+from langchain_core.tools import StructuredTool
+from langgraph.graph import END, START, StateGraph
+from langgraph.prebuilt import ToolNode
+from ralph.graph import AgentState
+from ralph.tool_executor import make_tool_executor_node
+
+
+def make_tool(name: str, seconds: float, fail: bool = False) -> StructuredTool:
+    async def call(customer_id: int) -> str:
+        await asyncio.sleep(seconds)
+        if fail:
+            raise RuntimeError("The server returned an error")
+        return f"Customer {customer_id}"
+
+    return StructuredTool.from_function(coroutine=call, name=name, description=f"Sleeps {seconds} s.")
+
+
+TOOLS = [
+    make_tool("instant", 0),
+    make_tool("mcp_call", 0.2),
+    make_tool("hangs", 5.0),
+    make_tool("fails", 0.05, fail=True),
+]
+
+# The tool called by each scenario. The hanging scenario makes one call of the hanging tool among quick ones.
+SCENARIOS = {
+    "overhead, instant tool": "instant",
+    "200 ms MCP calls": "mcp_call",
+    "one call hangs": "hangs",
+    "failing tool": "fails",
+}
+
+
+def make_message(tool: str, calls: int) -> AIMessage:
+    names = [tool] if tool == "hangs" else [tool] * calls
+    if tool == "hangs":
+        names += ["mcp_call"] * (calls - 1)
+    return AIMessage(content="", tool_calls=[
+        {"id": f"call_{i}", "name": name, "args": {"customer_id": i}} for i, name in enumerate(names)
+    ])
+
+
+def single_node_graph(node):
+    builder = StateGraph(AgentState)
+    builder.add_node("tools", node)
+    builder.add_edge(START, "tools")
+    builder.add_edge("tools", END)
+    return builder.compile()
+
+
+async def measure(graph, message: AIMessage, runs: int) -> tuple[float, str]:
+    """
+    Returns:
+        The median seconds of running `graph` on `message` and the number of error results of the last run,
+        or "raised" if the run raised.
+    """
+    timings = []
+    errors = ""
+    for _ in range(runs):
+        start = time.perf_counter()
+        try:
+            state = await graph.ainvoke({"messages": [message]})
+            errors = str(sum(result.status == "error" for result in state["messages"][1:]))
+        except Exception:
+            errors = "raised"
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), errors
+
+
+async def main():
+    parser = argparse.ArgumentParser(description="Compare the tool executor node with ToolNode.")
+    parser.add_argument("--calls", type=int, nargs="+", default=[1, 5, 20], help="Tool calls per AI message.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-concurrency", type=int, default=16, help="Tool calls the executor runs at the same time.")
+    parser.add_argument("--timeout", type=float, default=1.0, help="Seconds the executor lets a tool call take.")
+    args = parser.parse_args()
+
+    tool_node = single_node_graph(ToolNode(TOOLS))
+    executor = single_node_graph(make_tool_executor_node(TOOLS, max_concurrency=args.max_concurrency, timeout=args.timeout))
+
+    print(f"{'scenario':<24} {'calls':>5} {'ToolNode ms':>12} {'errors':>7} {'executor ms':>12} {'errors':>7}")
+    for name, tool in SCENARIOS.items():
+        # The hanging tool is slow for every run, once is enough
+        runs = 1 if tool == "hangs" else args.runs
+        for calls in args.calls:
+            message = make_message(tool, calls)
+            tool_node_s, tool_node_errors = await measure(tool_node, message, runs)
+            executor_s, executor_errors = await measure(executor, message, runs)
+            print(
+                f"{name:<24} {calls:>5} {tool_node_s * 1000:>12.1f} {tool_node_errors:>7}"
+                f" {executor_s * 1000:>12.1f} {executor_errors:>7}"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,172 @@
+"""
+Benchmark the agent's typical queries against a seeded database.
+
+Each query is run with EXPLAIN (ANALYZE, BUFFERS) and the median execution time, the plan
+node types and the indexes used are saved to a JSON file. Run it before and after applying
+migration-indexes.sql and compare the two result files:
+
+    python benchmark_queries.py --output before.json
+    python benchmark_queries.py --output after.json
+    python benchmark_queries.py --compare before.json after.json
+"""
+
+import argparse
+import json
+import os
+import statistics
+import psycopg2
+from contextlib import closing
+from dotenv import load_dotenv
+
+
+# Representative queries, parameterised with a customer, segment and campaign picked from the database
+QUERIES = {
+    "customer_recent_transactions": """
+        SELECT * FROM transactions
+        WHERE "Customer ID" = %(customer_id)s AND "InvoiceDate" >= %(since)s
+        ORDER BY "InvoiceDate" DESC
+    """,
+    "customer_top_items": """
+        SELECT i."Description", SUM(t."TotalPrice") AS spend
+        FROM transactions t
+        JOIN items i ON i."StockCode" = t."StockCode"
+        WHERE t."Customer ID" = %(customer_id)s
+        GROUP BY i."Description"
+        ORDER BY spend DESC
+        LIMIT 5
+    """,
+    "item_buyers": """
+        SELECT DISTINCT t."Customer ID"
+        FROM transactions t
+        WHERE t."StockCode" = %(stock_code)s
+    """,
+    "segment_members": """
+        SELECT r."Customer ID", c."Name", c."Email", r.monetary
+        FROM rfm r
+        JOIN customers c ON c."Customer ID" = r."Customer ID"
+        WHERE r."Segment" = %(segment)s
+        ORDER BY r."Customer ID"
+        LIMIT 100
+    """,
+    "campaign_emails_for_campaign": """
+        SELECT * FROM campaign_emails WHERE campaign_id = %(campaign_id)s
+    """,
+    "customer_already_emailed": """
+        SELECT 1 FROM campaign_emails
+        WHERE campaign_id = %(campaign_id)s AND customer_id = %(customer_id)s
+    """,
+    "customer_summary_by_segment": """
+        SELECT * FROM customer_summary WHERE "Segment" = %(segment)s
+    """,
+}
+
+
+def pick_params(cur) -> dict:
+    """
+    Pick a busy customer, their most bought item, a common segment and any campaign to query with.
+    """
+    cur.execute("""
+        SELECT "Customer ID", max("InvoiceDate") - interval '90 days'
+        FROM transactions GROUP BY "Customer ID" ORDER BY count(*) DESC LIMIT 1
+    """)
+    customer_id, since = cur.fetchone()
+    cur.execute('SELECT "StockCode" FROM transactions WHERE "Customer ID" = %s LIMIT 1', (customer_id,))
+    stock_code = cur.fetchone()[0]
+    cur.execute('SELECT "Segment" FROM rfm GROUP BY "Segment" ORDER BY count(*) DESC LIMIT 1')
+    segment = cur.fetchone()[0]
+    cur.execute("SELECT id FROM marketing_campaigns LIMIT 1")
+    campaign = cur.fetchone()
+    return {
+        "customer_id": customer_id,
+        "since": since,
+        "stock_code": stock_code,
+        "segment": segment,
+        "campaign_id": campaign[0] if campaign else "00000000-0000-0000-0000-000000000000",
+    }
+
+
+def plan_summary(plan: dict) -> tuple[list[str], list[str]]:
+    """
+    Collect the node types and index names of a plan tree.
+    """
+    node_types, indexes = [], []
+    stack = [plan]
+    while stack:
+        node = stack.pop()
+        node_types.append(node["Node Type"])
+        if "Index Name" in node:
+            indexes.append(node["Index Name"])
+        stack.extend(node.get("Plans", []))
+    return node_types, sorted(set(indexes))
+
+
+def run_benchmark(conn, runs: int) -> dict:
+    results = {}
+    with conn.cursor() as cur:
+        params = pick_params(cur)
+        for name, query in QUERIES.items():
+            timings = []
+            try:
+                for _ in range(runs):
+                    cur.execute("EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) " + query, params)
+                    explain = cur.fetchone()[0][0]
+                    timings.append(explain["Execution Time"])
+            except psycopg2.Error as e:
+                conn.rollback()
+                results[name] = {"error": str(e).strip()}
+                print(f"  {name}: skipped ({str(e).strip().splitlines()[0]})")
+                continue
+
+            node_types, indexes = plan_summary(explain["Plan"])
+            results[name] = {
+                "median_ms": statistics.median(timings),
+                "min_ms": min(timings),
+                "node_types": node_types,
+                "indexes": indexes,
+                "plan": explain["Plan"],
+            }
+            print(f"  {name}: {results[name]['median_ms']:.3f} ms median, indexes: {', '.join(indexes) or 'none'}")
+    conn.rollback()
+    return results
+
+
+def compare(before_path: str, after_path: str) -> None:
+    with open(before_path) as f:
+        before = json.load(f)
+    with open(after_path) as f:
+        after = json.load(f)
+
+    print(f"{'query':<32} {'before ms':>10} {'after ms':>10} {'speedup':>8}")
+    for name in QUERIES:
+        b, a = before.get(name, {}), after.get(name, {})
+        if "median_ms" not in b or "median_ms" not in a:
+            print(f"{name:<32} {'-':>10} {'-':>10} {'-':>8}")
+            continue
+        print(f"{name:<32} {b['median_ms']:>10.3f} {a['median_ms']:>10.3f} {b['median_ms'] / max(a['median_ms'], 1e-9):>7.1f}x")
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Benchmark the agent's typical queries.")
+    parser.add_argument("--uri", default=None, help="Database to benchmark, defaults to SUPABASE_URI.")
+    parser.add_argument("--runs", type=int, default=5, help="Number of times each query is run.")
+    parser.add_argument("--output", default="query_benchmark.json", help="File the results are written to.")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="Compare two result files instead of running.")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    print("Benchmarking queries...")
+    with closing(psycopg2.connect(args.uri or os.getenv("SUPABASE_URI"))) as conn:
+        results = run_benchmark(conn, args.runs)
+
+    with open(args.output, "w") as f:
+        json.dump(results, f, indent=2, default=str)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
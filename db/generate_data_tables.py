@@ -1,7 +1,130 @@
+import argparse
+import csv
+import io
+import os
+import numpy as np
 import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
 from faker import Faker
 import random
-from datetime import datetime
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import closing, contextmanager
+from functools import lru_cache
+from types import SimpleNamespace
+
+
+# Columns and types of the raw Online Retail II export
+RAW_DTYPES = {
+    'Invoice': str,
+    'StockCode': str,
+    'Description': str,
+    'Quantity': 'int64',
+    'InvoiceDate': str,
+    'Price': 'float64',
+    'Customer ID': 'float64',
+    'Country': str,
+}
+
+# Date the recency of each customer is measured against
+RFM_REFERENCE_DATE = pd.Timestamp("2012-01-01")
+
+# Set locale based on country for more realistic names
+COUNTRY_LOCALES = {
+    'United Kingdom': 'en_GB',
+    'France': 'fr_FR',
+    'Germany': 'de_DE',
+    'Spain': 'es_ES',
+    'Netherlands': 'nl_NL',
+    'Norway': 'no_NO',
+    'Switzerland': 'de_CH',
+    'Poland': 'pl_PL',
+    'Australia': 'en_AU',
+    'EIRE': 'en_GB',  # Ireland, use UK locale
+}
+
+EMAIL_DOMAINS = ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'company.com']
+
+# Primary keys of the tables in migration-create-tables.sql, used to upsert on load
+TABLE_KEYS = {
+    'customers': ['Customer ID'],
+    'items': ['StockCode'],
+    'transactions': ['Invoice', 'StockCode'],
+    'rfm': ['Customer ID'],
+}
+
+# Rows sent per COPY call when loading a DataFrame
+LOAD_BATCH_ROWS = 100_000
+
+
+class StageReport:
+    """
+    Reports the duration, throughput and peak memory of each pipeline stage when benchmarking is enabled.
+    """
+
+    def __init__(self, enabled: bool = False):
+        self.enabled = enabled
+        if enabled:
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name: str, rows: int = 0):
+        """
+        Time a stage. The number of rows can also be set on the yielded object
+        when it is only known once the stage has run.
+        """
+        stats = SimpleNamespace(rows=rows)
+        if not self.enabled:
+            yield stats
+            return
+
+        tracemalloc.reset_peak()
+        start = time.perf_counter()
+        yield stats
+        elapsed = time.perf_counter() - start
+        _, peak = tracemalloc.get_traced_memory()
+        print(f"  [{name}] {stats.rows:,} rows in {elapsed:.2f}s "
+              f"({stats.rows / max(elapsed, 1e-9):,.0f} rows/sec, peak memory {peak / 1e6:,.1f} MB)")
+
+
+def read_raw_data(path: str, chunksize: int | None = None):
+    """
+    Read the raw export, only parsing the columns the pipeline needs.
+    Returns an iterator of DataFrames when `chunksize` is set.
+    """
+    return pd.read_csv(path, usecols=list(RAW_DTYPES), dtype=RAW_DTYPES, chunksize=chunksize)
+
+
+def parse_invoice_dates(dates: pd.Series) -> pd.Series:
+    # The ISO fast path covers the standard export, other formats fall back to per-value parsing
+    try:
+        return pd.to_datetime(dates, format="ISO8601")
+    except ValueError:
+        return pd.to_datetime(dates, format="mixed")
+
+
+def clean_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Remove cancelled invoices and incomplete rows, add features and cast correct types.
+    Expects duplicates to already be removed.
+    """
+    # remove cancelled invoices
+    df_clean = df[~df['Invoice'].str.startswith(('C', 'A'))]
+
+    # remove NaNs
+    df_clean = df_clean.dropna(subset=['Invoice', 'StockCode', 'InvoiceDate', 'Price', 'Customer ID'], how='any')
+
+    # add features
+    df_clean = df_clean.assign(
+        TotalPrice=(df_clean['Quantity'] * df_clean['Price']).round(2),
+        InvoiceDate=parse_invoice_dates(df_clean['InvoiceDate']),
+        **{'Customer ID': df_clean['Customer ID'].astype(int)},
+        Quantity=df_clean['Quantity'].astype(int),
+    )
+
+    return df_clean
 
 
 def preprocess_data(df):
@@ -9,60 +132,44 @@ def preprocess_data(df):
     # remove duplicates
     df_clean = df.drop_duplicates(['Invoice', 'StockCode'])
 
-    # remove cancelled invoices
-    df_clean = df_clean[~df_clean['Invoice'].str.startswith('C')]
-    df_clean = df_clean[~df_clean['Invoice'].str.startswith('A')]
-
-    # remove NaNs
-    df_clean.dropna(subset=['Invoice', 'StockCode', 'InvoiceDate', 'Price', 'Customer ID'], how='any', inplace=True)
-
-    # add features
-    df_clean['TotalPrice'] = round(df_clean['Quantity'] * df_clean['Price'], 2)
+    return clean_rows(df_clean)
 
-    # cast correct types
-    df_clean['InvoiceDate'] = pd.to_datetime(df_clean['InvoiceDate'], format="mixed")
-    df_clean['Customer ID'] = df_clean['Customer ID'].astype(int)
-    df_clean['Quantity'] = df_clean['Quantity'].astype(int)
 
-    return df_clean
+@lru_cache(maxsize=None)
+def get_faker(locale: str) -> Faker:
+    return Faker(locale)
 
 
 # Function to generate fake data based on country
 def generate_fake_customer_data(customer_id, country):
     # Use customer ID as seed for consistent fake data
-    fake = Faker()
-    Faker.seed(int(customer_id))
-    random.seed(int(customer_id))
-
-    # Set locale based on country for more realistic names
-    country_locales = {
-        'United Kingdom': 'en_GB',
-        'France': 'fr_FR',
-        'Germany': 'de_DE',
-        'Spain': 'es_ES',
-        'Netherlands': 'nl_NL',
-        'Norway': 'no_NO',
-        'Switzerland': 'de_CH',
-        'Poland': 'pl_PL',
-        'Australia': 'en_AU',
-        'EIRE': 'en_GB',  # Ireland, use UK locale
-    }
-
-    locale = country_locales.get(country, 'en_US')  # Default to US English
-    fake = Faker(locale)
+    fake = get_faker(COUNTRY_LOCALES.get(country, 'en_US'))  # Default to US English
     Faker.seed(int(customer_id))
 
     # Generate fake name and email
     name = fake.name()
     # Create email from name (more realistic than random email)
     email_name = name.lower().replace(' ', '.').replace("'", "")
-    email_domains = ['gmail.com', 'yahoo.com', 'hotmail.com', 'outlook.com', 'company.com']
-    email_domain = random.choice(email_domains)
+    email_domain = random.Random(int(customer_id)).choice(EMAIL_DOMAINS)
     email = f"{email_name}@{email_domain}"
 
     return name, email
 
 
+def generate_customer_names(customers: pd.DataFrame) -> pd.DataFrame:
+    """
+    Add fake names and emails to the customers table.
+    """
+    fake_data = [
+        generate_fake_customer_data(customer_id, country)
+        for customer_id, country in zip(customers['Customer ID'].to_numpy(), customers['Country'].to_numpy())
+    ]
+    return customers.assign(
+        Name=[name for name, _ in fake_data],
+        Email=[email for _, email in fake_data]
+    )
+
+
 def generate_core_tables(df_clean):
     print("Generating core tables...")
     transaction_cols = ['Invoice', 'InvoiceDate', 'StockCode', 'Quantity', 'Price', 'TotalPrice', 'Customer ID']
@@ -75,25 +182,41 @@ def generate_core_tables(df_clean):
     customers = df_clean[['Customer ID', 'Country']].drop_duplicates(subset=['Customer ID'])
 
     # Generate fake names and emails for each customer
-    customers[['Name', 'Email']] = customers.apply(
-        lambda row: generate_fake_customer_data(row['Customer ID'], row['Country']),
-        axis=1,
-        result_type='expand'
-    )
+    customers = generate_customer_names(customers)
 
     return transactions, items, customers
 
 
-def generate_rfm(transactions):
-    print("Generating RFM table...")
-    rfm = transactions.groupby('Customer ID').agg({
-        'InvoiceDate': lambda x: (pd.to_datetime("2012-01-01") - x.max()).days,  # Recency
-        'Customer ID': 'count',  # Frequency
-        'TotalPrice': 'sum'  # Monetary
-    }).rename(columns={
-        'InvoiceDate': 'recency',
-        'Customer ID': 'frequency',
-        'TotalPrice': 'monetary'
+def aggregate_rfm(transactions: pd.DataFrame) -> pd.DataFrame:
+    """
+    Aggregate the last purchase date, number of purchases and total spend of each customer.
+    """
+    return transactions.groupby('Customer ID').agg(
+        last_purchase=('InvoiceDate', 'max'),
+        frequency=('InvoiceDate', 'size'),
+        monetary=('TotalPrice', 'sum'),
+    )
+
+
+def merge_rfm_aggregates(partials: list[pd.DataFrame]) -> pd.DataFrame:
+    """
+    Combine partial RFM aggregates, e.g. from separate chunks or from new transactions, into one row per customer.
+    """
+    return pd.concat(partials).groupby(level=0).agg(
+        last_purchase=('last_purchase', 'max'),
+        frequency=('frequency', 'sum'),
+        monetary=('monetary', 'sum'),
+    )
+
+
+def score_rfm(aggregates: pd.DataFrame, reference_date: pd.Timestamp = RFM_REFERENCE_DATE) -> pd.DataFrame:
+    """
+    Score recency, frequency and monetary value into quintiles and assign segments.
+    """
+    rfm = pd.DataFrame({
+        'recency': (reference_date - aggregates['last_purchase']).dt.days,
+        'frequency': aggregates['frequency'],
+        'monetary': aggregates['monetary'],
     })
 
     # Score each R, F, M column (1=worst, 5=best)
@@ -101,31 +224,32 @@ def generate_rfm(transactions):
     rfm['F'] = pd.qcut(rfm['frequency'].rank(method='first'), 5, labels=[1,2,3,4,5]).astype(int)
     rfm['M'] = pd.qcut(rfm['monetary'], 5, labels=[1,2,3,4,5]).astype(int)
 
-    rfm['RFM_Score'] = rfm['R'].astype(str) + rfm['F'].astype(str) + rfm['M'].astype(str)
-
-    def assign_segment(score):
-        if score == '555':
-            return 'Champion'
-        elif score[0] == '5':
-            return 'Recent Customer'
-        elif score[1] == '5':
-            return 'Frequent Buyer'
-        elif score[2] == '5':
-            return 'Big Spender'
-        elif score[0] == '1':
-            return 'At Risk'
-        else:
-            return 'Others'
-
-    rfm['Segment'] = rfm['RFM_Score'].apply(assign_segment)
+    rfm['RFM_Score'] = rfm['R'] * 100 + rfm['F'] * 10 + rfm['M']
+
+    rfm['Segment'] = np.select(
+        [
+            rfm['RFM_Score'] == 555,
+            rfm['R'] == 5,
+            rfm['F'] == 5,
+            rfm['M'] == 5,
+            rfm['R'] == 1,
+        ],
+        ['Champion', 'Recent Customer', 'Frequent Buyer', 'Big Spender', 'At Risk'],
+        default='Others'
+    )
 
     return rfm
 
 
+def generate_rfm(transactions):
+    print("Generating RFM table...")
+    return score_rfm(aggregate_rfm(transactions))
+
+
 def sample_data(
-        customers: pd.DataFrame, 
-        transactions: pd.DataFrame, 
-        items: pd.DataFrame, 
+        customers: pd.DataFrame,
+        transactions: pd.DataFrame,
+        items: pd.DataFrame,
         rfm: pd.DataFrame,
         sample_size: int = 100):
     print("Sampling data...")
@@ -137,28 +261,252 @@ def sample_data(
     return sampled_transactions, sampled_items, sampled_customers, sampled_rfm
 
 
-def export_data(transactions: pd.DataFrame, items: pd.DataFrame, customers: pd.DataFrame, rfm: pd.DataFrame):
+def export_data(transactions: pd.DataFrame, items: pd.DataFrame, customers: pd.DataFrame, rfm: pd.DataFrame, output_dir: str = "data"):
     print("Exporting data...")
-    transactions.to_csv("data/transactions.csv", index=False)
-    items.to_csv("data/items.csv", index=False)
-    customers.to_csv("data/customers.csv", index=False)
-    rfm.reset_index().to_csv("data/rfm.csv", index=False)
+    transactions.to_csv(f"{output_dir}/transactions.csv", index=False)
+    items.to_csv(f"{output_dir}/items.csv", index=False)
+    customers.to_csv(f"{output_dir}/customers.csv", index=False)
+    rfm.reset_index().to_csv(f"{output_dir}/rfm.csv", index=False)
+
+
+def quote(identifier: str) -> str:
+    return '"' + identifier.replace('"', '""') + '"'
+
+
+def table_columns(source: pd.DataFrame | str) -> list[str]:
+    """
+    Get the column names of a DataFrame or of a CSV file's header.
+    """
+    if isinstance(source, pd.DataFrame):
+        return list(source.columns)
+    with open(source, newline='') as f:
+        return next(csv.reader(f))
+
+
+def copy_into(cur, table: str, columns: list[str], source: pd.DataFrame | str) -> int:
+    """
+    Stream a DataFrame or CSV file into a table with COPY FROM STDIN.
+    CSV files are sent as is, DataFrames are serialised in batches to bound memory.
+
+    Returns:
+        The number of rows copied.
+    """
+    copy_sql = f"COPY {table} ({', '.join(map(quote, columns))}) FROM STDIN WITH (FORMAT csv"
+
+    if isinstance(source, str):
+        with open(source, newline='') as f:
+            cur.copy_expert(copy_sql + ", HEADER true)", f)
+        return cur.rowcount
+
+    rows = 0
+    for start in range(0, len(source), LOAD_BATCH_ROWS):
+        buffer = io.StringIO()
+        source.iloc[start:start + LOAD_BATCH_ROWS].to_csv(buffer, header=False, index=False)
+        buffer.seek(0)
+        cur.copy_expert(copy_sql + ")", buffer)
+        rows += cur.rowcount
+    return rows
+
+
+def load_table(uri: str, table: str, source: pd.DataFrame | str, upsert: bool = False) -> tuple[int, float]:
+    """
+    Load a table in a single transaction.
+
+    With `upsert`, rows are copied into a temporary staging table first and then merged,
+    updating rows whose primary key already exists. Otherwise rows are copied straight
+    into the table and any duplicate key fails the load.
+
+    Returns:
+        The number of rows loaded and the number of seconds it took.
+    """
+    start = time.perf_counter()
+    columns = table_columns(source)
+
+    with closing(psycopg2.connect(uri)) as conn, conn, conn.cursor() as cur:
+        if not upsert:
+            rows = copy_into(cur, table, columns, source)
+        else:
+            cur.execute(f"CREATE TEMP TABLE staging (LIKE {table} INCLUDING DEFAULTS) ON COMMIT DROP")
+            rows = copy_into(cur, "staging", columns, source)
+
+            column_list = ", ".join(map(quote, columns))
+            keys = TABLE_KEYS[table]
+            updates = ", ".join(f"{quote(column)} = EXCLUDED.{quote(column)}" for column in columns if column not in keys)
+            cur.execute(
+                f"INSERT INTO {table} ({column_list}) SELECT {column_list} FROM staging "
+                f"ON CONFLICT ({', '.join(map(quote, keys))}) DO UPDATE SET {updates}"
+            )
+
+    return rows, time.perf_counter() - start
+
+
+def refresh_customer_summary(conn) -> bool:
+    """
+    Refresh the customer_summary view of migration-indexes.sql and commit.
+
+    Returns:
+        Whether the view was refreshed, False if the migration has not been run yet.
+    """
+    with conn.cursor() as cur:
+        cur.execute("SELECT to_regproc('public.refresh_customer_summary') IS NOT NULL")
+        exists = cur.fetchone()[0]
+        if exists:
+            cur.execute("SELECT public.refresh_customer_summary()")
+    conn.commit()
+    return exists
+
+
+def load_data(uri: str, sources: dict[str, pd.DataFrame | str], upsert: bool = False, parallel: bool = False):
+    """
+    Load each table from a DataFrame or CSV file path and report the throughput.
+    The tables have no foreign keys between them, so they can be loaded in parallel.
+    """
+    print("Loading data...")
+    start = time.perf_counter()
+
+    if parallel:
+        with ThreadPoolExecutor(max_workers=len(sources)) as pool:
+            futures = {table: pool.submit(load_table, uri, table, source, upsert) for table, source in sources.items()}
+            results = {table: future.result() for table, future in futures.items()}
+    else:
+        results = {table: load_table(uri, table, source, upsert) for table, source in sources.items()}
+
+    for table, (rows, seconds) in results.items():
+        print(f"  {table}: {rows:,} rows in {seconds:.2f}s ({rows / max(seconds, 1e-9):,.0f} rows/sec)")
+
+    total_rows = sum(rows for rows, _ in results.values())
+    elapsed = time.perf_counter() - start
+    print(f"  total: {total_rows:,} rows in {elapsed:.2f}s ({total_rows / max(elapsed, 1e-9):,.0f} rows/sec)")
+
+    with closing(psycopg2.connect(uri)) as conn:
+        if refresh_customer_summary(conn):
+            print("  refreshed customer_summary")
+
+
+def iter_clean_chunks(path: str, chunksize: int):
+    """
+    Stream the raw export in chunks, yielding cleaned chunks.
+
+    Duplicates are removed across chunks by tracking a 64-bit hash of every
+    (Invoice, StockCode) pair seen so far, so only the hashes are kept in memory.
+    """
+    seen = np.array([], dtype=np.uint64)
+    for chunk in read_raw_data(path, chunksize):
+        keys = pd.util.hash_pandas_object(chunk[['Invoice', 'StockCode']], index=False).to_numpy()
+        first = ~pd.Series(keys).duplicated().to_numpy() & ~np.isin(keys, seen)
+        seen = np.union1d(seen, keys)
+        yield clean_rows(chunk[first])
+
+
+def run_chunked(path: str, chunksize: int, sample_size: int, output_dir: str, report: StageReport):
+    """
+    Run the pipeline over an input larger than memory.
+
+    The first pass builds the customers, items and RFM tables from per-chunk partial aggregates.
+    The second pass streams the transactions of the selected customers straight to the output file.
+    """
+    print("Preprocessing data in chunks...")
+    customers, items, partials = [], [], []
+    seen_customers, seen_items = set(), set()
+    rows = 0
+    with report.stage("First pass") as stats:
+        for chunk in iter_clean_chunks(path, chunksize):
+            rows += len(chunk)
+            stats.rows = rows
+            new_customers = chunk.drop_duplicates('Customer ID')
+            new_customers = new_customers[~new_customers['Customer ID'].isin(seen_customers)]
+            seen_customers.update(new_customers['Customer ID'])
+            customers.append(new_customers[['Customer ID', 'Country']])
+
+            new_items = chunk.drop_duplicates('StockCode')
+            new_items = new_items[~new_items['StockCode'].isin(seen_items)]
+            seen_items.update(new_items['StockCode'])
+            items.append(new_items[['StockCode', 'Description', 'Price']])
+
+            partials.append(aggregate_rfm(chunk))
+
+    print("Generating core tables...")
+    with report.stage("Core tables", rows):
+        customers = generate_customer_names(pd.concat(customers))
+        items = pd.concat(items)
+
+    print("Generating RFM table...")
+    with report.stage("RFM", rows):
+        rfm = score_rfm(merge_rfm_aggregates(partials))
+
+    if sample_size:
+        print("Sampling data...")
+        customers = customers.sample(n=sample_size, random_state=42)
+        rfm = rfm[rfm.index.isin(customers['Customer ID'])]
+
+    print("Exporting data...")
+    transaction_cols = ['Invoice', 'InvoiceDate', 'StockCode', 'Quantity', 'Price', 'TotalPrice', 'Customer ID']
+    stock_codes = set()
+    with report.stage("Second pass", rows):
+        for i, chunk in enumerate(iter_clean_chunks(path, chunksize)):
+            chunk = chunk[chunk['Customer ID'].isin(customers['Customer ID'])]
+            stock_codes.update(chunk['StockCode'])
+            chunk[transaction_cols].to_csv(f"{output_dir}/transactions.csv", mode='w' if i == 0 else 'a', header=i == 0, index=False)
+
+    items[items['StockCode'].isin(stock_codes)].to_csv(f"{output_dir}/items.csv", index=False)
+    customers.to_csv(f"{output_dir}/customers.csv", index=False)
+    rfm.reset_index().to_csv(f"{output_dir}/rfm.csv", index=False)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Generate the CRM tables from the Online Retail II export.")
+    parser.add_argument("--input", default="data/online_retail_II_2010-2011.csv", help="Path to the raw export.")
+    parser.add_argument("--output-dir", default="data", help="Directory the table CSVs are written to.")
+    parser.add_argument("--sample-size", type=int, default=100, help="Number of customers to sample, 0 keeps all customers.")
+    parser.add_argument("--chunksize", type=int, default=None, help="Stream the input in chunks of this many rows for inputs larger than memory.")
+    parser.add_argument("--benchmark", action="store_true", help="Report rows/sec and peak memory for each stage.")
+    parser.add_argument("--load", action="store_true", help="Load the tables into the database at SUPABASE_URI instead of only exporting CSVs.")
+    parser.add_argument("--from-csv", action="store_true", help="Skip generation and load the CSVs already in the output directory.")
+    parser.add_argument("--upsert", action="store_true", help="Update rows that already exist instead of failing on duplicate keys.")
+    parser.add_argument("--parallel", action="store_true", help="Load the tables in parallel.")
+    return parser.parse_args()
 
 
 def main():
-    df = pd.read_csv("data/online_retail_II_2010-2011.csv")
+    load_dotenv()
+    args = parse_args()
+    report = StageReport(enabled=args.benchmark)
+    csv_sources = {table: f"{args.output_dir}/{table}.csv" for table in TABLE_KEYS}
+
+    if args.from_csv:
+        load_data(os.getenv("SUPABASE_URI"), csv_sources, args.upsert, args.parallel)
+        return
+
+    if args.chunksize:
+        run_chunked(args.input, args.chunksize, args.sample_size, args.output_dir, report)
+        print(f"Data exported to /{args.output_dir}")
+        if args.load:
+            load_data(os.getenv("SUPABASE_URI"), csv_sources, args.upsert, args.parallel)
+        return
+
+    df = read_raw_data(args.input)
+
+    with report.stage("Preprocessing", len(df)):
+        df_clean = preprocess_data(df)
 
-    df_clean = preprocess_data(df)
+    with report.stage("Core tables", len(df_clean)):
+        transactions, items, customers = generate_core_tables(df_clean)
 
-    transactions, items, customers = generate_core_tables(df_clean)
+    with report.stage("RFM", len(transactions)):
+        rfm = generate_rfm(transactions)
 
-    rfm = generate_rfm(transactions)
+    if args.sample_size:
+        transactions, items, customers, rfm = sample_data(customers, transactions, items, rfm, sample_size=args.sample_size)
 
-    sampled_transactions, sampled_items, sampled_customers, sampled_rfm = sample_data(customers, transactions, items, rfm, sample_size=100)
+    if args.load:
+        sources = {'customers': customers, 'items': items, 'transactions': transactions, 'rfm': rfm.reset_index()}
+        load_data(os.getenv("SUPABASE_URI"), sources, args.upsert, args.parallel)
+        return
 
-    export_data(sampled_transactions, sampled_items, sampled_customers, sampled_rfm)
+    with report.stage("Export", len(transactions) + len(items) + len(customers) + len(rfm)):
+        export_data(transactions, items, customers, rfm, args.output_dir)
 
-    print("Data exported to /data")
+    print(f"Data exported to /{args.output_dir}")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,191 @@
+"""
+Incrementally refresh the rfm table from new transactions.
+
+Per-customer aggregates (last purchase, number of purchases, total spend) are kept in
+the rfm_aggregates table, see migration-incremental-rfm.sql. Each run folds in only the
+transactions written since the stored watermark, rescores every customer from the
+aggregates and upserts only the rfm rows that changed.
+
+The watermark is the write_id transactions are numbered with as they are inserted, so rows
+that arrive late or share an InvoiceDate with rows already folded in are still counted.
+Updated or deleted transactions are not, the aggregates have to be rebuilt for those by
+truncating rfm_aggregates and resetting rfm_watermark.last_write_id to 0.
+"""
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+import psycopg2
+from dotenv import load_dotenv
+from psycopg2.extras import execute_values
+from generate_data_tables import RFM_REFERENCE_DATE, aggregate_rfm, merge_rfm_aggregates, refresh_customer_summary, score_rfm
+
+
+RFM_COLUMNS = ['recency', 'frequency', 'monetary', 'R', 'F', 'M', 'RFM_Score', 'Segment']
+
+
+def fetch_frame(cur, query: str, params: tuple = ()) -> pd.DataFrame:
+    cur.execute(query, params)
+    return pd.DataFrame(cur.fetchall(), columns=[column.name for column in cur.description])
+
+
+def to_naive_utc(dates: pd.Series) -> pd.Series:
+    return pd.to_datetime(dates, utc=True).dt.tz_convert(None)
+
+
+def fetch_transactions(cur, after: int = 0, up_to: int | None = None) -> pd.DataFrame:
+    """
+    Fetch the columns RFM needs for the transactions written after write_id `after`, up to `up_to` if given.
+    """
+    query = 'SELECT "InvoiceDate", "TotalPrice", "Customer ID" FROM transactions WHERE "Customer ID" IS NOT NULL AND write_id > %s'
+    params = (after,)
+    if up_to is not None:
+        query += ' AND write_id <= %s'
+        params += (up_to,)
+    transactions = fetch_frame(cur, query, params)
+    transactions['InvoiceDate'] = to_naive_utc(transactions['InvoiceDate'])
+    return transactions
+
+
+def changed_rows(current: pd.DataFrame, updated: pd.DataFrame) -> pd.DataFrame:
+    """
+    Return the rows of `updated` that are new or differ from `current`.
+    """
+    current = current.reindex(updated.index)
+    changed = current[RFM_COLUMNS].isna().any(axis=1)
+    for column in ['recency', 'frequency', 'R', 'F', 'M', 'RFM_Score', 'Segment']:
+        changed = changed | (current[column] != updated[column])
+    changed = changed | ~np.isclose(current['monetary'].astype(float), updated['monetary'].astype(float))
+    return updated[changed]
+
+
+def last_committed_write_id(conn) -> int:
+    """
+    Wait until the transactions being inserted are committed and return the highest write_id.
+    Every transaction up to it is then visible, and rows inserted later get higher IDs.
+    """
+    with conn.cursor() as cur:
+        # Conflicts with inserts, so it waits for those in progress and is released straight away
+        cur.execute("LOCK TABLE transactions IN SHARE MODE")
+        cur.execute("SELECT coalesce(max(write_id), 0) FROM transactions")
+        last_write_id = cur.fetchone()[0]
+    conn.commit()
+    return last_write_id
+
+
+def refresh_rfm(conn, reference_date: pd.Timestamp = RFM_REFERENCE_DATE) -> pd.DataFrame:
+    """
+    Fold new transactions into the aggregates and upsert the rfm rows that changed.
+    Runs in a single transaction on the given connection, after waiting for transactions being inserted,
+    then refreshes the customer_summary view.
+
+    Returns:
+        The full, rescored rfm table.
+    """
+    last_write_id = last_committed_write_id(conn)
+    with conn.cursor() as cur:
+        # Lock the watermark so concurrent refreshes can't fold the same transactions twice
+        cur.execute("SELECT last_write_id FROM rfm_watermark FOR UPDATE")
+        watermark = cur.fetchone()[0]
+
+        aggregates = fetch_frame(cur, 'SELECT "Customer ID", last_purchase, frequency, monetary FROM rfm_aggregates')
+        aggregates['last_purchase'] = to_naive_utc(aggregates['last_purchase'])
+        # Sorted like the aggregates of new transactions, so customers with the same frequency always get the same F score
+        aggregates = aggregates.set_index('Customer ID').sort_index()
+
+        new_transactions = fetch_transactions(cur, after=watermark, up_to=last_write_id)
+        print(f"Folding {len(new_transactions):,} new transactions into {len(aggregates):,} customer aggregates...")
+
+        if not new_transactions.empty:
+            new_aggregates = aggregate_rfm(new_transactions)
+            aggregates = merge_rfm_aggregates([aggregates, new_aggregates])
+
+            touched = aggregates.loc[new_aggregates.index]
+            execute_values(
+                cur,
+                """
+                INSERT INTO rfm_aggregates ("Customer ID", last_purchase, frequency, monetary) VALUES %s
+                ON CONFLICT ("Customer ID") DO UPDATE SET
+                    last_purchase = EXCLUDED.last_purchase,
+                    frequency = EXCLUDED.frequency,
+                    monetary = EXCLUDED.monetary
+                """,
+                [
+                    (int(customer_id), row.last_purchase.to_pydatetime(), int(row.frequency), float(row.monetary))
+                    for customer_id, row in touched.iterrows()
+                ],
+                template="(%s, %s AT TIME ZONE 'UTC', %s, %s)"
+            )
+
+        # A concurrent refresh that waited for this one may have seen fewer transactions
+        cur.execute("UPDATE rfm_watermark SET last_write_id = greatest(last_write_id, %s)", (last_write_id,))
+
+        rfm = score_rfm(aggregates, reference_date)
+
+        current = fetch_frame(cur, 'SELECT * FROM rfm').set_index('Customer ID')
+        changed = changed_rows(current, rfm)
+        print(f"Upserting {len(changed):,} changed RFM rows...")
+
+        if not changed.empty:
+            execute_values(
+                cur,
+                """
+                INSERT INTO rfm ("Customer ID", recency, frequency, monetary, "R", "F", "M", "RFM_Score", "Segment") VALUES %s
+                ON CONFLICT ("Customer ID") DO UPDATE SET
+                    recency = EXCLUDED.recency,
+                    frequency = EXCLUDED.frequency,
+                    monetary = EXCLUDED.monetary,
+                    "R" = EXCLUDED."R",
+                    "F" = EXCLUDED."F",
+                    "M" = EXCLUDED."M",
+                    "RFM_Score" = EXCLUDED."RFM_Score",
+                    "Segment" = EXCLUDED."Segment"
+                """,
+                [
+                    (int(customer_id), int(row.recency), int(row.frequency), float(row.monetary),
+                     int(row.R), int(row.F), int(row.M), int(row.RFM_Score), row.Segment)
+                    for customer_id, row in changed.iterrows()
+                ]
+            )
+
+    conn.commit()
+    # The view reads rfm, refreshed in its own transaction so readers never wait on the upserts
+    refresh_customer_summary(conn)
+    return rfm
+
+
+def verify_against_full_recompute(conn, rfm: pd.DataFrame, reference_date: pd.Timestamp = RFM_REFERENCE_DATE) -> None:
+    """
+    Recompute RFM from every transaction and check it matches the incremental result.
+    """
+    print("Verifying against a full recompute...")
+    with conn.cursor() as cur:
+        full = score_rfm(aggregate_rfm(fetch_transactions(cur)), reference_date)
+
+    pd.testing.assert_frame_equal(
+        rfm.sort_index()[RFM_COLUMNS],
+        full.sort_index()[RFM_COLUMNS],
+        check_dtype=False,
+        check_names=False
+    )
+    print("Incremental RFM matches a full recompute.")
+
+
+def main():
+    load_dotenv()
+
+    parser = argparse.ArgumentParser(description="Incrementally refresh the rfm table from new transactions.")
+    parser.add_argument("--reference-date", default=str(RFM_REFERENCE_DATE.date()), help="Date recency is measured against.")
+    parser.add_argument("--verify", action="store_true", help="Check the result against a full recompute.")
+    args = parser.parse_args()
+
+    reference_date = pd.Timestamp(args.reference_date)
+    with psycopg2.connect(os.getenv("SUPABASE_URI")) as conn:
+        rfm = refresh_rfm(conn, reference_date)
+        if args.verify:
+            verify_against_full_recompute(conn, rfm, reference_date)
+
+
+if __name__ == "__main__":
+    main()
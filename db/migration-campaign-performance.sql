@@ -0,0 +1,174 @@
+-- Per-campaign and per-segment counts of campaign emails, kept up to date by triggers on campaign_emails
+-- so every writer (the marketing tools, the outbox worker, engagement ingestion) updates them incrementally.
+-- Read by the get_campaign_performance tool, see src/ralph/my_mcp/servers/engagement.py for the events.
+
+-- RFM segment of the customer when the email was queued, so later updates of the email count towards the same segment
+alter table public.campaign_emails
+  add column if not exists segment text null;
+
+update public.campaign_emails e
+set segment = r."Segment"
+from public.rfm r
+where r."Customer ID" = e.customer_id and e.segment is null;
+
+create or replace function public.set_campaign_email_segment() returns trigger
+language plpgsql as $$
+begin
+  if new.segment is null then
+    select "Segment" into new.segment from public.rfm where "Customer ID" = new.customer_id;
+  end if;
+  return new;
+end;
+$$;
+
+create trigger campaign_emails_set_segment
+before insert on public.campaign_emails
+for each row execute function public.set_campaign_email_segment();
+
+-- Emails are pending while queued or sending, delivered once sent, opened or clicked
+create table public.campaign_performance (
+  campaign_id uuid not null,
+  emails bigint not null default 0,
+  pending bigint not null default 0,
+  delivered bigint not null default 0,
+  bounced bigint not null default 0,
+  opened bigint not null default 0,
+  clicked bigint not null default 0,
+  updated_at timestamp without time zone not null default now(),
+  constraint campaign_performance_pkey primary key (campaign_id),
+  constraint campaign_performance_campaign_id_fkey foreign KEY (campaign_id) references marketing_campaigns (id) on delete CASCADE
+) TABLESPACE pg_default;
+
+ALTER TABLE campaign_performance ENABLE ROW LEVEL SECURITY;
+
+create table public.campaign_segment_performance (
+  campaign_id uuid not null,
+  segment text not null,
+  emails bigint not null default 0,
+  pending bigint not null default 0,
+  delivered bigint not null default 0,
+  bounced bigint not null default 0,
+  opened bigint not null default 0,
+  clicked bigint not null default 0,
+  updated_at timestamp without time zone not null default now(),
+  constraint campaign_segment_performance_pkey primary key (campaign_id, segment),
+  constraint campaign_segment_performance_campaign_id_fkey foreign KEY (campaign_id) references marketing_campaigns (id) on delete CASCADE
+) TABLESPACE pg_default;
+
+ALTER TABLE campaign_segment_performance ENABLE ROW LEVEL SECURITY;
+
+-- Adds what the rows of one statement contributed after it, minus what they contributed before.
+-- Runs once per statement, so a batch of 1,000 updated emails costs one upsert per campaign and segment.
+create or replace function public.update_campaign_performance() returns trigger
+language plpgsql as $$
+declare
+  changes text;
+begin
+  changes := case TG_OP
+    when 'INSERT' then 'select campaign_id, segment, status, opened_at, clicked_at, 1 as sign from new_rows'
+    when 'DELETE' then 'select campaign_id, segment, status, opened_at, clicked_at, -1 as sign from old_rows'
+    else 'select campaign_id, segment, status, opened_at, clicked_at, 1 as sign from new_rows
+          union all
+          select campaign_id, segment, status, opened_at, clicked_at, -1 as sign from old_rows'
+  end;
+
+  execute format($sql$
+    with changes as (%s),
+    deltas as (
+      select
+        c.campaign_id,
+        coalesce(c.segment, 'Unknown') as segment,
+        sum(c.sign) as emails,
+        sum(c.sign * (c.status in ('pending', 'sending'))::int) as pending,
+        sum(c.sign * (c.status in ('sent', 'opened', 'clicked'))::int) as delivered,
+        sum(c.sign * (c.status = 'bounced')::int) as bounced,
+        sum(c.sign * (c.opened_at is not null)::int) as opened,
+        sum(c.sign * (c.clicked_at is not null)::int) as clicked
+      from changes c
+      -- Emails deleted with their campaign have nothing left to count towards
+      join public.marketing_campaigns m on m.id = c.campaign_id
+      group by 1, 2
+    ),
+    changed as (
+      select * from deltas
+      where (emails, pending, delivered, bounced, opened, clicked) <> (0, 0, 0, 0, 0, 0)
+    ),
+    segments as (
+      insert into public.campaign_segment_performance as p (campaign_id, segment, emails, pending, delivered, bounced, opened, clicked)
+      -- Rows are upserted in key order so concurrent statements never wait on each other in a cycle
+      select * from changed order by campaign_id, segment
+      on conflict (campaign_id, segment) do update set
+        emails = p.emails + excluded.emails,
+        pending = p.pending + excluded.pending,
+        delivered = p.delivered + excluded.delivered,
+        bounced = p.bounced + excluded.bounced,
+        opened = p.opened + excluded.opened,
+        clicked = p.clicked + excluded.clicked,
+        updated_at = now()
+    )
+    insert into public.campaign_performance as p (campaign_id, emails, pending, delivered, bounced, opened, clicked)
+    select campaign_id, sum(emails), sum(pending), sum(delivered), sum(bounced), sum(opened), sum(clicked)
+    from changed
+    group by campaign_id
+    order by campaign_id
+    on conflict (campaign_id) do update set
+      emails = p.emails + excluded.emails,
+      pending = p.pending + excluded.pending,
+      delivered = p.delivered + excluded.delivered,
+      bounced = p.bounced + excluded.bounced,
+      opened = p.opened + excluded.opened,
+      clicked = p.clicked + excluded.clicked,
+      updated_at = now()
+  $sql$, changes);
+  return null;
+end;
+$$;
+
+create or replace function public.reset_campaign_performance() returns trigger
+language plpgsql as $$
+begin
+  delete from public.campaign_segment_performance;
+  delete from public.campaign_performance;
+  return null;
+end;
+$$;
+
+-- Transition tables can only be declared for a single event, hence one trigger per event
+create trigger campaign_emails_performance_insert
+after insert on public.campaign_emails
+referencing new table as new_rows
+for each statement execute function public.update_campaign_performance();
+
+create trigger campaign_emails_performance_update
+after update on public.campaign_emails
+referencing old table as old_rows new table as new_rows
+for each statement execute function public.update_campaign_performance();
+
+create trigger campaign_emails_performance_delete
+after delete on public.campaign_emails
+referencing old table as old_rows
+for each statement execute function public.update_campaign_performance();
+
+create trigger campaign_emails_performance_truncate
+after truncate on public.campaign_emails
+for each statement execute function public.reset_campaign_performance();
+
+-- Count the emails written before this migration
+insert into public.campaign_segment_performance (campaign_id, segment, emails, pending, delivered, bounced, opened, clicked)
+select
+  campaign_id,
+  coalesce(segment, 'Unknown'),
+  count(*),
+  count(*) filter (where status in ('pending', 'sending')),
+  count(*) filter (where status in ('sent', 'opened', 'clicked')),
+  count(*) filter (where status = 'bounced'),
+  count(opened_at),
+  count(clicked_at)
+from public.campaign_emails
+where campaign_id is not null
+group by 1, 2;
+
+insert into public.campaign_performance (campaign_id, emails, pending, delivered, bounced, opened, clicked)
+select campaign_id, sum(emails), sum(pending), sum(delivered), sum(bounced), sum(opened), sum(clicked)
+from public.campaign_segment_performance
+group by campaign_id;
@@ -0,0 +1,31 @@
+-- Campaign emails are written as pending and delivered by the outbox worker, see src/ralph/my_mcp/servers/outbox.py
+-- pending -> sending -> sent, or back to pending to be retried, or bounced
+
+alter table public.campaign_emails
+  drop constraint campaign_emails_status_check;
+
+alter table public.campaign_emails
+  add constraint campaign_emails_status_check check (
+    status = any (
+      array[
+        'pending'::text,
+        'sending'::text,
+        'sent'::text,
+        'bounced'::text,
+        'opened'::text,
+        'clicked'::text
+      ]
+    )
+  ),
+  alter column status set default 'pending'::text,
+  -- Set when the email is delivered
+  alter column sent_at drop default,
+  add column attempts integer not null default 0,
+  -- When a pending email may be sent, or when the claim of a worker on a sending email expires
+  add column next_attempt_at timestamp without time zone null default now(),
+  add column last_error text null;
+
+-- Emails waiting for delivery, in the order workers claim them
+create index if not exists campaign_emails_outbox_idx
+  on public.campaign_emails (next_attempt_at)
+  where status in ('pending', 'sending');
@@ -0,0 +1,32 @@
+-- Per-customer running totals the rfm table is scored from, see db/incremental_rfm.py
+create table public.rfm_aggregates (
+  "Customer ID" bigint not null,
+  last_purchase timestamp with time zone null,
+  frequency bigint not null default 0,
+  monetary double precision not null default 0,
+  constraint rfm_aggregates_pkey primary key ("Customer ID")
+) TABLESPACE pg_default;
+
+ALTER TABLE rfm_aggregates ENABLE ROW LEVEL SECURITY;
+
+-- Numbers transactions in the order they are written, whatever their InvoiceDate, so each refresh
+-- folds in exactly the rows written since the last one. Existing rows are numbered by this migration.
+create sequence if not exists public.transactions_write_id_seq;
+
+alter table public.transactions
+  add column if not exists write_id bigint not null default nextval('public.transactions_write_id_seq');
+
+create index if not exists transactions_write_id_idx
+  on public.transactions (write_id);
+
+-- Last transaction write_id folded into rfm_aggregates. Single row table.
+create table public.rfm_watermark (
+  id boolean not null default true,
+  last_write_id bigint not null default 0,
+  constraint rfm_watermark_pkey primary key (id),
+  constraint rfm_watermark_single_row check (id)
+) TABLESPACE pg_default;
+
+ALTER TABLE rfm_watermark ENABLE ROW LEVEL SECURITY;
+
+insert into public.rfm_watermark (id, last_write_id) values (true, 0);
@@ -0,0 +1,64 @@
+-- Secondary indexes for the agent's query patterns
+
+-- Purchase history of a customer, optionally filtered by date
+create index if not exists transactions_customer_id_invoice_date_idx
+  on public.transactions ("Customer ID", "InvoiceDate");
+
+-- Date range scans across all customers
+create index if not exists transactions_invoice_date_idx
+  on public.transactions ("InvoiceDate");
+
+-- Joins from transactions to items
+create index if not exists transactions_stock_code_idx
+  on public.transactions ("StockCode");
+
+-- Segment lookups, ordered by customer for paging
+create index if not exists rfm_segment_customer_id_idx
+  on public.rfm ("Segment", "Customer ID");
+
+-- Emails of a campaign, and whether a customer was already emailed for it
+create index if not exists campaign_emails_campaign_id_customer_id_idx
+  on public.campaign_emails (campaign_id, customer_id);
+
+-- Emails sent to a customer across campaigns
+create index if not exists campaign_emails_customer_id_idx
+  on public.campaign_emails (customer_id);
+
+
+-- One row per customer with their purchase totals and RFM segment
+create materialized view if not exists public.customer_summary as
+select
+  c."Customer ID",
+  c."Name",
+  c."Email",
+  c."Country",
+  count(t."Invoice") as transaction_count,
+  count(distinct t."Invoice") as invoice_count,
+  coalesce(sum(t."TotalPrice"), 0) as total_spend,
+  min(t."InvoiceDate") as first_purchase,
+  max(t."InvoiceDate") as last_purchase,
+  r.recency,
+  r.frequency,
+  r.monetary,
+  r."R",
+  r."F",
+  r."M",
+  r."RFM_Score",
+  r."Segment"
+from public.customers c
+left join public.transactions t on t."Customer ID" = c."Customer ID"
+left join public.rfm r on r."Customer ID" = c."Customer ID"
+group by c."Customer ID", r."Customer ID";
+
+-- A unique index is required to refresh the view concurrently
+create unique index if not exists customer_summary_customer_id_idx
+  on public.customer_summary ("Customer ID");
+
+create index if not exists customer_summary_segment_idx
+  on public.customer_summary ("Segment");
+
+-- Refresh the summary without blocking readers. Run after loading data or refreshing RFM.
+create or replace function public.refresh_customer_summary() returns void
+language sql as $$
+  refresh materialized view concurrently public.customer_summary;
+$$;
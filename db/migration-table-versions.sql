@@ -0,0 +1,42 @@
+create table public.table_versions (
+  table_name text not null,
+  version bigint not null default 0,
+  constraint table_versions_pkey primary key (table_name)
+) TABLESPACE pg_default;
+
+ALTER TABLE table_versions ENABLE ROW LEVEL SECURITY;
+
+-- Bumps the version of a table once per modifying statement so caches can tell when the table changed
+create or replace function public.bump_table_version() returns trigger
+language plpgsql as $$
+begin
+  insert into public.table_versions (table_name, version)
+  values (TG_TABLE_NAME, 1)
+  on conflict (table_name) do update set version = public.table_versions.version + 1;
+  return null;
+end;
+$$;
+
+create trigger customers_bump_version
+after insert or update or delete or truncate on public.customers
+for each statement execute function public.bump_table_version();
+
+create trigger transactions_bump_version
+after insert or update or delete or truncate on public.transactions
+for each statement execute function public.bump_table_version();
+
+create trigger items_bump_version
+after insert or update or delete or truncate on public.items
+for each statement execute function public.bump_table_version();
+
+create trigger rfm_bump_version
+after insert or update or delete or truncate on public.rfm
+for each statement execute function public.bump_table_version();
+
+create trigger marketing_campaigns_bump_version
+after insert or update or delete or truncate on public.marketing_campaigns
+for each statement execute function public.bump_table_version();
+
+-- campaign_emails is not versioned: the marketing tools, the outbox worker and engagement ingestion
+-- all write it, and each bump would hold the lock on the same table_versions row until commit,
+-- serialising every one of those writes. Cached reads of it expire after a short TTL instead.
@@ -1,9 +1,21 @@
-from ralph.graph import build_graph, AgentState
-from langchain_core.messages import AIMessageChunk, HumanMessage
+from ralph.checkpoint import open_checkpointer
+from ralph.graph import build_graph
+from ralph.metrics import configure_tracing, profile_turn
+from ralph.my_mcp.config import load_env
+from ralph.my_mcp.registry import close_tool_registries
+from ralph.streaming import stream_graph_events, TextDelta, ToolCallArgsDelta, ToolCallStart
+from langchain_core.messages import HumanMessage
+from contextlib import nullcontext
 from typing import AsyncGenerator, Any
+from uuid import uuid4
 from langgraph.graph import StateGraph
 from langgraph.types import Command
 import json
+import os
+
+
+# Where --profile writes the spans of this process and of the MCP servers, unless METRICS_TRACE_PATH is set
+DEFAULT_TRACE_PATH = "~/.cache/ralph/traces.jsonl"
 
 
 async def stream_graph_responses(
@@ -16,109 +28,134 @@ async def stream_graph_responses(
     Args:
         input: The input to the graph.
         graph: The compiled graph.
-        **kwargs: Additional keyword arguments.
+        **kwargs: Additional keyword arguments, see `ralph.streaming.stream_graph_events`.
 
     Returns:
         str: The final LLM or tool call response
     """
-    async for message_chunk, metadata in graph.astream(
-        input=input,
-        stream_mode="messages",
-        **kwargs
-        ):
-        if isinstance(message_chunk, AIMessageChunk):
-            if message_chunk.response_metadata:
-                finish_reason = message_chunk.response_metadata.get("finish_reason", "")
-                if finish_reason == "tool_calls":
-                    yield "\n\n"
-
-            if message_chunk.tool_call_chunks:
-                tool_chunk = message_chunk.tool_call_chunks[0]
-
-                tool_name = tool_chunk.get("name", "")
-                args = tool_chunk.get("args", "")
-
-                if tool_name:
-                    tool_call_str = f"\n\n< TOOL CALL: {tool_name} >\n\n"
-                if args:
-                    tool_call_str = args
+    tool_names = {}
+    tool_index = None
+
+    async for event in stream_graph_events(input, graph, **kwargs):
+        if isinstance(event, ToolCallStart):
+            tool_names[event.index] = event.name
+            tool_index = event.index
+            yield f"\n\n< TOOL CALL: {event.name} >\n\n"
+
+        elif isinstance(event, ToolCallArgsDelta):
+            # Arguments of parallel tool calls may arrive interleaved
+            if event.index != tool_index:
+                tool_index = event.index
+                yield f"\n\n< TOOL CALL: {tool_names.get(event.index, '')} >\n\n"
+            yield event.args
+
+        else:
+            if tool_index is not None:
+                tool_names = {}
+                tool_index = None
+                yield "\n\n"
+            if isinstance(event, TextDelta):
+                yield event.text
+
+
+async def print_graph_responses(input: dict[str, Any], graph: StateGraph, profile: bool = False, **kwargs) -> None:
+    """Print the streamed result of the graph run, followed by a breakdown of where its time went if `profile` is set."""
+    with profile_turn() if profile else nullcontext() as turn:
+        async for response in stream_graph_responses(input, graph, **kwargs):
+            print(response, end="", flush=True)
+    if profile:
+        print(f"\n\n{turn.report()}\n")
+
+
+async def main(profile: bool = False, thread_id: str | None = None):
+    # Read before the tracing and checkpointer settings
+    load_env()
+    if profile:
+        # Set before the MCP servers start, so they trace their database queries too
+        configure_tracing(os.getenv("METRICS_TRACE_PATH") or DEFAULT_TRACE_PATH)
+    try:
+        async with open_checkpointer() as checkpointer:
+            graph = await build_graph(checkpointer=checkpointer)
+
+            thread_id = thread_id or str(uuid4())
+            config = {
+                "configurable": {
+                    "thread_id": thread_id
+                }
+            }
+            yolo_mode = False
+            print(f"Thread {thread_id}, continue it later with --thread {thread_id}\n")
 
-                yield tool_call_str
+            # A thread that already has messages picks up where it left off
+            if (await graph.aget_state(config=config)).values.get("messages"):
+                graph_input = None
             else:
-                yield message_chunk.content
-            continue
-
-
-async def main():
-    try:
-        graph = await build_graph()
+                graph_input = {
+                    "messages": [
+                        HumanMessage(content="Briefly introduce yourself and offer to help me.")
+                    ],
+                    "yolo_mode": yolo_mode
+                }
+
+            while True:
+                if graph_input is not None:
+                    print(f" ---- 🤖 Assistant ---- \n")
+                    await print_graph_responses(graph_input, graph, profile, config=config)
+
+                thread_state = await graph.aget_state(config=config)
+
+                while thread_state.interrupts:
+                    # if interrupt, collect input and handle resume
+                    for interrupt in thread_state.interrupts:
+                        print("\n ----- ✅ / ❌ Human Approval Required ----- \n")
+                        interrupt_json_str = json.dumps(interrupt.value, indent=2, ensure_ascii=False)
+                        print(interrupt_json_str)
+                        print("\n Please specify whether you want to continue, update, or provide feedback.")
 
-        config = {
-            "configurable": {
-                "thread_id": "1"
-            }
-        }
-        yolo_mode = False
-
-        graph_input = AgentState(
-            messages=[
-                HumanMessage(content="Briefly introduce yourself and offer to help me.")
-            ],
-            yolo_mode=yolo_mode
-        )
-
-        while True:
-            print(f" ---- 🤖 Assistant ---- \n")
-            async for response in stream_graph_responses(graph_input, graph, config=config):
-                print(response, end="", flush=True)
-
-            thread_state = graph.get_state(config=config)
-
-            while thread_state.interrupts:
-                # if interrupt, collect input and handle resume
-                for interrupt in thread_state.interrupts:
-                    print("\n ----- ✅ / ❌ Human Approval Required ----- \n")
-                    interrupt_json_str = json.dumps(interrupt.value, indent=2, ensure_ascii=False)
-                    print(interrupt_json_str)
-                    print("\n Please specify whether you want to continue, update, or provide feedback.")
-
-                    action = input("Action (continue, update, feedback): ")
-                    while action not in ["continue", "update", "feedback"]:
-                        print("Invalid action. Please try again.")
                         action = input("Action (continue, update, feedback): ")
+                        while action not in ["continue", "update", "feedback"]:
+                            print("Invalid action. Please try again.")
+                            action = input("Action (continue, update, feedback): ")
 
-                    if action == "continue":
-                        data=None
-                    else:
-                        data = input("Data: ")
+                        if action == "continue":
+                            data=None
+                        else:
+                            data = input("Data: ")
 
-                    print(f" ----- 🤖 Assistant ----- \n")
-                    async for response in stream_graph_responses(Command(resume={"action": action, "data": data}), graph, config=config):
-                        print(response, end="", flush=True)
+                        print(f" ----- 🤖 Assistant ----- \n")
+                        await print_graph_responses(Command(resume={"action": action, "data": data}), graph, profile, config=config)
 
-                    thread_state = graph.get_state(config=config)
+                        thread_state = await graph.aget_state(config=config)
 
-            user_input = input("User: ")
-            if user_input.lower() in ["exit", "quit"]:
-                print("\n\nExit command received. Exiting...\n\n")
-                break
-            graph_input = AgentState(
-                messages=[
-                    HumanMessage(content=user_input)
-                ],
-                yolo_mode=yolo_mode
-            )
+                user_input = input("User: ")
+                if user_input.lower() in ["exit", "quit"]:
+                    print("\n\nExit command received. Exiting...\n\n")
+                    break
+                graph_input = {
+                    "messages": [
+                        HumanMessage(content=user_input)
+                    ],
+                    "yolo_mode": yolo_mode
+                }
 
-            print(f"\n\n ----- 🥷 Human ----- \n\n{user_input}\n")
+                print(f"\n\n ----- 🥷 Human ----- \n\n{user_input}\n")
 
     except Exception as e:
         print(f"Error: {type(e).__name__}: {str(e)}")
         raise
+    finally:
+        await close_tool_registries()
 
 
 if __name__ == "__main__":
+    import argparse
     import asyncio
     import nest_asyncio
     nest_asyncio.apply()
 
-    asyncio.run(main())
+    parser = argparse.ArgumentParser(description="Chat with the agent in the terminal.")
+    parser.add_argument("--profile", action="store_true", help="Print the time spent in nodes, LLM calls, tools and queries after each turn.")
+    parser.add_argument("--thread", help="The ID of a thread to continue, a new thread is started by default.")
+    args = parser.parse_args()
+
+    asyncio.run(main(profile=args.profile, thread_id=args.thread))
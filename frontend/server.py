@@ -0,0 +1,234 @@
+"""
+ASGI server that hosts one shared agent graph for many marketers at once.
+
+Each conversation is a thread. Replies are streamed as server-sent events, and protected
+tool calls wait for approval through the resume endpoint, as in chat_local.py.
+
+Events, see ralph/streaming.py:
+    text, tool_call, tool_call_args, tool_result   The reply as it is generated, small deltas are coalesced.
+    interrupt                                      A tool call waits for approval.
+    done, error, cancelled                         The run ended.
+
+    cd frontend && uv run uvicorn server:app
+
+Endpoints:
+    POST /threads                         Start a new thread.
+    GET  /threads/{thread_id}             Get the messages and pending approvals of a thread.
+    POST /threads/{thread_id}/messages    Send a message, {"content": "..."}. Streams the reply.
+    POST /threads/{thread_id}/resume      Answer an approval, {"action": "continue|update|feedback", "data": "..."}. Streams the reply.
+    POST /threads/{thread_id}/cancel      Stop the run in progress.
+    GET  /metrics                         Timings, token counts and errors in the Prometheus text format, see ralph/metrics.py.
+"""
+
+from ralph.checkpoint import open_checkpointer
+from ralph.graph import build_graph
+from ralph.metrics import render_prometheus
+from ralph.my_mcp.config import load_env
+from ralph.my_mcp.registry import close_tool_registries
+from ralph.streaming import InterruptEvent, event_data, stream_graph_events
+from contextlib import asynccontextmanager
+from langchain_core.messages import HumanMessage
+from langgraph.types import Command
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from starlette.routing import Route
+from typing import Any, AsyncGenerator
+from uuid import uuid4
+import asyncio
+import json
+import os
+
+
+# Read before the settings below, the checkpointer and the graph
+load_env()
+
+# Max graph runs in progress across all threads, further runs wait for a free slot
+MAX_CONCURRENT_RUNS = int(os.getenv("SERVER_MAX_CONCURRENT_RUNS", "64"))
+# Seconds a run waits for a free slot before it is rejected
+RUN_QUEUE_TIMEOUT = float(os.getenv("SERVER_RUN_QUEUE_TIMEOUT", "30"))
+# Events buffered per stream, a slow client pauses its run once the buffer is full
+STREAM_BUFFER_SIZE = int(os.getenv("SERVER_STREAM_BUFFER_SIZE", "256"))
+# Seconds small deltas are held back to be merged into one event, 0 sends every delta on its own
+STREAM_COALESCE_DELAY = float(os.getenv("SERVER_STREAM_COALESCE_DELAY", "0.05"))
+# Whether clients may send {"yolo_mode": true} to skip the review of protected tools. The server
+# has no authentication, so any client could otherwise send campaigns without approval.
+ALLOW_YOLO_MODE = os.getenv("SERVER_ALLOW_YOLO_MODE", "false").lower() in ("1", "true", "yes")
+
+
+def format_event(event: str, data: Any) -> str:
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class RunManager:
+    """
+    Runs the graph for many threads at once.
+
+    Each thread has at most one run in progress and a global semaphore limits
+    the runs in progress across threads. A run writes its events into a bounded
+    queue, so it is paused while its client is not keeping up, and it is
+    cancelled when the client disconnects or calls the cancel endpoint.
+    """
+
+    def __init__(self, graph, max_concurrent_runs: int = MAX_CONCURRENT_RUNS):
+        self.graph = graph
+        self.semaphore = asyncio.Semaphore(max_concurrent_runs)
+        self.runs: dict[str, asyncio.Task] = {}
+
+    def is_running(self, thread_id: str) -> bool:
+        run = self.runs.get(thread_id)
+        return run is not None and not run.done()
+
+    def cancel(self, thread_id: str) -> bool:
+        if not self.is_running(thread_id):
+            return False
+        self.runs[thread_id].cancel()
+        return True
+
+    async def run(self, thread_id: str, graph_input: Any, queue: asyncio.Queue) -> None:
+        config = {"configurable": {"thread_id": thread_id}}
+        try:
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), timeout=RUN_QUEUE_TIMEOUT)
+            except asyncio.TimeoutError:
+                await queue.put(("error", {"message": "The server is busy, please try again."}))
+                await queue.put(None)
+                return
+
+            try:
+                interrupted = False
+                async for event in stream_graph_events(
+                    graph_input, self.graph, max_delay=STREAM_COALESCE_DELAY, config=config
+                ):
+                    interrupted = interrupted or isinstance(event, InterruptEvent)
+                    await queue.put((event.event, event_data(event)))
+                await queue.put(("done", {"interrupted": interrupted}))
+            except Exception as e:
+                await queue.put(("error", {"message": f"{type(e).__name__}: {e}"}))
+            finally:
+                self.semaphore.release()
+            await queue.put(None)
+
+        except asyncio.CancelledError:
+            # Tell a client that is still connected, without waiting on it. Buffered tokens are dropped to make room.
+            while not queue.empty():
+                queue.get_nowait()
+            queue.put_nowait(("cancelled", {}))
+            queue.put_nowait(None)
+            raise
+
+    def start(self, thread_id: str, graph_input: Any) -> StreamingResponse | JSONResponse:
+        """
+        Start a run and stream its events to the client.
+        """
+        if self.is_running(thread_id):
+            return JSONResponse({"error": "A run is already in progress for this thread."}, status_code=409)
+
+        queue = asyncio.Queue(maxsize=STREAM_BUFFER_SIZE)
+        run = asyncio.create_task(self.run(thread_id, graph_input, queue))
+        self.runs[thread_id] = run
+
+        def forget_run(_):
+            if self.runs.get(thread_id) is run:
+                del self.runs[thread_id]
+
+        run.add_done_callback(forget_run)
+
+        async def events() -> AsyncGenerator[str, None]:
+            try:
+                while (item := await queue.get()) is not None:
+                    yield format_event(*item)
+            finally:
+                # The client disconnected or the stream ended, either way the run must not outlive it
+                run.cancel()
+
+        return StreamingResponse(events(), media_type="text/event-stream", headers={"Cache-Control": "no-cache"})
+
+
+async def create_thread(request: Request) -> JSONResponse:
+    return JSONResponse({"thread_id": str(uuid4())}, status_code=201)
+
+
+async def get_thread(request: Request) -> JSONResponse:
+    thread_id = request.path_params["thread_id"]
+    thread_state = await request.app.state.runs.graph.aget_state({"configurable": {"thread_id": thread_id}})
+    messages = thread_state.values.get("messages", []) if thread_state.values else []
+    return JSONResponse({
+        "thread_id": thread_id,
+        "running": request.app.state.runs.is_running(thread_id),
+        "messages": [{"type": message.type, "content": message.content} for message in messages],
+        "interrupts": [interrupt.value for interrupt in thread_state.interrupts],
+    })
+
+
+async def send_message(request: Request) -> StreamingResponse | JSONResponse:
+    body = await request.json()
+    if not isinstance(body.get("content"), str) or not body["content"]:
+        return JSONResponse({"error": "content is required."}, status_code=400)
+
+    yolo_mode = bool(body.get("yolo_mode", False))
+    if yolo_mode and not ALLOW_YOLO_MODE:
+        return JSONResponse({"error": "yolo_mode is disabled on this server, see SERVER_ALLOW_YOLO_MODE."}, status_code=403)
+
+    graph_input = {"messages": [HumanMessage(content=body["content"])], "yolo_mode": yolo_mode}
+    return request.app.state.runs.start(request.path_params["thread_id"], graph_input)
+
+
+async def resume(request: Request) -> StreamingResponse | JSONResponse:
+    body = await request.json()
+    if body.get("action") not in ["continue", "update", "feedback"]:
+        return JSONResponse({"error": "action must be one of continue, update, feedback."}, status_code=400)
+
+    command = Command(resume={"action": body["action"], "data": body.get("data")})
+    return request.app.state.runs.start(request.path_params["thread_id"], command)
+
+
+async def cancel(request: Request) -> JSONResponse:
+    cancelled = request.app.state.runs.cancel(request.path_params["thread_id"])
+    return JSONResponse({"cancelled": cancelled})
+
+
+async def metrics(request: Request) -> PlainTextResponse:
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def create_app(graph=None) -> Starlette:
+    """
+    Create the ASGI app.
+
+    Args:
+        graph: The compiled graph to serve. Built with a persistent checkpointer on startup if not given.
+    """
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        if graph is not None:
+            app.state.runs = RunManager(graph)
+            yield
+            return
+
+        try:
+            async with open_checkpointer() as checkpointer:
+                app.state.runs = RunManager(await build_graph(checkpointer=checkpointer))
+                yield
+        finally:
+            await close_tool_registries()
+
+    return Starlette(
+        routes=[
+            Route("/threads", create_thread, methods=["POST"]),
+            Route("/threads/{thread_id}", get_thread, methods=["GET"]),
+            Route("/threads/{thread_id}/messages", send_message, methods=["POST"]),
+            Route("/threads/{thread_id}/resume", resume, methods=["POST"]),
+            Route("/threads/{thread_id}/cancel", cancel, methods=["POST"]),
+            Route("/metrics", metrics, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+app = create_app()
+
+
+if __name__ == "__main__":
+    import uvicorn
+    uvicorn.run(app, host=os.getenv("SERVER_HOST", "127.0.0.1"), port=int(os.getenv("SERVER_PORT", "8000")))
@@ -0,0 +1,340 @@
+"""
+This file provides the checkpoint backends used to persist agent threads.
+Threads are stored in SQLite locally or Postgres in production, and only the
+most recently used threads are kept in memory.
+"""
+
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Iterator, Optional, Sequence
+from langchain_core.runnables import RunnableConfig
+from langgraph.checkpoint.base import (
+    BaseCheckpointSaver,
+    ChannelVersions,
+    Checkpoint,
+    CheckpointMetadata,
+    CheckpointTuple,
+    copy_checkpoint,
+    get_checkpoint_id,
+    get_checkpoint_metadata
+)
+from langgraph.checkpoint.memory import MemorySaver
+import os
+
+
+class CachedCheckpointSaver(BaseCheckpointSaver):
+    """
+    Wraps a SQLite or Postgres checkpoint saver with an in-memory LRU cache of the latest checkpoint per thread.
+
+    Threads that have not been used recently are evicted from memory and lazily
+    reloaded from the backend the next time they are accessed. Checkpoints are written
+    to the backend and kept in the cache as the latest of their thread, while pending
+    writes invalidate the cached entry. Before a cached checkpoint is handed out, the
+    ID of the latest checkpoint of the thread and its number of pending writes are
+    read from the backend with one indexed query, so threads written by other
+    processes are reloaded instead of served stale. Only the deserialisation of the
+    checkpoint and its channel values is saved, which grows with the history.
+    """
+
+    def __init__(self, saver: BaseCheckpointSaver, max_cached_threads: int = 128):
+        backend = type(saver).__name__
+        if backend not in LATEST_CHECKPOINT_READERS:
+            raise TypeError(f"Caching is not supported for {backend}, only for {', '.join(LATEST_CHECKPOINT_READERS)}")
+        super().__init__(serde=saver.serde)
+        self.saver = saver
+        self.max_cached_threads = max_cached_threads
+        self.cache: OrderedDict[tuple[str, str], CheckpointTuple] = OrderedDict()
+        self.read_latest = LATEST_CHECKPOINT_READERS[backend]
+        self.stats = {"hits": 0, "misses": 0}
+
+    @property
+    def config_specs(self) -> list:
+        return self.saver.config_specs
+
+    @staticmethod
+    def _cache_key(config: RunnableConfig) -> tuple[str, str]:
+        configurable = config["configurable"]
+        return configurable["thread_id"], configurable.get("checkpoint_ns", "")
+
+    async def _get_cached(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        # Only the latest checkpoint of a thread is cached
+        if get_checkpoint_id(config):
+            return None
+        key = self._cache_key(config)
+        cached = self.cache.get(key)
+        if cached is None:
+            return None
+
+        if await self.read_latest(self.saver, *key) != (cached.checkpoint["id"], len(cached.pending_writes or ())):
+            del self.cache[key]
+            return None
+
+        self.cache.move_to_end(key)
+        # Hand out a copy so callers can't mutate the cached checkpoint
+        return cached._replace(checkpoint=copy_checkpoint(cached.checkpoint))
+
+    def _remember(self, key: tuple[str, str], checkpoint_tuple: CheckpointTuple) -> None:
+        self.cache[key] = checkpoint_tuple
+        self.cache.move_to_end(key)
+        while len(self.cache) > self.max_cached_threads:
+            self.cache.popitem(last=False)
+
+    def _forget(self, config: RunnableConfig) -> None:
+        self.cache.pop(self._cache_key(config), None)
+
+    def _forget_thread(self, thread_id: str) -> None:
+        for key in [key for key in self.cache if key[0] == thread_id]:
+            del self.cache[key]
+
+    def get_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        return self.saver.get_tuple(config)
+
+    async def aget_tuple(self, config: RunnableConfig) -> Optional[CheckpointTuple]:
+        if cached := await self._get_cached(config):
+            self.stats["hits"] += 1
+            return cached
+        self.stats["misses"] += 1
+        checkpoint_tuple = await self.saver.aget_tuple(config)
+        if checkpoint_tuple is not None and not get_checkpoint_id(config):
+            self._remember(self._cache_key(config), checkpoint_tuple)
+        return checkpoint_tuple
+
+    def list(self, config: Optional[RunnableConfig], **kwargs: Any) -> Iterator[CheckpointTuple]:
+        return self.saver.list(config, **kwargs)
+
+    async def alist(self, config: Optional[RunnableConfig], **kwargs: Any) -> AsyncIterator[CheckpointTuple]:
+        async for checkpoint_tuple in self.saver.alist(config, **kwargs):
+            yield checkpoint_tuple
+
+    def put(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions
+            ) -> RunnableConfig:
+        self._forget(config)
+        return self.saver.put(config, checkpoint, metadata, new_versions)
+
+    async def aput(
+            self,
+            config: RunnableConfig,
+            checkpoint: Checkpoint,
+            metadata: CheckpointMetadata,
+            new_versions: ChannelVersions
+            ) -> RunnableConfig:
+        self._forget(config)
+        next_config = await self.saver.aput(config, checkpoint, metadata, new_versions)
+        # The new checkpoint is the latest of its thread, as the backend would return it
+        parent_id = get_checkpoint_id(config)
+        key = self._cache_key(config)
+        self._remember(key, CheckpointTuple(
+            config=next_config,
+            checkpoint=copy_checkpoint(checkpoint),
+            metadata=get_checkpoint_metadata(config, metadata),
+            parent_config={"configurable": {"thread_id": key[0], "checkpoint_ns": key[1], "checkpoint_id": parent_id}} if parent_id else None,
+            pending_writes=[],
+        ))
+        return next_config
+
+    def put_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        self._forget(config)
+        self.saver.put_writes(config, writes, task_id, task_path)
+
+    async def aput_writes(self, config: RunnableConfig, writes: Sequence[tuple[str, Any]], task_id: str, task_path: str = "") -> None:
+        self._forget(config)
+        await self.saver.aput_writes(config, writes, task_id, task_path)
+
+    def delete_thread(self, thread_id: str) -> None:
+        self._forget_thread(thread_id)
+        self.saver.delete_thread(thread_id)
+
+    async def adelete_thread(self, thread_id: str) -> None:
+        self._forget_thread(thread_id)
+        await self.saver.adelete_thread(thread_id)
+
+    def get_next_version(self, current: Optional[str], channel: None) -> str:
+        return self.saver.get_next_version(current, channel)
+
+
+# ----------------------------
+# Backends
+# ----------------------------
+
+# The latest checkpoint of a thread and its number of pending writes, through the primary keys
+LATEST_CHECKPOINT_SQL = """
+SELECT c.checkpoint_id, (
+    SELECT count(*) FROM {writes} w
+    WHERE w.thread_id = c.thread_id AND w.checkpoint_ns = c.checkpoint_ns AND w.checkpoint_id = c.checkpoint_id
+) AS writes
+FROM checkpoints c
+WHERE c.thread_id = {param} AND c.checkpoint_ns = {param}
+ORDER BY c.checkpoint_id DESC
+LIMIT 1
+"""
+
+# Ranks the checkpoints of each thread from newest to oldest. Checkpoint IDs are time-ordered UUIDs.
+RANKED_CHECKPOINTS_SQL = """
+SELECT thread_id, checkpoint_ns, checkpoint_id FROM (
+    SELECT thread_id, checkpoint_ns, checkpoint_id,
+           ROW_NUMBER() OVER (PARTITION BY thread_id, checkpoint_ns ORDER BY checkpoint_id DESC) AS rank
+    FROM checkpoints
+) ranked WHERE rank > {keep_last}
+"""
+
+
+@asynccontextmanager
+async def postgres_connection(saver) -> AsyncIterator[Any]:
+    from psycopg import AsyncConnection
+    # The saver holds either a connection or a pool
+    if isinstance(saver.conn, AsyncConnection):
+        yield saver.conn
+    else:
+        async with saver.conn.connection() as conn:
+            yield conn
+
+
+async def latest_sqlite(saver, thread_id: str, checkpoint_ns: str) -> Optional[tuple[str, int]]:
+    async with saver.lock, saver.conn.execute(LATEST_CHECKPOINT_SQL.format(writes="writes", param="?"), (thread_id, checkpoint_ns)) as cur:
+        row = await cur.fetchone()
+    return (row[0], row[1]) if row else None
+
+
+async def latest_postgres(saver, thread_id: str, checkpoint_ns: str) -> Optional[tuple[str, int]]:
+    async with saver.lock, postgres_connection(saver) as conn:
+        cur = await conn.execute(LATEST_CHECKPOINT_SQL.format(writes="checkpoint_writes", param="%s"), (thread_id, checkpoint_ns))
+        row = await cur.fetchone()
+    if row is None:
+        return None
+    # Rows are dicts with the row factory of AsyncPostgresSaver.from_conn_string
+    return (str(row["checkpoint_id"]), row["writes"]) if isinstance(row, dict) else (str(row[0]), row[1])
+
+
+LATEST_CHECKPOINT_READERS = {
+    "AsyncSqliteSaver": latest_sqlite,
+    "AsyncPostgresSaver": latest_postgres,
+}
+
+
+async def compact_checkpoints(checkpointer: BaseCheckpointSaver, keep_last: int = 1) -> None:
+    """
+    Delete all but the newest `keep_last` checkpoints of every thread, along with their pending writes.
+    The latest state of each thread is kept, older history is no longer available for time travel.
+
+    Args:
+        checkpointer: A checkpoint saver from `open_checkpointer`.
+        keep_last: The number of checkpoints to keep per thread, at least 1.
+    """
+    if keep_last < 1:
+        raise ValueError("At least the latest checkpoint of each thread must be kept")
+    saver = checkpointer.saver if isinstance(checkpointer, CachedCheckpointSaver) else checkpointer
+    if isinstance(saver, MemorySaver):
+        compact_memory(saver, keep_last)
+    elif type(saver).__name__ == "AsyncSqliteSaver":
+        await compact_sqlite(saver, keep_last)
+    else:
+        await compact_postgres(saver, keep_last)
+
+
+def compact_memory(saver: MemorySaver, keep_last: int) -> None:
+    referenced = set()
+    for thread_id, namespaces in saver.storage.items():
+        for checkpoint_ns, checkpoints in namespaces.items():
+            for checkpoint_id in sorted(checkpoints, reverse=True)[keep_last:]:
+                del checkpoints[checkpoint_id]
+                saver.writes.pop((thread_id, checkpoint_ns, checkpoint_id), None)
+            for saved_checkpoint, _, _ in checkpoints.values():
+                versions = saver.serde.loads_typed(saved_checkpoint)["channel_versions"]
+                referenced.update((thread_id, checkpoint_ns, channel, version) for channel, version in versions.items())
+    # Channel values are stored once per version and shared between checkpoints
+    for key in [key for key in saver.blobs if key not in referenced]:
+        del saver.blobs[key]
+
+
+async def compact_sqlite(saver, keep_last: int) -> None:
+    async with saver.lock:
+        await saver.conn.execute(
+            "DELETE FROM checkpoints WHERE (thread_id, checkpoint_ns, checkpoint_id) IN ("
+            + RANKED_CHECKPOINTS_SQL.format(keep_last=int(keep_last)) + ")"
+        )
+        await saver.conn.execute(
+            """
+            DELETE FROM writes WHERE NOT EXISTS (
+                SELECT 1 FROM checkpoints c
+                WHERE c.thread_id = writes.thread_id
+                AND c.checkpoint_ns = writes.checkpoint_ns
+                AND c.checkpoint_id = writes.checkpoint_id
+            )
+            """
+        )
+        await saver.conn.commit()
+
+
+async def compact_postgres(saver, keep_last: int) -> None:
+    statements = [
+        "DELETE FROM checkpoints WHERE (thread_id, checkpoint_ns, checkpoint_id) IN ("
+        + RANKED_CHECKPOINTS_SQL.format(keep_last=int(keep_last)) + ")",
+        """
+        DELETE FROM checkpoint_writes w WHERE NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = w.thread_id
+            AND c.checkpoint_ns = w.checkpoint_ns
+            AND c.checkpoint_id = w.checkpoint_id
+        )
+        """,
+        # Channel values are stored once per version and shared between checkpoints
+        """
+        DELETE FROM checkpoint_blobs b WHERE NOT EXISTS (
+            SELECT 1 FROM checkpoints c
+            WHERE c.thread_id = b.thread_id
+            AND c.checkpoint_ns = b.checkpoint_ns
+            AND c.checkpoint -> 'channel_versions' ->> b.channel = b.version
+        )
+        """,
+    ]
+
+    async with saver.lock, postgres_connection(saver) as conn, conn.transaction():
+        for statement in statements:
+            await conn.execute(statement)
+
+
+@asynccontextmanager
+async def open_checkpointer(
+        uri: Optional[str] = None,
+        max_cached_threads: int = 128,
+        keep_last: Optional[int] = None
+        ) -> AsyncIterator[BaseCheckpointSaver]:
+    """
+    Open the checkpoint backend for the given URI.
+
+    Args:
+        uri: A postgres connection string, a SQLite file path (optionally prefixed with `sqlite:///`),
+            or None to read it from the CHECKPOINT_URI environment variable.
+            Falls back to an in-memory saver when no URI is configured.
+        max_cached_threads: The number of threads kept in memory.
+        keep_last: Compact a persistent backend on opening, keeping this many checkpoints per thread,
+            see `compact_checkpoints`. Read from CHECKPOINT_KEEP_LAST by default, 0 keeps every checkpoint.
+
+    Yields:
+        The checkpoint saver. It is closed when the context exits.
+    """
+    uri = uri or os.getenv("CHECKPOINT_URI")
+    if keep_last is None:
+        keep_last = int(os.getenv("CHECKPOINT_KEEP_LAST", "0"))
+
+    if not uri:
+        yield MemorySaver()
+        return
+
+    if uri.startswith(("postgres://", "postgresql://")):
+        from langgraph.checkpoint.postgres.aio import AsyncPostgresSaver
+        open_saver = AsyncPostgresSaver.from_conn_string(uri)
+    else:
+        from langgraph.checkpoint.sqlite.aio import AsyncSqliteSaver
+        open_saver = AsyncSqliteSaver.from_conn_string(uri.removeprefix("sqlite:///"))
+
+    async with open_saver as saver:
+        await saver.setup()
+        if keep_last:
+            await compact_checkpoints(saver, keep_last)
+        yield CachedCheckpointSaver(saver, max_cached_threads)
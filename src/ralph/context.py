@@ -0,0 +1,223 @@
+"""
+This file manages the context window sent to the LLM on every assistant turn.
+Old tool outputs are truncated and earlier turns are folded into a rolling summary,
+so the prompt stays within a token budget as a campaign grows.
+"""
+
+from typing import List, Optional, Sequence
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import (
+    AIMessage,
+    BaseMessage,
+    HumanMessage,
+    RemoveMessage,
+    SystemMessage,
+    ToolMessage,
+    get_buffer_string
+)
+from langchain_core.messages.utils import count_tokens_approximately
+from langgraph.constants import TAG_NOSTREAM
+from ralph.llm_client import LLMClient
+from ralph.metrics import record_llm_usage, span
+import logging
+
+
+logger = logging.getLogger(__name__)
+
+
+SUMMARY_PROMPT = """You are maintaining a running summary of a conversation between a marketing team member and Ralph, a CRM marketing assistant.
+
+Update the summary below with the new messages. Keep every fact needed to continue the work: customer IDs, campaign IDs and names, segment findings, emails already sent and decisions made. Be concise.
+
+<CURRENT_SUMMARY>
+{summary}
+</CURRENT_SUMMARY>
+
+<NEW_MESSAGES>
+{messages}
+</NEW_MESSAGES>
+
+Respond with the updated summary only."""
+
+
+def truncate_tool_messages(messages: Sequence[BaseMessage], keep_recent: int, max_chars: int) -> List[BaseMessage]:
+    """
+    Truncate the content of all but the `keep_recent` most recent tool messages to `max_chars` characters.
+    The messages in state are left untouched, truncated copies are returned.
+    """
+    tool_message_indexes = [i for i, message in enumerate(messages) if isinstance(message, ToolMessage)]
+    old_indexes = set(tool_message_indexes[:-keep_recent] if keep_recent else tool_message_indexes)
+
+    truncated = []
+    for i, message in enumerate(messages):
+        content = message.content
+        if i in old_indexes and isinstance(content, str) and len(content) > max_chars:
+            message = message.model_copy(update={
+                "content": f"{content[:max_chars]}\n... [truncated {len(content) - max_chars} characters]"
+            })
+        truncated.append(message)
+    return truncated
+
+
+class TokenCounter:
+    """
+    Approximate token counts of messages, remembered per message.
+
+    The history is re-read from the checkpoint on every turn, so counts are keyed
+    by message ID and content length rather than by object. Only messages new
+    since the last turn, or truncated differently, are counted again.
+    """
+
+    def __init__(self, max_entries: int = 100_000):
+        self.max_entries = max_entries
+        self.counts: dict[tuple, int] = {}
+
+    def count_message(self, message: BaseMessage) -> int:
+        if message.id is None or not isinstance(message.content, str):
+            return count_tokens_approximately([message])
+
+        key = (message.id, len(message.content))
+        count = self.counts.get(key)
+        if count is None:
+            count = count_tokens_approximately([message])
+            if len(self.counts) >= self.max_entries:
+                # Drop the oldest entry, dicts keep insertion order
+                del self.counts[next(iter(self.counts))]
+            self.counts[key] = count
+        return count
+
+    def count(self, messages: Sequence[BaseMessage]) -> int:
+        return sum(self.count_message(message) for message in messages)
+
+
+def split_points(messages: Sequence[BaseMessage]) -> List[int]:
+    """
+    Find the indexes the history can be split at without separating an AI tool call from its tool messages.
+
+    These are the human messages, and the AI messages that come after every earlier tool call was
+    answered, i.e. after a complete AI→tool messages group or an AI message without tool calls.
+    A campaign runs as many tool round-trips within a single human turn, so it can be split too.
+    """
+    points = []
+    pending = set()
+    for i, message in enumerate(messages):
+        if isinstance(message, HumanMessage):
+            # Calls left unanswered before a human message never will be, they don't pin the history
+            pending.clear()
+        if i > 0 and not pending and not isinstance(message, ToolMessage):
+            points.append(i)
+        if isinstance(message, AIMessage):
+            pending.update(tool_call["id"] for tool_call in message.tool_calls)
+        elif isinstance(message, ToolMessage):
+            pending.discard(message.tool_call_id)
+    return points
+
+
+def find_summary_split(messages: Sequence[BaseMessage], keep_tokens: int, counter: TokenCounter | None = None) -> int:
+    """
+    Find the index of the first message to keep verbatim, at one of the `split_points`.
+    Returns 0 when nothing can be summarised.
+    """
+    counter = counter or TokenCounter()
+    points = split_points(messages)
+    if not points:
+        return 0
+
+    # Tokens from each message to the end of the history
+    suffix_tokens = [0] * (len(messages) + 1)
+    for i in range(len(messages) - 1, -1, -1):
+        suffix_tokens[i] = suffix_tokens[i + 1] + counter.count_message(messages[i])
+
+    for i in points:
+        if suffix_tokens[i] <= keep_tokens:
+            return i
+
+    # Even the latest exchange is over budget, keep at least that
+    return points[-1]
+
+
+class ContextManager:
+    """
+    Builds the prompt for each assistant turn within a token budget.
+
+    Args:
+        llm: The model used to write the rolling summary. It should not have tools bound.
+        token_budget: The number of prompt tokens above which earlier turns are summarised.
+        keep_tokens: The number of tokens of recent turns kept verbatim when summarising.
+        max_tool_output_chars: The length old tool outputs are truncated to.
+        keep_tool_outputs: The number of most recent tool outputs that are never truncated.
+        llm_client: The client the summaries are requested through, so they count towards the shared limits.
+    """
+
+    def __init__(
+            self,
+            llm: BaseChatModel,
+            token_budget: int = 16000,
+            keep_tokens: int = 6000,
+            max_tool_output_chars: int = 2000,
+            keep_tool_outputs: int = 4,
+            llm_client: Optional[LLMClient] = None
+            ):
+        self.llm = llm
+        self.token_budget = token_budget
+        self.keep_tokens = keep_tokens
+        self.max_tool_output_chars = max_tool_output_chars
+        self.keep_tool_outputs = keep_tool_outputs
+        self.token_counter = TokenCounter()
+        self.llm_client = llm_client or LLMClient(max_retries=0)
+
+    def build_system_message(self, system_prompt: str, summary: str) -> SystemMessage:
+        if not summary:
+            return SystemMessage(content=system_prompt)
+        # The summary goes last so the system prompt stays a stable prefix
+        return SystemMessage(content=f"{system_prompt}\n<CONVERSATION_SUMMARY>\n{summary}\n</CONVERSATION_SUMMARY>\n")
+
+    async def summarize(self, summary: str, messages: Sequence[BaseMessage]) -> str:
+        with span("llm", "summary", messages=len(messages)) as attributes:
+            response = await self.llm_client.ainvoke(
+                self.llm,
+                SUMMARY_PROMPT.format(summary=summary or "None yet.", messages=get_buffer_string(messages)),
+                config={"tags": [TAG_NOSTREAM]}
+            )
+            record_llm_usage(attributes, response)
+        return response.content
+
+    async def prepare(self, system_prompt: str, summary: str, messages: Sequence[BaseMessage]) -> tuple[List[BaseMessage], dict]:
+        """
+        Build the prompt messages for this turn.
+
+        Returns:
+            The prompt messages and a state update holding the new summary and
+            the removal of summarised messages, empty if nothing was summarised.
+        """
+        messages = list(messages)
+        update = {}
+        trimmed = truncate_tool_messages(messages, self.keep_tool_outputs, self.max_tool_output_chars)
+        prompt = [self.build_system_message(system_prompt, summary)] + trimmed
+
+        if self.token_counter.count(prompt) > self.token_budget:
+            split = find_summary_split(trimmed, self.keep_tokens, self.token_counter)
+            if split:
+                summary = await self.summarize(summary, trimmed[:split])
+                update = {
+                    "summary": summary,
+                    "messages": [RemoveMessage(id=message.id) for message in messages[:split]]
+                }
+                prompt = [self.build_system_message(system_prompt, summary)] + trimmed[split:]
+
+        if logger.isEnabledFor(logging.INFO):
+            logger.info(
+                "Prompt tokens: %d (full history: %d)",
+                self.token_counter.count(prompt),
+                self.token_counter.count([SystemMessage(content=system_prompt)] + messages)
+            )
+        return prompt, update
+
+
+def log_token_usage(response: BaseMessage) -> None:
+    """
+    Log the prompt token count reported by the provider for a response.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if usage:
+        logger.info("Prompt tokens reported by provider: %d", usage.get("input_tokens", 0))
@@ -1,89 +1,198 @@
 from pydantic import BaseModel
-from typing import Annotated, List, Literal
+from typing import Annotated, List, Literal, Optional
 from langchain_core.messages import (
     BaseMessage,
-    SystemMessage,
     AIMessage,
-    ToolMessage
+    RemoveMessage,
+    ToolMessage,
+    convert_to_messages,
+    message_chunk_to_message
 )
+from langchain_core.language_models import BaseChatModel
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool
 from langchain_openai import ChatOpenAI 
 from langgraph.types import Command, interrupt
 from langgraph.graph.message import add_messages
 from langgraph.graph import StateGraph, START, END
-from langgraph.prebuilt import ToolNode
+from langgraph.checkpoint.base import BaseCheckpointSaver
 from langgraph.checkpoint.memory import MemorySaver
-from langchain_mcp_adapters.client import MultiServerMCPClient
-from ralph.my_mcp.config import mcp_config
-from ralph.prompts import ralph_system_prompt
+from ralph.my_mcp.config import load_mcp_config
+from ralph.my_mcp.registry import get_tool_registry
+from ralph.context import ContextManager, log_token_usage
+from ralph.llm_cache import LLMCache
+from ralph.llm_client import LLMClient, get_http_client, get_llm_client
+from ralph.metrics import record_llm_usage, span
+from ralph.prompts import build_system_prompt
+from ralph.tool_executor import make_tool_executor_node
 import json
 import os
+import uuid
+
+
+def append_messages(left: List[BaseMessage], right) -> List[BaseMessage]:
+    """
+    Reducer for the message history, with the same behaviour as `add_messages`.
+
+    Nodes return only the messages they add, which almost always have new IDs. Those are
+    appended after a single pass over the existing IDs, instead of re-merging the whole
+    history. Updates that replace or remove existing messages fall back to `add_messages`.
+    """
+    if not isinstance(right, list):
+        right = [right]
+    right = [message_chunk_to_message(message) for message in convert_to_messages(right)]
+    for message in right:
+        if message.id is None:
+            message.id = str(uuid.uuid4())
+
+    if any(isinstance(message, RemoveMessage) for message in right):
+        return add_messages(left, right)
+
+    existing_ids = {message.id for message in left}
+    if any(message.id in existing_ids for message in right) or len({message.id for message in right}) < len(right):
+        return add_messages(left, right)
+    return left + right
 
 
 class AgentState(BaseModel):
     """
     The state of the agent.
+
+    Send each turn as a dict of the fields it changes, e.g. {"messages": [...], "yolo_mode": ...}.
+    An AgentState input writes every field, so its empty summary would erase the rolling summary
+    of the messages the context manager already removed.
     """
-    messages: Annotated[List[BaseMessage], add_messages] = []
-    protected_tools: List[str] = ["create_campaign", "send_campaign_email"]
+    messages: Annotated[List[BaseMessage], append_messages] = []
+    summary: str = ""
+    protected_tools: List[str] = ["create_campaign", "send_campaign_email", "send_campaign_emails", "send_templated_campaign_emails"]
     yolo_mode: bool = False
 
 
-async def build_graph():
+async def build_graph(
+        checkpointer: Optional[BaseCheckpointSaver] = None,
+        max_tool_concurrency: int = 16,
+        tool_timeout: float = 120.0,
+        token_budget: int = 16000,
+        llm_cache: Optional[LLMCache] = None,
+        mcp_profile: Optional[str] = None,
+        model: Optional[BaseChatModel] = None,
+        tools: Optional[List[BaseTool]] = None,
+        inline_schema: Optional[bool] = None,
+        llm_client: Optional[LLMClient] = None
+        ):
     """
     Build the LangGraph application.
+
+    Args:
+        checkpointer: The checkpoint saver used to persist threads, see `ralph.checkpoint.open_checkpointer`.
+            Defaults to an in-memory saver.
+        max_tool_concurrency: The maximum number of tool calls from one assistant turn run at the same time.
+        tool_timeout: The number of seconds a single tool call may take.
+        token_budget: The number of prompt tokens above which earlier turns are summarised.
+        llm_cache: Cache for LLM responses. Defaults to the cache configured by the environment, see `LLMCache.from_env`.
+        mcp_profile: The MCP config profile to load the tools from, see `ralph.my_mcp.config.load_mcp_config`.
+        model: The chat model to use instead of the NVIDIA endpoint, e.g. a fake model for load tests.
+        tools: The tools to use instead of the tools of the MCP servers.
+        inline_schema: Whether to send the full database schema in the system prompt, or to let the model
+            fetch it with the `describe_table` tool. Defaults to the PROMPT_INLINE_SCHEMA environment variable, or true.
+        llm_client: The client LLM calls are made through. Defaults to the client shared by every graph
+            of the running event loop, see `ralph.llm_client.get_llm_client`.
     """
-    client = MultiServerMCPClient(connections=mcp_config["mcpServers"])
-    tools = await client.get_tools()
+    if tools is None:
+        # MCP servers are started lazily and shared by every graph built in this event loop
+        tools = await get_tool_registry(load_mcp_config(mcp_profile).connections()).get_tools()
+    llm_cache = llm_cache or LLMCache.from_env()
+    llm_client = llm_client or get_llm_client()
+    if inline_schema is None:
+        inline_schema = os.getenv("PROMPT_INLINE_SCHEMA", "true").lower() != "false"
+    # Only the sections for the loaded tools are sent, the prompt is the same on every turn
+    system_prompt = build_system_prompt((tool.name for tool in tools), inline_schema=inline_schema)
 
     # ✅ NVIDIA model using OpenAI-compatible endpoint
-    llm = ChatOpenAI(
+    base_llm = model or ChatOpenAI(
         model="nvidia/llama-3.1-nemotron-nano-4b-v1.1",
         base_url="https://integrate.api.nvidia.com/v1",
         api_key=os.getenv("NVIDIA_API_KEY"),  # 🔐 Use your NVIDIA key
-    ).bind_tools(tools)
-
-    def assistant_node(state: AgentState) -> AgentState:
-        response = llm.invoke(
-            [SystemMessage(content=ralph_system_prompt)] +
-            state.messages
-        )
-        state.messages = state.messages + [response]
-        return state
+        cache=llm_cache,
+        http_async_client=get_http_client(),
+        # Retries are made by the LLM client, under the shared limits
+        max_retries=0,
+    )
+    llm = base_llm.bind_tools(tools)
+    context_manager = ContextManager(base_llm, token_budget=token_budget, llm_client=llm_client)
+
+    async def assistant_node(state: AgentState, config: RunnableConfig) -> dict:
+        with span("node", "assistant_node"):
+            prompt, update = await context_manager.prepare(system_prompt, state.summary, state.messages)
+            with span("llm", "assistant", messages=len(prompt)) as attributes:
+                response = await llm_client.ainvoke(llm, prompt, config)
+                record_llm_usage(attributes, response)
+            log_token_usage(response)
+            return {**update, "messages": update.get("messages", []) + [response]}
 
     def human_tool_review_node(state: AgentState) -> Command[Literal["assistant_node", "tools"]]:
         last_message = state.messages[-1]
-        tool_call = last_message.tool_calls[-1]
-
-        human_review: dict = interrupt({
-            "message": "Your input is required for the following tool:",
-            "tool_call": tool_call
-        })
+        tool_calls = []
+        feedback_messages = []
+        updated = False
+
+        # Every protected tool call gets its own review, one interrupt at a time
+        for tool_call in last_message.tool_calls:
+            if tool_call["name"] not in state.protected_tools:
+                tool_calls.append(tool_call)
+                continue
+
+            human_review: dict = interrupt({
+                "message": "Your input is required for the following tool:",
+                "tool_call": tool_call
+            })
+
+            review_action = human_review["action"]
+            review_data = human_review.get("data")
+
+            if review_action == "update":
+                tool_call = {
+                    "id": tool_call["id"],
+                    "name": tool_call["name"],
+                    "args": json.loads(review_data)
+                }
+                updated = True
 
-        review_action = human_review["action"]
-        review_data = human_review.get("data")
+            elif review_action == "feedback":
+                feedback_messages.append(ToolMessage(
+                    content=review_data,
+                    name=tool_call["name"],
+                    tool_call_id=tool_call["id"]
+                ))
 
-        if review_action == "continue":
-            return Command(goto="tools")
+            tool_calls.append(tool_call)
 
-        elif review_action == "update":
-            updated_message = AIMessage(
+        messages = []
+        if updated:
+            messages.append(AIMessage(
                 content=last_message.content,
-                tool_calls=[{
-                    "id": tool_call["id"],
-                    "name": tool_call["name"],
-                    "args": json.loads(review_data)
-                }],
+                tool_calls=tool_calls,
                 id=last_message.id
-            )
-            return Command(goto="tools", update={"messages": [updated_message]})
-
-        elif review_action == "feedback":
-            tool_message = ToolMessage(
-                content=review_data,
-                name=tool_call["name"],
-                tool_call_id=tool_call["id"]
-            )
-            return Command(goto="assistant_node", update={"messages": [tool_message]})
+            ))
+        messages.extend(feedback_messages)
+
+        # Tool calls that received feedback are already answered, the executor skips them
+        if len(feedback_messages) == len(tool_calls):
+            return Command(goto="assistant_node", update={"messages": messages})
+        return Command(goto="tools", update={"messages": messages})
+
+    tool_executor_node = make_tool_executor_node(tools, max_concurrency=max_tool_concurrency, timeout=tool_timeout)
+
+    async def tools_node(state: AgentState, config) -> dict:
+        with span("node", "tools"):
+            update = await tool_executor_node(state, config)
+        # Cached answers are keyed on the table versions, but protected tools also write campaign_emails, which has none
+        if llm_cache and any(
+            message.name in state.protected_tools and message.status != "error"
+            for message in update["messages"]
+        ):
+            llm_cache.clear()
+        return update
 
     def assistant_router(state: AgentState) -> str:
         last_message = state.messages[-1]
@@ -98,13 +207,13 @@ async def build_graph():
     builder = StateGraph(AgentState)
     builder.add_node(assistant_node)
     builder.add_node(human_tool_review_node)
-    builder.add_node("tools", ToolNode(tools))
+    builder.add_node("tools", tools_node)
 
     builder.add_edge(START, "assistant_node")
     builder.add_conditional_edges("assistant_node", assistant_router, ["tools", "human_tool_review_node", END])
     builder.add_edge("tools", "assistant_node")
 
-    return builder.compile(checkpointer=MemorySaver())
+    return builder.compile(checkpointer=checkpointer or MemorySaver())
 
 
 def inspect_graph(graph):
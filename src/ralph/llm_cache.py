@@ -0,0 +1,279 @@
+"""
+This file provides an opt-in cache for LLM responses.
+Identical prompts, with the same message history and tools, against unchanged data are answered
+from the cache instead of calling the model again. Entries are kept in memory with LRU and TTL
+eviction and can be persisted to a SQLite file so they survive restarts.
+
+Like the query and profile caches, entries are keyed on the versions of the CRM tables, see
+db/migration-table-versions.sql, so a change made by any process, e.g. an MCP server or a
+data load, stops earlier answers from being served. Hits, misses and evictions are exported
+in the Prometheus text format, see ralph/metrics.py.
+"""
+
+from collections import OrderedDict
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Optional, Sequence
+from langchain_core.caches import RETURN_VAL_TYPE, BaseCache
+from langchain_core.messages import message_to_dict, messages_from_dict
+from langchain_core.outputs import ChatGeneration, Generation
+from langchain_core.runnables.config import run_in_executor
+from ralph.metrics import registry
+import hashlib
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+LLM_CACHE_LOOKUPS = registry.counter("ralph_llm_cache_lookups_total", "LLM cache lookups, by whether they were answered from the cache.")
+LLM_CACHE_EVICTIONS = registry.counter("ralph_llm_cache_evictions_total", "LLM responses dropped from memory to stay within the size of the cache.")
+LLM_CACHE_ENTRIES = registry.gauge("ralph_llm_cache_entries", "LLM responses kept in memory.")
+
+
+# The cache, prompt, llm string and table versions of the latest async lookup of the current task.
+# LangChain awaits the update of a miss in the same task, so the answer is stored under the versions
+# read before it was generated, never under those another session read meanwhile.
+LOOKUP_VERSIONS: ContextVar[Optional[tuple[int, str, str, Optional[dict[str, int]]]]] = ContextVar("llm_cache_lookup_versions", default=None)
+
+# Message fields that differ between otherwise identical conversations
+VOLATILE_MESSAGE_FIELDS = ("id", "usage_metadata", "response_metadata")
+
+
+def normalize_prompt(prompt: str) -> str:
+    """
+    Drop message IDs and response metadata from a serialised prompt, so a conversation
+    replayed in another thread, or with earlier answers taken from the cache, has the same key.
+    """
+    try:
+        messages = json.loads(prompt)
+    except ValueError:
+        return prompt
+    if not isinstance(messages, list):
+        return prompt
+
+    for message in messages:
+        kwargs = message.get("kwargs") if isinstance(message, dict) else None
+        if isinstance(kwargs, dict):
+            for field in VOLATILE_MESSAGE_FIELDS:
+                kwargs.pop(field, None)
+    return json.dumps(messages, sort_keys=True)
+
+
+def dump_generations(generations: Sequence[Generation]) -> str:
+    # Cached messages are stored without an ID, every hit is given a fresh one
+    return json.dumps([
+        {"message": message_to_dict(generation.message.model_copy(update={"id": None}))}
+        if isinstance(generation, ChatGeneration)
+        else {"text": generation.text}
+        for generation in generations
+    ])
+
+
+def load_generations(value: str) -> list[Generation]:
+    return [
+        ChatGeneration(message=messages_from_dict([generation["message"]])[0]) if "message" in generation
+        else Generation(text=generation["text"])
+        for generation in json.loads(value)
+    ]
+
+
+def table_versions_reader(uri: str) -> Callable[[], Awaitable[dict[str, int]]]:
+    """
+    Get a function that reads the versions of the CRM tables from the database at `uri`.
+    """
+    from ralph.my_mcp.servers.db import create_db_engine, create_session_factory, get_table_versions
+    from ralph.my_mcp.servers.query_cache import VERSIONED_TABLES
+
+    session_factory = create_session_factory(create_db_engine(uri))
+
+    async def read_versions() -> dict[str, int]:
+        async with session_factory() as session:
+            return await get_table_versions(session, VERSIONED_TABLES)
+
+    return read_versions
+
+
+class LLMCache(BaseCache):
+    """
+    LRU cache of LLM responses with a time to live, optionally backed by SQLite.
+
+    LangChain passes the serialised messages as the prompt and the model parameters,
+    including the bound tool schemas, as the llm string, so both are part of the key.
+    With `read_versions`, the table versions it returns are part of the key too. They are
+    read on every async lookup, with one small query, and an async update stores the answer
+    under the versions its own lookup read, if they are still current. If they can't be read,
+    nothing is cached, and the sync API, which can't read them, doesn't cache either.
+    Call `clear` when data without a version changes.
+
+    Args:
+        max_entries: Responses kept in memory.
+        ttl: Seconds a response stays valid.
+        path: SQLite file responses are persisted to.
+        read_versions: Async function returning the versions of the tables answers depend on.
+    """
+
+    def __init__(
+            self,
+            max_entries: int = 256,
+            ttl: float = 3600.0,
+            path: Optional[str] = None,
+            read_versions: Optional[Callable[[], Awaitable[dict[str, int]]]] = None
+            ):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.read_versions = read_versions
+        self.entries: OrderedDict[str, tuple[float, str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.Lock()
+
+        self.db = None
+        if path:
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.execute("CREATE TABLE IF NOT EXISTS llm_cache (key TEXT PRIMARY KEY, created_at REAL, value TEXT)")
+            self.db.commit()
+
+    @classmethod
+    def from_env(cls) -> Optional["LLMCache"]:
+        """
+        Create the cache configured by the environment, or None if caching is disabled.
+
+        Environment variables:
+            LLM_CACHE: Set to true to enable the cache (default false).
+            LLM_CACHE_SIZE: Responses kept in memory (default 256).
+            LLM_CACHE_TTL: Seconds a response stays valid (default 3600).
+            LLM_CACHE_PATH: SQLite file responses are persisted to, in memory only if empty.
+            SUPABASE_URI: The database the table versions are read from.
+        """
+        if os.getenv("LLM_CACHE", "false").lower() not in ("1", "true", "yes"):
+            return None
+        uri = os.getenv("SUPABASE_URI")
+        return cls(
+            max_entries=int(os.getenv("LLM_CACHE_SIZE", "256")),
+            ttl=float(os.getenv("LLM_CACHE_TTL", "3600")),
+            path=os.getenv("LLM_CACHE_PATH") or None,
+            read_versions=table_versions_reader(uri) if uri else None,
+        )
+
+    @staticmethod
+    def _key(prompt: str, llm_string: str, versions: dict[str, int]) -> str:
+        return hashlib.sha256(
+            f"{llm_string}\n{json.dumps(versions, sort_keys=True)}\n{normalize_prompt(prompt)}".encode()
+        ).hexdigest()
+
+    async def _read_versions(self) -> Optional[dict[str, int]]:
+        """
+        Returns:
+            The table versions, empty without `read_versions`, or None if they can't be read.
+        """
+        if self.read_versions is None:
+            return {}
+        try:
+            return await self.read_versions()
+        except Exception as e:
+            logger.warning("Could not read the table versions, the LLM cache is bypassed: %r", e)
+            return None
+
+    def _sync_versions(self) -> Optional[dict[str, int]]:
+        return {} if self.read_versions is None else None
+
+    def _expired(self, created_at: float) -> bool:
+        return time.time() - created_at > self.ttl
+
+    def _store(self, key: str, created_at: float, value: str) -> None:
+        self.entries[key] = (created_at, value)
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
+            self.evictions += 1
+            LLM_CACHE_EVICTIONS.inc()
+        LLM_CACHE_ENTRIES.set(len(self.entries))
+
+    def lookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        return self._lookup(prompt, llm_string, self._sync_versions())
+
+    def _lookup(self, prompt: str, llm_string: str, versions: Optional[dict[str, int]]) -> Optional[RETURN_VAL_TYPE]:
+        if versions is None:
+            return None
+        key = self._key(prompt, llm_string, versions)
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None and self.db is not None:
+                entry = self.db.execute("SELECT created_at, value FROM llm_cache WHERE key = ?", (key,)).fetchone()
+                if entry is not None:
+                    self._store(key, *entry)
+
+            if entry is None or self._expired(entry[0]):
+                if entry is not None:
+                    self.entries.pop(key, None)
+                self.misses += 1
+                LLM_CACHE_LOOKUPS.inc(outcome="miss")
+                return None
+
+            self.entries.move_to_end(key)
+            self.hits += 1
+            LLM_CACHE_LOOKUPS.inc(outcome="hit")
+        return load_generations(entry[1])
+
+    async def alookup(self, prompt: str, llm_string: str) -> Optional[RETURN_VAL_TYPE]:
+        versions = await self._read_versions()
+        LOOKUP_VERSIONS.set((id(self), prompt, llm_string, versions))
+        if versions is None:
+            return None
+        # The SQLite file is read off the event loop
+        return await run_in_executor(None, self._lookup, prompt, llm_string, versions)
+
+    def update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        self._update(prompt, llm_string, return_val, self._sync_versions())
+
+    def _update(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE, versions: Optional[dict[str, int]]) -> None:
+        if versions is None:
+            return
+        key = self._key(prompt, llm_string, versions)
+        created_at = time.time()
+        value = dump_generations(return_val)
+        with self.lock:
+            self._store(key, created_at, value)
+            if self.db is not None:
+                self.db.execute("INSERT OR REPLACE INTO llm_cache VALUES (?, ?, ?)", (key, created_at, value))
+                self.db.commit()
+
+    async def aupdate(self, prompt: str, llm_string: str, return_val: RETURN_VAL_TYPE) -> None:
+        lookup = LOOKUP_VERSIONS.get()
+        if lookup is None or lookup[:3] != (id(self), prompt, llm_string) or lookup[3] is None:
+            return
+        versions = lookup[3]
+        # A table that changed while the model answered may or may not be reflected in the answer
+        if self.read_versions is not None and await self._read_versions() != versions:
+            return
+        await run_in_executor(None, self._update, prompt, llm_string, return_val, versions)
+
+    def clear(self, **kwargs: Any) -> None:
+        with self.lock:
+            self.entries.clear()
+            LLM_CACHE_ENTRIES.set(0)
+            if self.db is not None:
+                self.db.execute("DELETE FROM llm_cache")
+                self.db.commit()
+        logger.info("LLM cache cleared")
+
+    async def aclear(self, **kwargs: Any) -> None:
+        await run_in_executor(None, self.clear, **kwargs)
+
+    def stats(self) -> dict:
+        """
+        Get the hit and miss counts of this cache, the counters of /metrics add up those of every cache of the process.
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "entries": len(self.entries),
+        }
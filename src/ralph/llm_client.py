@@ -0,0 +1,228 @@
+"""
+This file calls the LLM without blocking the event loop and shares one connection pool,
+rate limit and concurrency limit between every graph in the process.
+
+Failed calls are retried with jittered exponential backoff, 429 responses also shrink the
+concurrency limit, and a call that is slow to start can optionally be hedged with a second
+request, keeping whichever answers first.
+"""
+
+from typing import Any, Optional
+from weakref import WeakKeyDictionary
+from langchain_core.callbacks import AsyncCallbackHandler, BaseCallbackManager
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import BaseMessage
+from langchain_core.runnables import RunnableConfig
+from ralph.rate_limit import AdaptiveConcurrencyLimiter, TokenBucket
+import asyncio
+import httpx
+import logging
+import openai
+import os
+import random
+
+
+logger = logging.getLogger(__name__)
+
+
+# HTTP and LLM clients are shared per event loop, as their connections and locks belong to the loop they were created on
+_http_clients: WeakKeyDictionary = WeakKeyDictionary()
+_llm_clients: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def get_http_client() -> httpx.AsyncClient:
+    """
+    Get the HTTP client shared by every model of the running event loop, so connections
+    to the endpoint are pooled and kept alive.
+
+    Environment variables:
+        LLM_MAX_CONNECTIONS: Connections open to the endpoint at most (default 100).
+        LLM_TIMEOUT: Seconds a request may take (default 120).
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _http_clients:
+        max_connections = int(os.getenv("LLM_MAX_CONNECTIONS", "100"))
+        _http_clients[loop] = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_connections),
+            timeout=httpx.Timeout(float(os.getenv("LLM_TIMEOUT", "120")), connect=10.0),
+        )
+    return _http_clients[loop]
+
+
+def is_overloaded(error: Exception) -> bool:
+    return getattr(error, "status_code", None) == 429
+
+
+def is_retryable(error: Exception) -> bool:
+    if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+        return True
+    status_code = getattr(error, "status_code", None)
+    return status_code is not None and (status_code in (408, 409, 429) or status_code >= 500)
+
+
+def retry_after(error: Exception) -> Optional[float]:
+    """
+    Get the delay requested by the endpoint in the Retry-After header, if any.
+    """
+    response = getattr(error, "response", None)
+    try:
+        return float(response.headers["retry-after"])
+    except (AttributeError, KeyError, TypeError, ValueError):
+        return None
+
+
+class FirstTokenHandler(AsyncCallbackHandler):
+    """
+    Records whether a streaming call produced its first token.
+    """
+
+    def __init__(self):
+        self.started = asyncio.Event()
+
+    async def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        self.started.set()
+
+
+def add_callback(config: Optional[RunnableConfig], handler: AsyncCallbackHandler) -> RunnableConfig:
+    config = dict(config or {})
+    callbacks = config.get("callbacks")
+    if isinstance(callbacks, BaseCallbackManager):
+        callbacks = callbacks.copy()
+        callbacks.add_handler(handler, inherit=True)
+    else:
+        callbacks = list(callbacks or []) + [handler]
+    config["callbacks"] = callbacks
+    return config
+
+
+class LLMClient:
+    """
+    Makes LLM calls under a shared rate limit and concurrency limit, with retries and optional hedging.
+
+    A call is only retried or hedged before its first token was streamed, so a
+    reply is never shown twice. Hedged requests run without callbacks and the
+    winning reply is returned as a whole.
+
+    Args:
+        rate: Requests per second on average, 0 for no limit.
+        burst: Requests that may be sent at once above the average rate.
+        max_concurrency: The highest number of requests in flight. The limit starts at a quarter of it.
+        max_retries: Retries after a failed call.
+        base_delay: The delay before the first retry in seconds, doubled for each further retry.
+        max_delay: The longest delay between retries in seconds.
+        hedge_after: Seconds without a first token after which a second request is sent. None disables hedging.
+    """
+
+    def __init__(
+            self,
+            rate: float = 0.0,
+            burst: int = 10,
+            max_concurrency: int = 64,
+            max_retries: int = 4,
+            base_delay: float = 0.5,
+            max_delay: float = 20.0,
+            hedge_after: Optional[float] = None
+            ):
+        self.bucket = TokenBucket(rate, burst)
+        self.limiter = AdaptiveConcurrencyLimiter(initial=max(1, max_concurrency // 4), maximum=max_concurrency)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.hedge_after = hedge_after
+        self.stats = {"calls": 0, "retries": 0, "overloaded": 0, "hedged": 0, "hedges_won": 0}
+
+    @classmethod
+    def from_env(cls) -> "LLMClient":
+        """
+        Create a client configured by the LLM_RATE_LIMIT, LLM_BURST, LLM_MAX_CONCURRENCY,
+        LLM_MAX_RETRIES and LLM_HEDGE_AFTER environment variables.
+        """
+        hedge_after = os.getenv("LLM_HEDGE_AFTER", "")
+        return cls(
+            rate=float(os.getenv("LLM_RATE_LIMIT", "0")),
+            burst=int(os.getenv("LLM_BURST", "10")),
+            max_concurrency=int(os.getenv("LLM_MAX_CONCURRENCY", "64")),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", "4")),
+            hedge_after=float(hedge_after) if hedge_after else None,
+        )
+
+    def backoff(self, attempt: int, error: Exception) -> float:
+        # Full jitter, so clients rejected together don't retry together
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+        return max(delay, retry_after(error) or 0.0)
+
+    async def ainvoke(self, llm: BaseChatModel, input: Any, config: Optional[RunnableConfig] = None) -> BaseMessage:
+        """
+        Call the model, waiting for the rate limit and a free slot first.
+        """
+        self.stats["calls"] += 1
+        for attempt in range(self.max_retries + 1):
+            first_token = FirstTokenHandler()
+            await self.bucket.acquire()
+            async with self.limiter.slot():
+                try:
+                    response = await self.invoke_hedged(llm, input, config, first_token)
+                except Exception as e:
+                    if is_overloaded(e):
+                        self.stats["overloaded"] += 1
+                        self.limiter.on_overload()
+                    if first_token.started.is_set() or attempt == self.max_retries or not is_retryable(e):
+                        raise
+                    delay = self.backoff(attempt, e)
+                    logger.warning("LLM call failed with %r, retrying in %.1fs", e, delay)
+                else:
+                    self.limiter.on_success()
+                    return response
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    async def invoke_hedged(
+            self,
+            llm: BaseChatModel,
+            input: Any,
+            config: Optional[RunnableConfig],
+            first_token: FirstTokenHandler
+            ) -> BaseMessage:
+        if self.hedge_after is None:
+            return await llm.ainvoke(input, add_callback(config, first_token))
+
+        primary = asyncio.ensure_future(llm.ainvoke(input, add_callback(config, first_token)))
+
+        tasks = {primary}
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=self.hedge_after)
+            # Hedge only while nothing was streamed yet, and only if the rate limit allows another request now
+            if done or first_token.started.is_set() or not self.bucket.try_acquire():
+                return await primary
+
+            self.stats["hedged"] += 1
+            # An empty list rather than None, which would inherit the node's callbacks and stream the hedge to the client
+            hedge = asyncio.ensure_future(llm.ainvoke(input, {**(config or {}), "callbacks": []}))
+            started = asyncio.ensure_future(first_token.started.wait())
+            tasks |= {hedge, started}
+            done, _ = await asyncio.wait({primary, hedge, started}, return_when=asyncio.FIRST_COMPLETED)
+
+            if started in done or (primary in done and primary.exception() is None):
+                return await primary
+            if hedge in done and hedge.exception() is None:
+                self.stats["hedges_won"] += 1
+                return hedge.result()
+            # One of the requests failed, the other one decides
+            if primary in done:
+                result = await hedge
+                self.stats["hedges_won"] += 1
+                return result
+            return await primary
+        finally:
+            for task in tasks:
+                task.cancel()
+
+
+def get_llm_client() -> LLMClient:
+    """
+    Get the client shared by every graph of the running event loop, configured by the environment.
+    """
+    loop = asyncio.get_running_loop()
+    if loop not in _llm_clients:
+        _llm_clients[loop] = LLMClient.from_env()
+    return _llm_clients[loop]
@@ -0,0 +1,377 @@
+"""
+This file records where the time of a turn goes: graph nodes, LLM calls, tool calls and
+database queries are timed as spans.
+
+Every span is counted in in-process histograms, exported in the Prometheus text format by
+`render_prometheus`. When METRICS_TRACE_PATH is set, each span is also appended to that file
+as one JSON line, which lets the MCP servers, running in their own processes, report their
+database queries too. `profile_turn` collects the spans of one turn for a breakdown.
+"""
+
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from pathlib import Path
+from typing import Any, Iterator, Optional, Sequence
+from langgraph.errors import GraphBubbleUp
+import asyncio
+import json
+import os
+import threading
+import time
+
+
+# Upper bounds of the histogram buckets
+SECONDS_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+TOKEN_BUCKETS = (100, 250, 500, 1000, 2000, 4000, 8000, 16000, 32000)
+BYTES_BUCKETS = (100, 1000, 10_000, 100_000, 1_000_000, 10_000_000)
+
+
+def format_labels(labels: tuple[tuple[str, str], ...], **extra: str) -> str:
+    items = [*labels, *extra.items()]
+    if not items:
+        return ""
+    escaped = (str(value).replace("\\", r"\\").replace('"', r"\"").replace("\n", r"\n") for _, value in items)
+    return "{" + ",".join(f'{name}="{value}"' for (name, _), value in zip(items, escaped)) + "}"
+
+
+class Counter:
+    """
+    A Prometheus counter with labels.
+    """
+
+    type = "counter"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, value: float = 1, **labels: str) -> None:
+        key = tuple(labels.items())
+        self.values[key] = self.values.get(key, 0) + value
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Gauge:
+    """
+    A Prometheus gauge with labels.
+    """
+
+    type = "gauge"
+
+    def __init__(self, name: str, help: str):
+        self.name = name
+        self.help = help
+        self.values: dict[tuple, float] = {}
+
+    def set(self, value: float, **labels: str) -> None:
+        self.values[tuple(labels.items())] = value
+
+    def render(self) -> list[str]:
+        return [f"{self.name}{format_labels(key)} {value}" for key, value in self.values.items()]
+
+
+class Histogram:
+    """
+    A Prometheus histogram with labels and fixed buckets.
+    """
+
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, buckets: Sequence[float]):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        # Per label set: the count of each bucket, non-cumulative, then the +Inf bucket, the sum
+        self.values: dict[tuple, tuple[list[int], list[float]]] = {}
+
+    def observe(self, value: float, **labels: str) -> None:
+        key = tuple(labels.items())
+        series = self.values.get(key)
+        if series is None:
+            series = self.values[key] = ([0] * (len(self.buckets) + 1), [0.0])
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1][0] += value
+
+    def render(self) -> list[str]:
+        lines = []
+        for key, (counts, total) in self.values.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{format_labels(key, le=str(bound))} {cumulative}")
+            lines.append(f"{self.name}_sum{format_labels(key)} {total[0]}")
+            lines.append(f"{self.name}_count{format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    The metrics of the process, by name.
+    """
+
+    def __init__(self):
+        self.metrics: dict[str, Counter | Gauge | Histogram] = {}
+
+    def counter(self, name: str, help: str) -> Counter:
+        return self.metrics.setdefault(name, Counter(name, help))
+
+    def gauge(self, name: str, help: str) -> Gauge:
+        return self.metrics.setdefault(name, Gauge(name, help))
+
+    def histogram(self, name: str, help: str, buckets: Sequence[float] = SECONDS_BUCKETS) -> Histogram:
+        return self.metrics.setdefault(name, Histogram(name, help, buckets))
+
+    def render(self) -> str:
+        lines = []
+        for metric in self.metrics.values():
+            lines.append(f"# HELP {metric.name} {metric.help}")
+            lines.append(f"# TYPE {metric.name} {metric.type}")
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = MetricsRegistry()
+
+SPAN_SECONDS = registry.histogram("ralph_span_duration_seconds", "Duration of graph nodes, LLM calls, tool calls and database queries.")
+SPAN_ERRORS = registry.counter("ralph_span_errors_total", "Graph nodes, LLM calls, tool calls and database queries that failed.")
+LLM_TOKENS = registry.histogram("ralph_llm_tokens", "Tokens per LLM call.", TOKEN_BUCKETS)
+TOOL_PAYLOAD_BYTES = registry.histogram("ralph_tool_payload_bytes", "Size of tool call arguments and results.", BYTES_BUCKETS)
+
+
+def render_prometheus() -> str:
+    """
+    Get the metrics of this process in the Prometheus text format.
+    """
+    return registry.render()
+
+
+# ----------------------------
+# Traces
+# ----------------------------
+
+class TraceWriter:
+    """
+    Appends spans to a JSONL file.
+
+    Every span is written with a single write to a file opened in append mode,
+    so several processes can share the file without interleaving lines.
+    """
+
+    def __init__(self, path: str):
+        self.path = Path(path).expanduser()
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    def write(self, record: dict) -> None:
+        os.write(self.fd, (json.dumps(record, default=str, ensure_ascii=False) + "\n").encode())
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+_trace_writer: Optional[TraceWriter] = None
+_trace_lock = threading.Lock()
+_trace_configured = False
+
+
+def get_trace_writer() -> Optional[TraceWriter]:
+    global _trace_writer, _trace_configured
+    if not _trace_configured:
+        with _trace_lock:
+            if not _trace_configured:
+                path = os.getenv("METRICS_TRACE_PATH")
+                _trace_writer = TraceWriter(path) if path else None
+                _trace_configured = True
+    return _trace_writer
+
+
+def configure_tracing(path: Optional[str]) -> None:
+    """
+    Write the spans of this process to `path`, or stop writing them if None.
+
+    The path is also set as METRICS_TRACE_PATH, so MCP servers started afterwards write their spans to it.
+    """
+    global _trace_writer, _trace_configured
+    with _trace_lock:
+        if _trace_writer is not None:
+            _trace_writer.close()
+        _trace_writer = TraceWriter(path) if path else None
+        _trace_configured = True
+        if path:
+            os.environ["METRICS_TRACE_PATH"] = str(Path(path).expanduser())
+        else:
+            os.environ.pop("METRICS_TRACE_PATH", None)
+
+
+# ----------------------------
+# Spans
+# ----------------------------
+
+# The spans of the turn being profiled, see `profile_turn`
+_turn_spans: ContextVar[Optional[list[dict]]] = ContextVar("turn_spans", default=None)
+
+
+def record_span(kind: str, name: str, started_at: float, duration: float, status: str = "ok", **attributes: Any) -> None:
+    """
+    Record a finished span.
+
+    Args:
+        kind: What was timed, e.g. node, llm, tool or db.
+        name: The node, tool or operation.
+        started_at: The time the span started, in seconds since the epoch.
+        duration: The duration in seconds.
+        status: ok, error, interrupted or cancelled.
+        **attributes: Details kept in the trace and the turn profile, e.g. token counts.
+    """
+    SPAN_SECONDS.observe(duration, kind=kind, name=name)
+    if status == "error":
+        SPAN_ERRORS.inc(kind=kind, name=name)
+
+    spans = _turn_spans.get()
+    writer = get_trace_writer()
+    if spans is None and writer is None:
+        return
+    record = {
+        "ts": started_at,
+        "pid": os.getpid(),
+        "kind": kind,
+        "name": name,
+        "duration_ms": round(duration * 1000, 3),
+        "status": status,
+        **attributes,
+    }
+    if spans is not None:
+        spans.append(record)
+    if writer is not None:
+        writer.write(record)
+
+
+@contextmanager
+def span(kind: str, name: str, **attributes: Any) -> Iterator[dict]:
+    """
+    Time the body of the with statement as a span.
+
+    Yields the attributes of the span, so details known only at the end can be added.
+    Setting the "status" attribute overrides the status, e.g. for a tool that returned an error.
+    """
+    started_at = time.time()
+    start = time.perf_counter()
+    status = "ok"
+    try:
+        yield attributes
+    except GraphBubbleUp:
+        # Interrupts and other control flow of the graph are not failures
+        status = "interrupted"
+        raise
+    except asyncio.CancelledError:
+        status = "cancelled"
+        raise
+    except Exception as e:
+        status = "error"
+        attributes["error"] = type(e).__name__
+        raise
+    finally:
+        status = attributes.pop("status", status)
+        record_span(kind, name, started_at, time.perf_counter() - start, status, **attributes)
+
+
+def record_llm_usage(attributes: dict, response: Any) -> None:
+    """
+    Add the token usage of an LLM response to the attributes of its span.
+    """
+    usage = getattr(response, "usage_metadata", None)
+    if not usage:
+        return
+    for key, label in (("input_tokens", "input"), ("output_tokens", "output")):
+        if key in usage:
+            attributes[key] = usage[key]
+            LLM_TOKENS.observe(usage[key], type=label)
+
+
+def record_tool_payload(attributes: dict, name: str, args: Any, result: Any) -> None:
+    """
+    Add the size of the arguments and the result of a tool call to the attributes of its span.
+    """
+    args_bytes = len(json.dumps(args, default=str).encode())
+    result_bytes = len(str(result).encode())
+    attributes["args_bytes"] = args_bytes
+    attributes["result_bytes"] = result_bytes
+    TOOL_PAYLOAD_BYTES.observe(args_bytes, tool=name, direction="args")
+    TOOL_PAYLOAD_BYTES.observe(result_bytes, tool=name, direction="result")
+
+
+# ----------------------------
+# Turn profiles
+# ----------------------------
+
+class TurnProfile:
+    """
+    The spans of one turn, including those the MCP servers wrote to the trace file meanwhile.
+    """
+
+    def __init__(self):
+        self.spans: list[dict] = []
+        self.started_at = time.time()
+        self.start = time.perf_counter()
+        self.duration = 0.0
+        writer = get_trace_writer()
+        self.trace_path = writer.path if writer else None
+        self.trace_offset = self.trace_path.stat().st_size if self.trace_path else 0
+
+    def finish(self) -> None:
+        self.duration = time.perf_counter() - self.start
+        if self.trace_path is None:
+            return
+        with open(self.trace_path, "rb") as f:
+            f.seek(self.trace_offset)
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                if record.get("pid") != os.getpid():
+                    self.spans.append(record)
+
+    def report(self) -> str:
+        """
+        Format a breakdown of the turn by kind and name of span.
+        """
+        rows: dict[tuple[str, str], dict] = {}
+        for record in self.spans:
+            row = rows.setdefault((record["kind"], record["name"]), {"calls": 0, "total": 0.0, "max": 0.0, "errors": 0, "details": {}})
+            row["calls"] += 1
+            row["total"] += record["duration_ms"]
+            row["max"] = max(row["max"], record["duration_ms"])
+            row["errors"] += record["status"] == "error"
+            for key in ("input_tokens", "output_tokens", "args_bytes", "result_bytes", "rows"):
+                if key in record:
+                    row["details"][key] = row["details"].get(key, 0) + record[key]
+
+        lines = [
+            f" ---- ⏱ Profile: {self.duration * 1000:,.0f} ms ---- ",
+            f"{'kind':<6} {'name':<32} {'calls':>5} {'total ms':>10} {'max ms':>9} {'errors':>6}  details",
+        ]
+        for (kind, name), row in sorted(rows.items(), key=lambda item: -item[1]["total"]):
+            details = " ".join(f"{key}={value:,}" for key, value in row["details"].items())
+            lines.append(
+                f"{kind:<6} {name[:32]:<32} {row['calls']:>5} {row['total']:>10,.1f} {row['max']:>9,.1f} {row['errors']:>6}  {details}"
+            )
+        return "\n".join(lines)
+
+
+@contextmanager
+def profile_turn() -> Iterator[TurnProfile]:
+    """
+    Collect the spans recorded in the body of the with statement, including those of the graph run it starts.
+    """
+    profile = TurnProfile()
+    token = _turn_spans.set(profile.spans)
+    try:
+        yield profile
+    finally:
+        _turn_spans.reset(token)
+        profile.finish()
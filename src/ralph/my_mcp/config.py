@@ -1,17 +1,73 @@
 """
-This file loads required secrets from the .env file into the mcp_config.
+This file loads the MCP server configuration and fills in required secrets from the .env file.
 It also resolves relative paths to absolute paths for local server files.
+
+Nothing is loaded at import time. `load_mcp_config` reads a profile the first time it is
+requested and returns the same immutable config afterwards, until `clear_mcp_config_cache()` is called.
+
+Entrypoints call `load_env` before they read any environment variable, so values in .env apply to them too.
 """
 
+import copy
+import logging
 import os
+from dataclasses import dataclass
+from functools import lru_cache
 from pathlib import Path
+from types import MappingProxyType
+from typing import Any, Mapping, Optional
 from dotenv import load_dotenv
 import json
 
 
-load_dotenv()
+logger = logging.getLogger(__name__)
+
+
+CONFIG_DIR = Path(__file__).parent
+DEFAULT_PROFILE = "default"
+TRANSPORTS = {"stdio", "sse", "streamable_http", "websocket"}
+# Passed on to local servers when set, as stdio servers only inherit a few variables such as PATH
+FORWARDED_ENV_VARS = ("METRICS_TRACE_PATH",)
+
+
+@dataclass(frozen=True)
+class MCPConfig:
+    """
+    A resolved MCP configuration.
+
+    Attributes:
+        profile: The profile the config was loaded from.
+        servers: The connection of each server, read-only.
+        skipped_servers: Servers left out because an environment variable they need is not set.
+    """
+    profile: str
+    servers: Mapping[str, Mapping[str, Any]]
+    skipped_servers: tuple[str, ...] = ()
+
+    def connections(self) -> dict[str, dict]:
+        """
+        Get a mutable copy of the server connections, as expected by the MCP client.
+        """
+        return thaw(self.servers)
+
+
+def freeze(value: Any) -> Any:
+    if isinstance(value, dict):
+        return MappingProxyType({key: freeze(item) for key, item in value.items()})
+    if isinstance(value, list):
+        return tuple(freeze(item) for item in value)
+    return value
 
 
+def thaw(value: Any) -> Any:
+    if isinstance(value, Mapping):
+        return {key: thaw(item) for key, item in value.items()}
+    if isinstance(value, tuple):
+        return [thaw(item) for item in value]
+    return value
+
+
+@lru_cache(maxsize=1)
 def get_project_root() -> Path:
     """
     Find the project root directory by looking for pyproject.toml.
@@ -28,6 +84,43 @@ def get_project_root() -> Path:
     return current_path.parent.parent.parent
 
 
+def get_config_file(profile: str) -> Path:
+    """
+    Get the file of a profile. The default profile is mcp_config.json, any other is mcp_config.<profile>.json.
+    """
+    if profile == DEFAULT_PROFILE:
+        return CONFIG_DIR / "mcp_config.json"
+    return CONFIG_DIR / f"mcp_config.{profile}.json"
+
+
+def validate_config(config: Any, config_file: Path) -> None:
+    """
+    Check the structure of a config before anything is resolved, reporting every problem at once.
+    """
+    if not isinstance(config, dict) or not isinstance(config.get("mcpServers"), dict):
+        raise ValueError(f"{config_file} must contain an object named 'mcpServers'")
+
+    errors = []
+    for server_name, server_config in config["mcpServers"].items():
+        if not isinstance(server_config, dict):
+            errors.append(f"{server_name}: must be an object")
+            continue
+        transport = server_config.get("transport")
+        if transport not in TRANSPORTS:
+            errors.append(f"{server_name}: transport must be one of {sorted(TRANSPORTS)}, got {transport!r}")
+        elif transport == "stdio" and not server_config.get("command"):
+            errors.append(f"{server_name}: stdio servers need a 'command'")
+        elif transport != "stdio" and not server_config.get("url"):
+            errors.append(f"{server_name}: {transport} servers need a 'url'")
+        if not isinstance(server_config.get("args", []), list):
+            errors.append(f"{server_name}: 'args' must be a list")
+        if not isinstance(server_config.get("env", {}), dict):
+            errors.append(f"{server_name}: 'env' must be an object")
+
+    if errors:
+        raise ValueError(f"Invalid MCP config {config_file}:\n" + "\n".join(errors))
+
+
 def resolve_relative_paths(config: dict, project_root: Path) -> dict:
     """
     Resolve relative paths in MCP server configurations to absolute paths.
@@ -45,16 +138,18 @@ def resolve_relative_paths(config: dict, project_root: Path) -> dict:
                             config["mcpServers"][server_name]["args"][i] = str(absolute_path)
                         else:
                             # If the file doesn't exist, keep the original path but warn
-                            print(f"Warning: Server file not found at {absolute_path}")
-                            print(f"Keeping original path: {arg}")
+                            logger.warning("Server file not found at %s, keeping original path: %s", absolute_path, arg)
 
     return config
 
 
-def resolve_env_vars(config: dict) -> dict:
+def resolve_env_vars(config: dict) -> tuple[dict, list[str]]:
     """
     Resolve environment variables in the MCP configuration.
     This allows sensitive information to be stored in the .env file rather than in the config.
+
+    Returns:
+        The config without the servers that need an unset environment variable, and the names of those servers.
     """
     skipped_servers = []
     for server_name, server_config in config["mcpServers"].items():
@@ -65,8 +160,7 @@ def resolve_env_vars(config: dict) -> dict:
                         env_var_name = value[2:-1]
                         env_var_value = os.environ.get(env_var_name, None)
                         if env_var_value is None or env_var_value == "":
-                            print(f"\nEnvironment variable {env_var_name} is not set\n")
-                            print(f"Skipping server {server_name}\n")
+                            logger.warning("Environment variable %s is not set, skipping server %s", env_var_name, server_name)
                             skipped_servers.append(server_name)
                             continue
                         config["mcpServers"][server_name][property][key] = env_var_value
@@ -76,32 +170,94 @@ def resolve_env_vars(config: dict) -> dict:
                         env_var_name = arg[2:-1]
                         env_var_value = os.environ.get(env_var_name, None)
                         if env_var_value is None or env_var_value == "":
-                            print(f"\nEnvironment variable {env_var_name} is not set\n")
-                            print(f"Skipping server {server_name}\n")
+                            logger.warning("Environment variable %s is not set, skipping server %s", env_var_name, server_name)
                             skipped_servers.append(server_name)
                             continue
                         config["mcpServers"][server_name][property][i] = env_var_value
 
     # Remove skipped servers
-    for server_name in set(skipped_servers):
+    skipped_servers = sorted(set(skipped_servers))
+    for server_name in skipped_servers:
         del config["mcpServers"][server_name]
 
+    return config, skipped_servers
+
+
+def forward_env_vars(config: dict) -> dict:
+    """
+    Pass the FORWARDED_ENV_VARS that are set on to the servers started as local processes.
+    Variables set in the config of a server take precedence.
+    """
+    forwarded = {name: os.environ[name] for name in FORWARDED_ENV_VARS if os.environ.get(name)}
+    if forwarded:
+        for server_config in config["mcpServers"].values():
+            if server_config.get("transport", "stdio") == "stdio":
+                server_config["env"] = {**forwarded, **server_config.get("env", {})}
     return config
 
 
-# Load and process the MCP configuration
-config_file = Path(__file__).parent / "mcp_config.json"
-if not config_file.exists():
-    raise FileNotFoundError(f"mcp_config.json file {config_file} does not exist")
+@lru_cache(maxsize=1)
+def load_env() -> None:
+    """
+    Load the .env file into the environment, once. Variables already set are left alone.
+    """
+    load_dotenv()
+
+
+@lru_cache(maxsize=None)
+def _load_mcp_config(profile: str) -> MCPConfig:
+    config_file = get_config_file(profile)
+    if not config_file.exists():
+        raise FileNotFoundError(f"MCP config file {config_file} for profile '{profile}' does not exist")
+
+    with open(config_file, "r") as f:
+        try:
+            config = json.load(f)
+        except json.JSONDecodeError as e:
+            raise ValueError(f"MCP config file {config_file} is not valid JSON: {e}") from e
+
+    validate_config(config, config_file)
 
-with open(config_file, "r") as f:
-    config = json.load(f)
+    # Resolve relative paths to absolute paths
+    config = resolve_relative_paths(copy.deepcopy(config), get_project_root())
 
-# Get the project root for resolving relative paths
-project_root = get_project_root()
+    # Resolve environment variables
+    config, skipped_servers = resolve_env_vars(config)
+    config = forward_env_vars(config)
+
+    return MCPConfig(
+        profile=profile,
+        servers=freeze(config["mcpServers"]),
+        skipped_servers=tuple(skipped_servers),
+    )
+
+
+def load_mcp_config(profile: Optional[str] = None) -> MCPConfig:
+    """
+    Load an MCP config profile, reading and resolving it only the first time it is requested.
+
+    Args:
+        profile: The profile to load. Defaults to the MCP_CONFIG_PROFILE environment variable,
+            or the default profile in mcp_config.json.
+
+    Raises:
+        FileNotFoundError: If the profile has no config file.
+        ValueError: If the config file is invalid.
+    """
+    load_env()
+    return _load_mcp_config(profile or os.getenv("MCP_CONFIG_PROFILE") or DEFAULT_PROFILE)
+
+
+def clear_mcp_config_cache() -> None:
+    """
+    Forget every loaded profile and the .env file, so the next load reads them again.
+    """
+    _load_mcp_config.cache_clear()
+    load_env.cache_clear()
 
-# Resolve relative paths to absolute paths
-config = resolve_relative_paths(config, project_root)
 
-# Resolve environment variables
-mcp_config = resolve_env_vars(config)
+def __getattr__(name: str):
+    # `mcp_config` used to be built at import time, it is now loaded on first access
+    if name == "mcp_config":
+        return {"mcpServers": load_mcp_config().connections()}
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,312 @@
+"""
+This file keeps MCP server sessions alive and shares them between graphs.
+Tool schemas are cached on disk so the tools can be handed to the LLM without starting
+any server, and a server is only started the first time one of its tools is called.
+"""
+
+from pathlib import Path
+from typing import Any, Optional
+from weakref import WeakKeyDictionary
+from langchain_core.tools import BaseTool, StructuredTool, ToolException
+from langchain_mcp_adapters.client import MultiServerMCPClient
+from langchain_mcp_adapters.tools import load_mcp_tools
+import asyncio
+import hashlib
+import json
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+
+DEFAULT_SCHEMA_CACHE_PATH = Path.home() / ".cache" / "ralph" / "mcp_tools.json"
+
+
+def connection_hash(connection: dict) -> str:
+    """
+    Hash a server connection so cached schemas are refreshed when its config changes,
+    or when the file of a local server is edited.
+    Only the hash is stored, never the config itself, as it may contain secrets.
+    """
+    server_files = {
+        arg: os.path.getmtime(arg)
+        for arg in connection.get("args", [])
+        if isinstance(arg, str) and arg.endswith(".py") and os.path.isfile(arg)
+    }
+    return hashlib.sha256(json.dumps([connection, server_files], sort_keys=True).encode()).hexdigest()
+
+
+def tool_schema(tool: BaseTool) -> dict:
+    args_schema = tool.args_schema
+    if not isinstance(args_schema, dict):
+        args_schema = args_schema.model_json_schema()
+    return {"name": tool.name, "description": tool.description, "args_schema": args_schema}
+
+
+class ServerSession:
+    """
+    A long running session with one MCP server.
+
+    The session is opened and closed by a background task, as the MCP client
+    requires, and stays open until `close` is called or the server dies.
+    """
+
+    def __init__(self, client: MultiServerMCPClient, name: str):
+        self.client = client
+        self.name = name
+        self.session = None
+        self.tools: dict[str, BaseTool] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.stopped = asyncio.Event()
+        self.lock = asyncio.Lock()
+
+    @property
+    def alive(self) -> bool:
+        return self.session is not None and self.task is not None and not self.task.done()
+
+    async def _run(self, ready: asyncio.Future) -> None:
+        try:
+            async with self.client.session(self.name) as session:
+                self.tools = {tool.name: tool for tool in await load_mcp_tools(session)}
+                self.session = session
+                ready.set_result(None)
+                await self.stopped.wait()
+        except Exception as e:
+            if not ready.done():
+                ready.set_exception(e)
+            else:
+                logger.warning("MCP server %s stopped: %r", self.name, e)
+        finally:
+            self.session = None
+
+    async def start(self) -> None:
+        """
+        Start the server if it is not running yet.
+        """
+        async with self.lock:
+            if self.alive:
+                return
+            self.stopped = asyncio.Event()
+            ready = asyncio.get_running_loop().create_future()
+            self.task = asyncio.create_task(self._run(ready), name=f"mcp-{self.name}")
+            await ready
+            logger.info("Started MCP server %s", self.name)
+
+    async def ping(self, timeout: float = 5.0) -> bool:
+        """
+        Check the server still responds.
+        """
+        if not self.alive:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=timeout)
+            return True
+        except Exception:
+            return False
+
+    async def close(self, timeout: float = 5.0) -> None:
+        async with self.lock:
+            if self.task is None:
+                return
+            self.stopped.set()
+            try:
+                await asyncio.wait_for(self.task, timeout=timeout)
+            except Exception:
+                self.task.cancel()
+            self.task = None
+            self.session = None
+
+    async def close_if_dead(self, session) -> bool:
+        """
+        Close the server if the given session stopped responding. Does nothing
+        if the session was already replaced, e.g. by a concurrent restart.
+
+        Returns:
+            Whether the server was closed.
+        """
+        if session is None or session is not self.session or await self.ping():
+            return False
+        await self.close()
+        return True
+
+
+class MCPToolRegistry:
+    """
+    Registry of the tools of a set of MCP servers.
+
+    Tools are returned as lightweight proxies built from the cached schemas.
+    Calling a proxy starts its server on first use and reuses the open session
+    afterwards. A server that stops responding is restarted on the next call.
+    """
+
+    def __init__(
+            self,
+            connections: dict[str, dict],
+            schema_cache_path: Optional[Path] = None,
+            health_check_interval: float = 60.0
+            ):
+        self.connections = connections
+        self.schema_cache_path = Path(schema_cache_path or os.getenv("MCP_SCHEMA_CACHE") or DEFAULT_SCHEMA_CACHE_PATH)
+        self.health_check_interval = health_check_interval
+        self.client = MultiServerMCPClient(connections=connections)
+        self.servers = {name: ServerSession(self.client, name) for name in connections}
+        self.tool_servers: dict[str, str] = {}
+        self.health_task: Optional[asyncio.Task] = None
+
+    def load_schemas(self) -> dict[str, dict]:
+        """
+        Load the cached tool schemas of the servers whose config has not changed.
+        """
+        try:
+            cached = json.loads(self.schema_cache_path.read_text())
+        except (OSError, ValueError):
+            return {}
+        return {
+            name: entry["tools"]
+            for name, entry in cached.items()
+            if name in self.connections and entry.get("connection_hash") == connection_hash(self.connections[name])
+        }
+
+    def save_schemas(self, schemas: dict[str, list[dict]]) -> None:
+        try:
+            cached = json.loads(self.schema_cache_path.read_text())
+        except (OSError, ValueError):
+            cached = {}
+        for name, tools in schemas.items():
+            cached[name] = {"connection_hash": connection_hash(self.connections[name]), "tools": tools}
+        try:
+            self.schema_cache_path.parent.mkdir(parents=True, exist_ok=True)
+            self.schema_cache_path.write_text(json.dumps(cached, indent=2))
+        except OSError as e:
+            logger.warning("Could not write MCP schema cache %s: %r", self.schema_cache_path, e)
+
+    async def start_servers(self, names: list[str]) -> list[str]:
+        """
+        Start the given servers concurrently.
+
+        Returns:
+            The names of the servers that started.
+        """
+        results = await asyncio.gather(*(self.servers[name].start() for name in names), return_exceptions=True)
+        started = []
+        for name, result in zip(names, results):
+            if isinstance(result, Exception):
+                logger.warning("Could not start MCP server %s: %r", name, result)
+            else:
+                started.append(name)
+        if started:
+            self.start_health_checks()
+        return started
+
+    async def get_tools(self) -> list[BaseTool]:
+        """
+        Get the tools of every server.
+
+        Only servers without a cached schema are started, concurrently, to read their tools.
+        """
+        schemas = self.load_schemas()
+        missing = [name for name in self.connections if name not in schemas]
+        if missing:
+            started = await self.start_servers(missing)
+            fresh = {
+                name: [tool_schema(tool) for tool in self.servers[name].tools.values()]
+                for name in started
+            }
+            self.save_schemas(fresh)
+            schemas.update(fresh)
+
+        tools = []
+        for server_name, server_tools in schemas.items():
+            for schema in server_tools:
+                self.tool_servers[schema["name"]] = server_name
+                tools.append(self.make_proxy(schema))
+        return tools
+
+    def make_proxy(self, schema: dict) -> BaseTool:
+        name = schema["name"]
+
+        async def call_tool(**arguments: Any):
+            return await self.call_tool(name, arguments)
+
+        return StructuredTool(
+            name=name,
+            description=schema["description"],
+            args_schema=schema["args_schema"],
+            coroutine=call_tool,
+        )
+
+    async def call_tool(self, name: str, arguments: dict) -> Any:
+        server = self.servers[self.tool_servers[name]]
+        if not server.alive:
+            await self.start_servers([server.name])
+            if not server.alive:
+                raise ToolException(f"The {server.name} server is not available.")
+
+        tool = server.tools.get(name)
+        if tool is None:
+            # The server no longer has this tool, refresh its schema for the next graph build
+            self.save_schemas({server.name: [tool_schema(tool) for tool in server.tools.values()]})
+            raise ToolException(f"{name} is no longer provided by the {server.name} server.")
+
+        session = server.session
+        try:
+            return await tool.ainvoke(arguments)
+        except Exception:
+            # Drop a dead session so the next call restarts the server.
+            # The call itself is not retried, as tools like sending emails are not idempotent.
+            await server.close_if_dead(session)
+            raise
+
+    async def check_health(self) -> None:
+        """
+        Ping every running server and restart the ones that stopped responding.
+        """
+        for server in self.servers.values():
+            if await server.close_if_dead(server.session):
+                logger.warning("MCP server %s stopped responding, restarting it", server.name)
+                await self.start_servers([server.name])
+
+    def start_health_checks(self) -> None:
+        if self.health_check_interval <= 0 or (self.health_task and not self.health_task.done()):
+            return
+
+        async def health_check_loop():
+            while True:
+                await asyncio.sleep(self.health_check_interval)
+                await self.check_health()
+
+        self.health_task = asyncio.create_task(health_check_loop(), name="mcp-health-checks")
+
+    async def aclose(self) -> None:
+        """
+        Stop the health checks and every running server.
+        """
+        if self.health_task:
+            self.health_task.cancel()
+            self.health_task = None
+        await asyncio.gather(*(server.close() for server in self.servers.values()))
+
+
+# Registries are shared per event loop, as their sessions belong to the loop they were started on
+_registries: WeakKeyDictionary = WeakKeyDictionary()
+
+
+def get_tool_registry(connections: dict[str, dict]) -> MCPToolRegistry:
+    """
+    Get the registry for a set of server connections, creating it on first use.
+    Graphs built from the same config share the registry and its running servers.
+    """
+    registries = _registries.setdefault(asyncio.get_running_loop(), {})
+    key = connection_hash(connections)
+    if key not in registries:
+        registries[key] = MCPToolRegistry(connections)
+    return registries[key]
+
+
+async def close_tool_registries() -> None:
+    """
+    Close every registry of the running event loop.
+    """
+    for registry in _registries.pop(asyncio.get_running_loop(), {}).values():
+        await registry.aclose()
@@ -0,0 +1,106 @@
+"""
+This file selects the audience of a campaign from the RFM segments in a single query.
+Customers are paged through by ID, so each page reads the same few index entries
+however large the audience is or how far into it the page is.
+"""
+
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import text
+
+
+# Max customers returned per page
+MAX_AUDIENCE_PAGE_SIZE = 500
+
+
+def build_audience_query(
+        segments: Optional[list[str]] = None,
+        r_scores: Optional[list[int]] = None,
+        f_scores: Optional[list[int]] = None,
+        m_scores: Optional[list[int]] = None,
+        exclude_emailed_for_campaign: Optional[UUID] = None,
+        after_customer_id: Optional[int] = None,
+        limit: int = 100
+        ) -> tuple[str, dict]:
+    """
+    Build the query for one page of a campaign audience.
+
+    Only the filters that are given are added to the query, so the planner can use
+    the (Segment, Customer ID) index on rfm and the (campaign_id, customer_id) index
+    on campaign_emails. Customers without an email address are never selected.
+
+    Args:
+        segments: The RFM segments to select, all if not given.
+        r_scores: The allowed recency scores, from 1 to 5.
+        f_scores: The allowed frequency scores, from 1 to 5.
+        m_scores: The allowed monetary scores, from 1 to 5.
+        exclude_emailed_for_campaign: Leave out customers already emailed for this campaign.
+        after_customer_id: Return customers after this ID, the last ID of the previous page.
+        limit: The number of customers to return.
+
+    Returns:
+        The SQL and its parameters.
+    """
+    conditions = ['c."Email" IS NOT NULL']
+    params = {"limit": limit}
+
+    if segments:
+        conditions.append('r."Segment" = ANY(:segments)')
+        params["segments"] = list(segments)
+    for column, scores in (("R", r_scores), ("F", f_scores), ("M", m_scores)):
+        if scores:
+            conditions.append(f'r."{column}" = ANY(:{column.lower()}_scores)')
+            params[f"{column.lower()}_scores"] = list(scores)
+    if after_customer_id is not None:
+        # Repeated for every joined table, the planner doesn't carry a range across
+        # a join and would otherwise scan the other tables from the start
+        conditions.append('r."Customer ID" > :after_customer_id AND c."Customer ID" > :after_customer_id')
+        params["after_customer_id"] = after_customer_id
+    if exclude_emailed_for_campaign is not None:
+        emailed_range = " AND e.customer_id > :after_customer_id" if after_customer_id is not None else ""
+        conditions.append(
+            'NOT EXISTS (SELECT 1 FROM campaign_emails e '
+            f'WHERE e.campaign_id = :campaign_id AND e.customer_id = r."Customer ID"{emailed_range})'
+        )
+        params["campaign_id"] = exclude_emailed_for_campaign
+
+    sql = f"""
+        SELECT r."Customer ID" AS customer_id,
+               c."Name" AS name,
+               c."Email" AS email,
+               c."Country" AS country,
+               r."Segment" AS segment,
+               r."RFM_Score" AS rfm_score,
+               r.recency,
+               r.frequency,
+               r.monetary
+        FROM rfm r
+        JOIN customers c ON c."Customer ID" = r."Customer ID"
+        WHERE {" AND ".join(conditions)}
+        ORDER BY r."Customer ID"
+        LIMIT :limit
+    """
+    return sql, params
+
+
+async def select_audience_page(session, limit: int = 100, **filters) -> dict:
+    """
+    Select one page of a campaign audience, see `build_audience_query` for the filters.
+
+    Returns:
+        The customers on the page, and the ID to pass as `after_customer_id` for the next page,
+        or None if this is the last page.
+    """
+    limit = max(1, min(limit, MAX_AUDIENCE_PAGE_SIZE))
+    # One extra row tells whether there is a next page without counting the audience
+    sql, params = build_audience_query(limit=limit + 1, **filters)
+    rows = (await session.execute(text(sql), params)).mappings().all()
+
+    customers = [
+        {**row, "monetary": round(row["monetary"], 2) if row["monetary"] is not None else None}
+        for row in rows[:limit]
+    ]
+    return {
+        "customers": customers,
+        "next_after_customer_id": customers[-1]["customer_id"] if len(rows) > limit else None,
+    }
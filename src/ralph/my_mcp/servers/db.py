@@ -0,0 +1,132 @@
+"""
+This file builds the async database engine shared by the MCP servers.
+Pool and timeout settings are read from the environment so they can be tuned
+per deployment without code changes. Every statement is timed, see ralph/metrics.py.
+"""
+
+import os
+import time
+from uuid import uuid4
+from sqlalchemy import event, text
+from sqlalchemy.engine import URL, Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
+from ralph.metrics import record_span
+
+
+SUPABASE_TRANSACTION_POOLER_PORT = 6543
+
+
+def get_async_url(uri: str) -> tuple[URL, dict]:
+    """
+    Convert a postgres connection string into an asyncpg URL.
+    asyncpg does not understand libpq's `sslmode` query parameter, so it is moved into the connect args.
+    """
+    url = make_url(uri).set(drivername="postgresql+asyncpg")
+    connect_args = {}
+    if "sslmode" in url.query:
+        connect_args["ssl"] = url.query["sslmode"]
+        url = url.difference_update_query(["sslmode"])
+    return url, connect_args
+
+
+def default_statement_cache_size(url: URL) -> str:
+    """
+    The transaction pooler may run each statement on a different backend than the one it was
+    prepared on, so prepared statements are only cached by default when connecting elsewhere.
+    """
+    return "0" if url.port == SUPABASE_TRANSACTION_POOLER_PORT else "100"
+
+
+def create_db_engine(uri: str) -> AsyncEngine:
+    """
+    Create a pooled async engine.
+
+    The engine is configured to work through the Supabase transaction pooler:
+    prepared statements get a unique name per connection so they never clash
+    when the pooler hands the same backend to a different client.
+
+    Environment variables:
+        DB_POOL_SIZE: Connections kept open in the pool (default 5).
+        DB_MAX_OVERFLOW: Extra connections opened under load (default 10).
+        DB_STATEMENT_TIMEOUT: Seconds before a statement is cancelled (default 30).
+        DB_STATEMENT_CACHE_SIZE: Prepared statements cached per connection, 0 disables caching
+            (default 0 on port 6543, the Supabase transaction pooler, and 100 otherwise).
+    """
+    url, connect_args = get_async_url(uri)
+    statement_cache_size = int(os.getenv("DB_STATEMENT_CACHE_SIZE", default_statement_cache_size(url)))
+
+    connect_args.update({
+        "command_timeout": float(os.getenv("DB_STATEMENT_TIMEOUT", "30")),
+        "statement_cache_size": statement_cache_size,
+        "prepared_statement_cache_size": statement_cache_size,
+        "prepared_statement_name_func": lambda: f"__asyncpg_{uuid4()}__",
+    })
+
+    engine = create_async_engine(
+        url,
+        pool_size=int(os.getenv("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.getenv("DB_MAX_OVERFLOW", "10")),
+        pool_pre_ping=True,
+        connect_args=connect_args,
+    )
+    instrument_engine(engine.sync_engine)
+    return engine
+
+
+def statement_operation(statement: str) -> str:
+    words = statement.split(None, 1)
+    return words[0].lower() if words else "unknown"
+
+
+def statement_summary(statement: str, length: int = 200) -> str:
+    return " ".join(statement.split())[:length]
+
+
+def instrument_engine(engine: Engine) -> None:
+    """
+    Record every statement the engine executes as a "db" span named after its operation, see `ralph.metrics`.
+    """
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_start", []).append((time.time(), time.perf_counter()))
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        started_at, start = conn.info["query_start"].pop()
+        attributes = {"statement": statement_summary(statement)}
+        rows = getattr(cursor, "rowcount", -1)
+        if rows is not None and rows >= 0:
+            attributes["rows"] = rows
+        record_span("db", statement_operation(statement), started_at, time.perf_counter() - start, **attributes)
+
+    @event.listens_for(engine, "handle_error")
+    def handle_error(context):
+        starts = context.connection.info.get("query_start") if context.connection is not None else None
+        if not starts:
+            return
+        started_at, start = starts.pop()
+        statement = context.statement or ""
+        record_span(
+            "db", statement_operation(statement), started_at, time.perf_counter() - start, status="error",
+            statement=statement_summary(statement), error=type(context.original_exception).__name__,
+        )
+
+
+def create_session_factory(engine: AsyncEngine) -> async_sessionmaker:
+    """
+    Create an async session factory bound to the engine.
+    """
+    return async_sessionmaker(bind=engine, autoflush=False, expire_on_commit=False)
+
+
+async def get_table_versions(session, tables: list[str]) -> dict[str, int]:
+    """
+    Get the current version of each table, see db/migration-table-versions.sql.
+    Tables that have never been modified are reported as version 0.
+    """
+    result = await session.execute(
+        text("SELECT table_name, version FROM table_versions WHERE table_name = ANY(:tables)"),
+        {"tables": tables},
+    )
+    versions = dict(result.tuples().all())
+    return {table: versions.get(table, 0) for table in tables}
@@ -0,0 +1,326 @@
+"""
+This file ingests email engagement events, opens and clicks, into campaign_emails.
+
+Events arrive from the tracking pixel the outbox adds to each email when OUTBOX_TRACKING_URL
+is set, or in batches from the webhook of an email provider. They are buffered in memory,
+keeping only the first open and the first click of each email, and applied with one UPDATE per
+batch keyed on the email id. Emails that were already opened or clicked earlier are left alone,
+so repeated opens cost no writes. Triggers fold each UPDATE into the campaign_performance and
+campaign_segment_performance rollups, see db/migration-campaign-performance.sql.
+
+    uv run uvicorn ralph.my_mcp.servers.engagement:app --port 8001
+
+    GET  /o/{email_id}.gif      Tracking pixel, records an open
+    POST /events                A JSON list of {"email_id", "type": "open" | "click", "timestamp"}
+    GET  /metrics               Counts of the events, in the Prometheus text format
+"""
+
+from contextlib import asynccontextmanager
+from datetime import datetime, timezone
+from operator import attrgetter
+from typing import Optional
+from uuid import UUID
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, PlainTextResponse, Response
+from starlette.routing import Route
+from ralph.metrics import registry, render_prometheus
+from ralph.my_mcp.servers.db import create_db_engine, create_session_factory
+import asyncio
+import logging
+import os
+
+
+logger = logging.getLogger(__name__)
+
+EVENT_TYPES = ("open", "click")
+
+ENGAGEMENT_EVENTS = registry.counter("ralph_engagement_events_total", "Engagement events received, by type and whether they were buffered or dropped.")
+ENGAGEMENT_UPDATES = registry.counter("ralph_engagement_emails_updated_total", "Emails updated with their first open or click.")
+ENGAGEMENT_ABANDONED = registry.counter("ralph_engagement_emails_abandoned_total", "Emails whose events were dropped after their batch failed too many times.")
+
+# A click without a recorded open, e.g. when the mail client blocked the pixel, counts as an open too
+APPLY_EVENTS_SQL = text("""
+UPDATE campaign_emails e
+SET opened_at = LEAST(e.opened_at, r.opened_at, r.clicked_at),
+    clicked_at = LEAST(e.clicked_at, r.clicked_at),
+    status = CASE
+        WHEN e.status NOT IN ('sent', 'opened', 'clicked') THEN e.status
+        WHEN e.clicked_at IS NOT NULL OR r.clicked_at IS NOT NULL THEN 'clicked'
+        ELSE 'opened'
+    END
+FROM unnest(CAST(:ids AS uuid[]), CAST(:opened_at AS timestamp[]), CAST(:clicked_at AS timestamp[]))
+    AS r(id, opened_at, clicked_at)
+WHERE e.id = r.id
+  AND (
+    e.opened_at IS NULL OR e.opened_at > LEAST(r.opened_at, r.clicked_at)
+    OR (r.clicked_at IS NOT NULL AND (e.clicked_at IS NULL OR e.clicked_at > r.clicked_at))
+  )
+""")
+
+# The smallest transparent GIF
+PIXEL = bytes.fromhex("47494638396101000100800000000000ffffff21f90401000000002c00000000010001000002024401003b")
+
+
+def earliest(current: Optional[datetime], new: Optional[datetime]) -> Optional[datetime]:
+    if current is None:
+        return new
+    if new is None:
+        return current
+    return min(current, new)
+
+
+def parse_timestamp(value) -> datetime:
+    """
+    Parse the time of an event, as seconds since the epoch or ISO 8601, into naive UTC like the other timestamps.
+    Events without a time happened now.
+    """
+    if value is None:
+        return datetime.now(timezone.utc).replace(tzinfo=None)
+    if isinstance(value, (int, float)):
+        return datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None)
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed
+
+
+class EngagementIngestor:
+    """
+    Buffers engagement events and applies them to campaign_emails in batches.
+
+    Args:
+        session_factory: The factory of database sessions.
+        batch_size: Emails updated per statement. A flush starts as soon as this many emails have events.
+        flush_interval: Seconds between flushes when fewer emails have events.
+        max_pending: Emails with buffered events at most. Events for other emails are dropped
+            beyond it, so callers can ask the sender to retry later.
+        max_attempts: Flushes that may fail for an email before its events are dropped, so a batch
+            the database keeps rejecting isn't retried forever.
+    """
+
+    def __init__(
+            self,
+            session_factory: async_sessionmaker,
+            batch_size: int = 1000,
+            flush_interval: float = 0.5,
+            max_pending: int = 100_000,
+            max_attempts: int = 5
+            ):
+        self.session_factory = session_factory
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        # The first open and the first click of each email
+        self.pending: dict[UUID, list[Optional[datetime]]] = {}
+        # The failed flushes of each email still buffered
+        self.attempts: dict[UUID, int] = {}
+        self.batch_ready = asyncio.Event()
+        self.flush_lock = asyncio.Lock()
+        self.task: Optional[asyncio.Task] = None
+        self.stats = {"events": 0, "dropped": 0, "flushes": 0, "updated": 0, "abandoned": 0}
+
+    @classmethod
+    def from_env(cls, session_factory: async_sessionmaker) -> "EngagementIngestor":
+        """
+        Create an ingestor configured by the ENGAGEMENT_* environment variables, see .env.example.
+        """
+        return cls(
+            session_factory,
+            batch_size=int(os.getenv("ENGAGEMENT_BATCH_SIZE", "1000")),
+            flush_interval=float(os.getenv("ENGAGEMENT_FLUSH_INTERVAL", "0.5")),
+            max_pending=int(os.getenv("ENGAGEMENT_MAX_PENDING", "100000")),
+            max_attempts=int(os.getenv("ENGAGEMENT_MAX_ATTEMPTS", "5")),
+        )
+
+    def add(self, email_id: UUID, type: str, occurred_at: Optional[datetime] = None) -> bool:
+        """
+        Buffer an event.
+
+        Args:
+            email_id: The ID of the email in campaign_emails.
+            type: open or click.
+            occurred_at: When the event happened, in naive UTC. Defaults to now.
+
+        Returns:
+            Whether the event was buffered, False if the buffer is full.
+        """
+        if type not in EVENT_TYPES:
+            raise ValueError(f"Unknown event type {type!r}, expected one of {', '.join(EVENT_TYPES)}.")
+        times = self.pending.get(email_id)
+        if times is None:
+            if len(self.pending) >= self.max_pending:
+                self.stats["dropped"] += 1
+                ENGAGEMENT_EVENTS.inc(type=type, outcome="dropped")
+                return False
+            times = self.pending[email_id] = [None, None]
+            if len(self.pending) >= self.batch_size:
+                self.batch_ready.set()
+
+        index = 0 if type == "open" else 1
+        times[index] = earliest(times[index], occurred_at or parse_timestamp(None))
+        self.stats["events"] += 1
+        ENGAGEMENT_EVENTS.inc(type=type, outcome="buffered")
+        return True
+
+    async def flush(self) -> int:
+        """
+        Apply the buffered events. Events of a batch that fails are buffered again, unless its
+        emails have failed max_attempts times, then they are dropped and logged.
+
+        Returns:
+            The number of emails updated.
+        """
+        async with self.flush_lock:
+            pending, self.pending = self.pending, {}
+            # Rows are locked in ID order, so concurrent ingestors never wait on each other in a cycle.
+            # UUIDs compare in Python, integers in C, and both orders match Postgres.
+            ids = sorted(pending, key=attrgetter("int"))
+            updated = 0
+            for start in range(0, len(ids), self.batch_size):
+                batch = ids[start:start + self.batch_size]
+                try:
+                    async with self.session_factory() as session:
+                        result = await session.execute(APPLY_EVENTS_SQL, {
+                            "ids": batch,
+                            "opened_at": [pending[email_id][0] for email_id in batch],
+                            "clicked_at": [pending[email_id][1] for email_id in batch],
+                        })
+                        await session.commit()
+                except Exception as e:
+                    abandoned = []
+                    for email_id in batch:
+                        self.attempts[email_id] = self.attempts.get(email_id, 0) + 1
+                        if self.attempts[email_id] >= self.max_attempts:
+                            del self.attempts[email_id]
+                            abandoned.append(email_id)
+                    if abandoned:
+                        logger.error(
+                            "Dropping the engagement events of %d emails after %d failed attempts: %r, e.g. %s",
+                            len(abandoned), self.max_attempts, e, abandoned[0],
+                        )
+                        self.stats["abandoned"] += len(abandoned)
+                        ENGAGEMENT_ABANDONED.inc(len(abandoned))
+                    # The batches after the failed one were not tried, they keep their attempts
+                    for email_id in set(ids[start:]).difference(abandoned):
+                        times = self.pending.setdefault(email_id, [None, None])
+                        times[0] = earliest(times[0], pending[email_id][0])
+                        times[1] = earliest(times[1], pending[email_id][1])
+                    raise
+                for email_id in batch:
+                    self.attempts.pop(email_id, None)
+                # Counted per batch, as the batches before a failed one stay applied
+                updated += result.rowcount
+                self.stats["updated"] += result.rowcount
+                ENGAGEMENT_UPDATES.inc(result.rowcount)
+            self.stats["flushes"] += 1
+            return updated
+
+    async def run(self) -> None:
+        """
+        Flush whenever a batch is full or the flush interval has passed, until cancelled.
+        """
+        while True:
+            try:
+                await asyncio.wait_for(self.batch_ready.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self.batch_ready.clear()
+            if not self.pending:
+                continue
+            try:
+                await self.flush()
+            except Exception as e:
+                logger.warning("Could not apply %d engagement events, retrying: %r", len(self.pending), e)
+                await asyncio.sleep(self.flush_interval)
+
+    def start(self) -> None:
+        self.task = asyncio.create_task(self.run())
+
+    async def close(self) -> None:
+        """
+        Stop flushing in the background and apply the events still buffered.
+        """
+        if self.task is not None:
+            async with self.flush_lock:
+                self.task.cancel()
+            self.task = None
+        if self.pending:
+            await self.flush()
+
+
+# ----------------------------
+# Tracking endpoints
+# ----------------------------
+
+async def track_open(request: Request) -> Response:
+    # The pixel is returned whatever the ID, so it never shows as broken in a mail client
+    try:
+        request.app.state.ingestor.add(UUID(request.path_params["email_id"]), "open")
+    except ValueError:
+        pass
+    return Response(PIXEL, media_type="image/gif", headers={"Cache-Control": "no-store, max-age=0"})
+
+
+async def receive_events(request: Request) -> JSONResponse:
+    try:
+        events = await request.json()
+        parsed = [(UUID(event["email_id"]), event["type"], parse_timestamp(event.get("timestamp"))) for event in events]
+    except (ValueError, TypeError, KeyError, AttributeError, OverflowError, OSError) as e:
+        # UUID() raises AttributeError for an ID that isn't a string,
+        # timestamps out of the range of datetime raise OverflowError or OSError
+        return JSONResponse({"error": f"Expected a JSON list of events with an email_id and a type: {e}"}, status_code=400)
+    if any(type not in EVENT_TYPES for _, type, _ in parsed):
+        return JSONResponse({"error": f"The type of an event must be one of {', '.join(EVENT_TYPES)}."}, status_code=400)
+
+    ingestor: EngagementIngestor = request.app.state.ingestor
+    accepted = sum(ingestor.add(email_id, type, occurred_at) for email_id, type, occurred_at in parsed)
+    if accepted < len(parsed):
+        # Applying a batch twice changes nothing, so the sender can retry all of it
+        return JSONResponse({"accepted": accepted, "error": "Too many events buffered, retry later."}, status_code=503)
+    return JSONResponse({"accepted": accepted})
+
+
+async def metrics(request: Request) -> PlainTextResponse:
+    return PlainTextResponse(render_prometheus(), media_type="text/plain; version=0.0.4")
+
+
+def create_app(session_factory: Optional[async_sessionmaker] = None) -> Starlette:
+    """
+    Create the tracking app.
+
+    Args:
+        session_factory: The factory of database sessions, by default connected to SUPABASE_URI.
+    """
+    @asynccontextmanager
+    async def lifespan(app: Starlette):
+        engine = None
+        factory = session_factory
+        if factory is None:
+            load_dotenv()
+            engine = create_db_engine(os.getenv("SUPABASE_URI"))
+            factory = create_session_factory(engine)
+        app.state.ingestor = EngagementIngestor.from_env(factory)
+        app.state.ingestor.start()
+        try:
+            yield
+        finally:
+            await app.state.ingestor.close()
+            if engine is not None:
+                await engine.dispose()
+
+    return Starlette(
+        routes=[
+            Route("/o/{email_id}.gif", track_open, methods=["GET"]),
+            Route("/events", receive_events, methods=["POST"]),
+            Route("/metrics", metrics, methods=["GET"]),
+        ],
+        lifespan=lifespan,
+    )
+
+
+app = create_app()
@@ -1,9 +1,16 @@
 from mcp.server.fastmcp import FastMCP
+from pydantic import BaseModel
 from sqlalchemy import text
+import json
 import os
 import pandas as pd
 from dotenv import load_dotenv
 from uuid import UUID
+from ralph.my_mcp.servers.db import create_db_engine, create_session_factory
+from ralph.my_mcp.servers.profiles import CustomerProfileCache
+from ralph.my_mcp.servers.audience import select_audience_page
+from ralph.my_mcp.servers.performance import get_campaign_performance as read_campaign_performance
+from ralph.my_mcp.servers.templates import BestSellerCache, TemplateError, compile_template, customer_variables, fetch_recipients, render_email
 
 load_dotenv()
 
@@ -12,11 +19,51 @@ load_dotenv()
 # DB Session
 # ----------------------------
 
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+engine = create_db_engine(os.getenv("SUPABASE_URI"))
+SessionLocal = create_session_factory(engine)
+profile_cache = CustomerProfileCache(max_entries=int(os.getenv("PROFILE_CACHE_SIZE", "10000")))
+best_seller_cache = BestSellerCache()
 
-engine = create_engine(url=os.getenv("SUPABASE_URI"))
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+
+# ----------------------------
+# Models
+# ----------------------------
+
+class CampaignEmail(BaseModel):
+    """A single email in a bulk campaign send."""
+    customer_id: int
+    subject: str
+    body: str
+
+
+# ----------------------------
+# Outbox
+# ----------------------------
+
+# Max rows per multi-row INSERT statement when writing emails in bulk
+INSERT_BATCH_SIZE = 500
+
+
+async def insert_campaign_emails(session, campaign_id: UUID, emails: list[CampaignEmail]) -> None:
+    """Queue emails for a campaign in the outbox using batched multi-row INSERT statements."""
+    for start in range(0, len(emails), INSERT_BATCH_SIZE):
+        batch = emails[start:start + INSERT_BATCH_SIZE]
+        params = {"campaign_id": campaign_id}
+        values = []
+        for i, email in enumerate(batch):
+            values.append(f"(:campaign_id, :customer_id_{i}, :subject_{i}, :body_{i}, 'pending')")
+            params[f"customer_id_{i}"] = email.customer_id
+            params[f"subject_{i}"] = email.subject
+            params[f"body_{i}"] = email.body
+        await session.execute(
+            text(
+                f"""
+                INSERT INTO campaign_emails (campaign_id, customer_id, subject, body, status)
+                VALUES {", ".join(values)}
+                """
+            ),
+            params,
+        )
 
 
 # ----------------------------
@@ -26,6 +73,65 @@ SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 mcp = FastMCP("marketing")
 
 
+@mcp.tool()
+async def get_customer_profiles(customer_ids: list[int]) -> str:
+    """Get compact purchase profiles for a list of customers in a single call.
+
+    Use this to analyze customers before writing marketing emails instead of
+    querying the transactions, items and rfm tables for each customer.
+
+    Args:
+        customer_ids: The IDs of the customers.
+
+    Returns:
+        A JSON list of profiles. Each profile has the customer's name, email, country,
+        last purchase date, RFM scores and segment, and their top items by spend.
+    """
+    async with SessionLocal() as session:
+        profiles = await profile_cache.get(session, customer_ids)
+    return json.dumps(profiles)
+
+@mcp.tool()
+async def select_campaign_audience(
+    segments: list[str] | None = None,
+    r_scores: list[int] | None = None,
+    f_scores: list[int] | None = None,
+    m_scores: list[int] | None = None,
+    exclude_emailed_for_campaign: UUID | None = None,
+    limit: int = 100,
+    after_customer_id: int | None = None,
+) -> str:
+    """Select the customers to target in a campaign by RFM segment or scores, in a single call.
+
+    Use this instead of querying customers one by one. Filters are combined, leave one out to not filter on it.
+
+    Args:
+        segments: The RFM segments to target, e.g. ["At Risk"].
+        r_scores: The recency scores to target, from 1 (long ago) to 5 (recent).
+        f_scores: The frequency scores to target, from 1 to 5.
+        m_scores: The monetary scores to target, from 1 to 5.
+        exclude_emailed_for_campaign: The ID of a campaign, to leave out customers already emailed for it.
+        limit: The number of customers per page, at most 500.
+        after_customer_id: The `next_after_customer_id` of the previous page, to get the next page.
+
+    Returns:
+        A JSON object with the customers on this page, each with their ID, name, email, country,
+        segment, RFM score, recency, frequency and monetary value, and the `next_after_customer_id`
+        to pass for the next page, or null if this is the last page.
+    """
+    async with SessionLocal() as session:
+        page = await select_audience_page(
+            session,
+            limit=limit,
+            segments=segments,
+            r_scores=r_scores,
+            f_scores=f_scores,
+            m_scores=m_scores,
+            exclude_emailed_for_campaign=exclude_emailed_for_campaign,
+            after_customer_id=after_customer_id,
+        )
+    return json.dumps(page, default=str)
+
 @mcp.tool()
 async def create_campaign(
     name: str,
@@ -42,8 +148,8 @@ async def create_campaign(
     Returns:
         The ID of the created campaign.
     """
-    with SessionLocal() as session:
-        result = session.execute(
+    async with SessionLocal() as session:
+        result = await session.execute(
             text(
                 """
                 INSERT INTO marketing_campaigns (name, type, description)
@@ -53,8 +159,9 @@ async def create_campaign(
             ),
             {"name": name, "type": type, "description": description},
         )
-        session.commit()
-        return str(result.fetchone()[0])
+        campaign_id = result.scalar_one()
+        await session.commit()
+        return str(campaign_id)
 
 @mcp.tool()
 async def send_campaign_email(
@@ -64,7 +171,9 @@ async def send_campaign_email(
     body: str,
 ) -> str:
     """Send a campaign email.
-    
+
+    The email is queued and delivered in the background by the outbox worker.
+
     Args:
         campaign_id: The ID of the campaign.
         customer_id: The ID of the customer.
@@ -72,24 +181,188 @@ async def send_campaign_email(
         body: The body of the email.
 
     Returns:
-        A confirmation that the email was sent.
+        A confirmation that the email was queued.
     """
-    # TODO: Send email via MCP
-
-    # Create email record in db
-    with SessionLocal() as session:
-        result = session.execute(
+    async with SessionLocal() as session:
+        await session.execute(
             text(
                 """
-                INSERT INTO campaign_emails (campaign_id, customer_id, subject, body)
-                VALUES (:campaign_id, :customer_id, :subject, :body)
+                INSERT INTO campaign_emails (campaign_id, customer_id, subject, body, status)
+                VALUES (:campaign_id, :customer_id, :subject, :body, 'pending')
                 """
             ),
             {"campaign_id": campaign_id, "customer_id": customer_id, "subject": subject, "body": body},
         )
-        session.commit()
+        await session.commit()
+
+    return f"Successfully queued <{subject}> for customer <{customer_id}>!"
+
+@mcp.tool()
+async def send_campaign_emails(
+    campaign_id: UUID,
+    emails: list[CampaignEmail],
+) -> str:
+    """Send a batch of campaign emails in a single transaction.
+
+    Prefer this over calling `send_campaign_email` once per customer. The emails are queued
+    and delivered in the background by the outbox worker.
+
+    Args:
+        campaign_id: The ID of the campaign.
+        emails: The emails to send. Each email has a customer_id, subject and body.
 
-    return f"Successfully sent <{subject}> to customer <{customer_id}>!"
+    Returns:
+        A JSON list with the status of each email, in the order given.
+    """
+
+    async with SessionLocal() as session:
+        campaign = (await session.execute(
+            text("SELECT 1 FROM marketing_campaigns WHERE id = :campaign_id"),
+            {"campaign_id": campaign_id},
+        )).fetchone()
+        if campaign is None:
+            return f"Campaign <{campaign_id}> does not exist. No emails were sent."
+
+        known_customers = set((await session.execute(
+            text('SELECT "Customer ID" FROM customers WHERE "Customer ID" = ANY(:customer_ids)'),
+            {"customer_ids": list({email.customer_id for email in emails})},
+        )).scalars())
+
+        statuses = []
+        to_insert = []
+        for email in emails:
+            if email.customer_id in known_customers:
+                to_insert.append(email)
+                statuses.append({"customer_id": email.customer_id, "status": "queued"})
+            else:
+                statuses.append({"customer_id": email.customer_id, "status": "skipped", "reason": "unknown customer"})
+
+        await insert_campaign_emails(session, campaign_id, to_insert)
+        await session.commit()
+
+    return json.dumps(statuses)
+
+
+@mcp.tool()
+async def preview_campaign_email(
+    subject_template: str,
+    body_template: str,
+    customer_id: int,
+) -> str:
+    """Render an email template for one customer, without sending anything.
+
+    Templates use placeholders like {{ first_name }}, with an optional fallback for customers
+    without a value: {{ recommendation | our new arrivals }}. The placeholders are: name, first_name,
+    email, country, segment, favourite_item, last_item, last_purchase_date and recommendation.
+
+    Args:
+        subject_template: The template of the subject line.
+        body_template: The template of the HTML body.
+        customer_id: The ID of the customer to render the email for.
+
+    Returns:
+        A JSON object with the rendered subject and body.
+    """
+    try:
+        subject, body = compile_template(subject_template), compile_template(body_template)
+    except TemplateError as e:
+        return f"Invalid template: {e}"
+
+    async with SessionLocal() as session:
+        recipient = (await fetch_recipients(session, [customer_id])).get(customer_id)
+        if recipient is None:
+            return f"Customer <{customer_id}> does not exist."
+        best_sellers = await best_seller_cache.get(session)
+
+    rendered_subject, rendered_body = render_email(subject, body, customer_variables(recipient, best_sellers))
+    return json.dumps({"customer_id": customer_id, "subject": rendered_subject, "body": rendered_body})
+
+@mcp.tool()
+async def send_templated_campaign_emails(
+    campaign_id: UUID,
+    subject_template: str,
+    body_template: str,
+    customer_ids: list[int],
+) -> str:
+    """Send a campaign email to many customers, rendered from one template.
+
+    Prefer this over writing each email yourself when emailing more than a few customers.
+    Each email is personalised by filling in the placeholders with the customer's data, see
+    `preview_campaign_email` for the placeholders. The emails are queued and delivered in the
+    background by the outbox worker.
+
+    Args:
+        campaign_id: The ID of the campaign.
+        subject_template: The template of the subject line.
+        body_template: The template of the HTML body.
+        customer_ids: The IDs of the customers to email, e.g. from `select_campaign_audience`.
+
+    Returns:
+        A JSON object with the number of emails queued, the customers skipped and why,
+        and the email rendered for the first customer.
+    """
+    try:
+        subject, body = compile_template(subject_template), compile_template(body_template)
+    except TemplateError as e:
+        return f"Invalid template: {e}. No emails were sent."
+
+    async with SessionLocal() as session:
+        campaign = (await session.execute(
+            text("SELECT 1 FROM marketing_campaigns WHERE id = :campaign_id"),
+            {"campaign_id": campaign_id},
+        )).fetchone()
+        if campaign is None:
+            return f"Campaign <{campaign_id}> does not exist. No emails were sent."
+
+        customer_ids = list(dict.fromkeys(customer_ids))
+        recipients = await fetch_recipients(session, customer_ids)
+        best_sellers = await best_seller_cache.get(session)
+
+        emails = []
+        skipped = []
+        for customer_id in customer_ids:
+            recipient = recipients.get(customer_id)
+            if recipient is None:
+                skipped.append({"customer_id": customer_id, "reason": "unknown customer"})
+            elif not recipient["email"]:
+                skipped.append({"customer_id": customer_id, "reason": "no email address"})
+            else:
+                rendered_subject, rendered_body = render_email(subject, body, customer_variables(recipient, best_sellers))
+                emails.append(CampaignEmail(customer_id=customer_id, subject=rendered_subject, body=rendered_body))
+
+        await insert_campaign_emails(session, campaign_id, emails)
+        await session.commit()
+
+    return json.dumps({
+        "queued": len(emails),
+        "skipped": skipped,
+        "example": emails[0].model_dump() if emails else None,
+    })
+
+
+@mcp.tool()
+async def get_campaign_performance(
+    campaign_id: UUID | None = None,
+    limit: int = 20,
+) -> str:
+    """Get how a campaign performed: emails queued, delivered, bounced, opened and clicked, with rates, overall and by RFM segment.
+
+    The counts are kept up to date as emails are delivered and opened, so use this instead of
+    querying the campaign_emails table. A click also counts as an open.
+
+    Args:
+        campaign_id: The ID of the campaign. Leave empty to compare the most recent campaigns, without segments.
+        limit: The number of recent campaigns to compare when no campaign is given, at most 100.
+
+    Returns:
+        A JSON object with the counts and rates of the campaign and of each segment it emailed,
+        or a JSON list of the most recent campaigns with their counts and rates.
+    """
+    async with SessionLocal() as session:
+        performance = await read_campaign_performance(session, campaign_id, limit)
+    if performance is None:
+        return f"Campaign <{campaign_id}> does not exist."
+    return json.dumps(performance, default=str)
 
 
 if __name__ == "__main__":
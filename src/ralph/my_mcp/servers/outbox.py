@@ -0,0 +1,492 @@
+"""
+This file delivers campaign emails from the outbox, see db/migration-email-outbox.sql.
+
+The marketing tools only write emails as pending rows of campaign_emails, so the agent never
+waits for SMTP. A worker claims pending emails in batches, sends them over a pool of SMTP
+connections that stay open across emails, limits the rate of emails to each recipient domain,
+and writes the outcomes back in batches: sent, bounced when the server rejects the email for
+good, or pending again after a backoff when the failure may be temporary. The worker renews the
+leases of the emails it claimed until their outcome is written, however long they wait for their
+domain's rate. A claimed email whose lease expires anyway, e.g. because the worker died, is
+claimed again. Workers never send an email whose lease is nearly over, so it isn't sent twice.
+
+    uv run python src/ralph/my_mcp/servers/outbox.py           # Deliver until stopped
+    uv run python src/ralph/my_mcp/servers/outbox.py --drain   # Deliver what is due, then exit
+"""
+
+from collections import deque
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from email.header import Header
+from email.utils import formatdate
+from typing import AsyncIterator, Optional
+from uuid import UUID
+from dotenv import load_dotenv
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import async_sessionmaker
+from ralph.my_mcp.servers.db import create_db_engine, create_session_factory
+from ralph.rate_limit import TokenBucket
+import aiosmtplib
+import argparse
+import asyncio
+import logging
+import os
+import quopri
+import random
+import time
+
+
+logger = logging.getLogger(__name__)
+
+
+CLAIM_SQL = text("""
+WITH claimed AS (
+    SELECT e.id, c."Email" AS address
+    FROM campaign_emails e
+    LEFT JOIN customers c ON c."Customer ID" = e.customer_id
+    WHERE e.status IN ('pending', 'sending') AND e.next_attempt_at <= now()
+      AND e.id <> ALL(CAST(:exclude AS uuid[]))
+    ORDER BY e.next_attempt_at
+    LIMIT :limit
+    FOR UPDATE OF e SKIP LOCKED
+)
+UPDATE campaign_emails e
+SET status = 'sending', attempts = e.attempts + 1, next_attempt_at = now() + make_interval(secs => :lease)
+FROM claimed
+WHERE e.id = claimed.id
+RETURNING e.id, e.subject, e.body, e.attempts, claimed.address
+""")
+
+# Only the claim that holds an email may extend its lease
+RENEW_SQL = text("""
+UPDATE campaign_emails e
+SET next_attempt_at = now() + make_interval(secs => :lease)
+FROM unnest(CAST(:ids AS uuid[]), CAST(:attempts AS integer[])) AS r(id, attempts)
+WHERE e.id = r.id AND e.status = 'sending' AND e.attempts = r.attempts
+RETURNING e.id
+""")
+
+# Only the claim that sent an email may record its outcome, not one whose lease expired meanwhile
+RESULTS_SQL = text("""
+UPDATE campaign_emails e
+SET status = r.status,
+    sent_at = CASE WHEN r.status = 'sent' THEN now() ELSE e.sent_at END,
+    last_error = r.error,
+    next_attempt_at = CASE WHEN r.status = 'pending' THEN now() + make_interval(secs => r.retry_in) END
+FROM unnest(
+    CAST(:ids AS uuid[]), CAST(:attempts AS integer[]), CAST(:statuses AS text[]),
+    CAST(:errors AS text[]), CAST(:retry_in AS float8[])
+) AS r(id, attempts, status, error, retry_in)
+WHERE e.id = r.id AND e.status = 'sending' AND e.attempts = r.attempts
+""")
+
+
+@dataclass
+class OutboxEmail:
+    id: UUID
+    subject: str
+    body: str
+    attempts: int
+    address: Optional[str]
+    # time.monotonic() when the lease of this claim ends, a little before it ends in the database
+    lease_until: float = 0.0
+
+
+@dataclass
+class DeliveryResult:
+    id: UUID
+    attempts: int
+    status: str
+    error: Optional[str] = None
+    retry_in: float = 0.0
+
+
+def encode_header(value: str) -> str:
+    value = " ".join(value.split())
+    if value.isascii() and len(value) <= 900:
+        return value
+    return Header(value, "utf-8").encode()
+
+
+def build_message(email: OutboxEmail, from_address: str, tracking_url: Optional[str] = None) -> bytes:
+    """
+    Build the MIME message of an email, an HTML body encoded as quoted-printable.
+    With a tracking URL, a pixel that records opens is added to the body, see engagement.py.
+
+    Written out directly rather than with email.message.EmailMessage, whose header parsing
+    and serialisation take about 1.4 ms per email against 30 µs.
+    """
+    domain = from_address.rsplit("@", 1)[-1]
+    headers = [
+        f"From: {from_address}",
+        f"To: {email.address}",
+        f"Subject: {encode_header(email.subject or '')}",
+        f"Date: {formatdate()}",
+        f"Message-ID: <{email.id}@{domain}>",
+        # Lets bounces and engagement events be matched to the email
+        f"X-Campaign-Email-ID: {email.id}",
+        "MIME-Version: 1.0",
+        'Content-Type: text/html; charset="utf-8"',
+        "Content-Transfer-Encoding: quoted-printable",
+    ]
+    body = email.body or ""
+    if tracking_url:
+        body += f'<img src="{tracking_url.rstrip("/")}/o/{email.id}.gif" width="1" height="1" alt="">'
+    return "\r\n".join(headers).encode() + b"\r\n\r\n" + quopri.encodestring(body.encode())
+
+
+def is_permanent_failure(error: Exception) -> bool:
+    """
+    Whether the server rejected the email for good, with a 5xx reply.
+    Connection problems, timeouts and 4xx replies are worth retrying.
+    """
+    if isinstance(error, aiosmtplib.SMTPRecipientsRefused):
+        return all(500 <= recipient.code < 600 for recipient in error.recipients)
+    if isinstance(error, aiosmtplib.SMTPResponseException):
+        return 500 <= error.code < 600
+    return False
+
+
+class SMTPConnectionPool:
+    """
+    Keeps up to `size` SMTP connections open and reuses them for many emails, so each email
+    only costs the MAIL, RCPT and DATA round-trips rather than a new connection and EHLO.
+    """
+
+    def __init__(self, size: int = 8, **smtp_options):
+        self.size = size
+        self.smtp_options = smtp_options
+        self.idle: list[aiosmtplib.SMTP] = []
+        self.semaphore = asyncio.Semaphore(size)
+
+    @asynccontextmanager
+    async def connection(self) -> AsyncIterator[aiosmtplib.SMTP]:
+        async with self.semaphore:
+            client = self.idle.pop() if self.idle else aiosmtplib.SMTP(**self.smtp_options)
+            try:
+                if not client.is_connected:
+                    await client.connect()
+                yield client
+            except (aiosmtplib.SMTPResponseException, aiosmtplib.SMTPRecipientsRefused):
+                # The server answered and aiosmtplib reset the transaction, the connection can be reused
+                if client.is_connected:
+                    self.idle.append(client)
+                raise
+            except BaseException:
+                client.close()
+                raise
+            self.idle.append(client)
+
+    async def close(self) -> None:
+        idle, self.idle = self.idle, []
+        for client in idle:
+            try:
+                await client.quit()
+            except (aiosmtplib.SMTPException, OSError):
+                client.close()
+
+
+class OutboxWorker:
+    """
+    Delivers the emails of the outbox.
+
+    Args:
+        session_factory: The factory of database sessions.
+        pool: The SMTP connections to send through.
+        from_address: The sender of the emails.
+        tracking_url: The base URL of the engagement tracking app, to record opens.
+        batch_size: Emails claimed, and outcomes written, per statement.
+        max_in_flight: Emails claimed but not done at most.
+        domain_rate: Emails per second to each recipient domain, 0 for no limit.
+        domain_burst: Emails that may be sent at once to a domain above its rate.
+        max_attempts: Attempts before an email that keeps failing is bounced.
+        retry_delay: The delay before the first retry in seconds, doubled for each further retry.
+        max_retry_delay: The longest delay between retries in seconds.
+        lease: Seconds a claimed email is reserved for this worker. Leases are renewed every third
+            of it, and an email is not sent with less than a tenth of its lease left.
+        poll_interval: Seconds between claims while the outbox is empty.
+    """
+
+    def __init__(
+            self,
+            session_factory: async_sessionmaker,
+            pool: SMTPConnectionPool,
+            from_address: str,
+            tracking_url: Optional[str] = None,
+            batch_size: int = 200,
+            max_in_flight: int = 1000,
+            domain_rate: float = 20.0,
+            domain_burst: int = 20,
+            max_attempts: int = 5,
+            retry_delay: float = 30.0,
+            max_retry_delay: float = 3600.0,
+            lease: float = 300.0,
+            poll_interval: float = 1.0
+            ):
+        self.session_factory = session_factory
+        self.pool = pool
+        self.from_address = from_address
+        self.tracking_url = tracking_url
+        self.batch_size = batch_size
+        self.max_in_flight = max_in_flight
+        self.domain_rate = domain_rate
+        self.domain_burst = domain_burst
+        self.max_attempts = max_attempts
+        self.retry_delay = retry_delay
+        self.max_retry_delay = max_retry_delay
+        self.lease = lease
+        self.poll_interval = poll_interval
+
+        self.buckets: dict[str, TokenBucket] = {}
+        self.domain_queues: dict[str, deque[OutboxEmail]] = {}
+        self.domain_tasks: dict[str, asyncio.Task] = {}
+        self.deliveries: set[asyncio.Task] = set()
+        self.results: list[DeliveryResult] = []
+        # Emails claimed whose outcome is not written yet, their leases are renewed
+        self.claimed: dict[UUID, OutboxEmail] = {}
+        self.write_lock = asyncio.Lock()
+        self.in_flight = 0
+        self.progress = asyncio.Event()
+        self.stats = {"claimed": 0, "sent": 0, "bounced": 0, "retried": 0, "expired": 0}
+
+    @classmethod
+    def from_env(cls, session_factory: async_sessionmaker) -> "OutboxWorker":
+        """
+        Create a worker configured by the SMTP_* and OUTBOX_* environment variables, see .env.example.
+        """
+        pool = SMTPConnectionPool(
+            size=int(os.getenv("OUTBOX_CONNECTIONS", "8")),
+            hostname=os.getenv("SMTP_HOST", "localhost"),
+            port=int(os.getenv("SMTP_PORT", "25")),
+            username=os.getenv("SMTP_USERNAME") or None,
+            password=os.getenv("SMTP_PASSWORD") or None,
+            start_tls=os.getenv("SMTP_START_TLS", "false").lower() in ("1", "true", "yes"),
+            timeout=float(os.getenv("SMTP_TIMEOUT", "30")),
+        )
+        return cls(
+            session_factory,
+            pool,
+            from_address=os.getenv("OUTBOX_FROM_ADDRESS", "marketing@example.com"),
+            tracking_url=os.getenv("OUTBOX_TRACKING_URL") or None,
+            batch_size=int(os.getenv("OUTBOX_BATCH_SIZE", "200")),
+            domain_rate=float(os.getenv("OUTBOX_DOMAIN_RATE", "20")),
+            domain_burst=int(os.getenv("OUTBOX_DOMAIN_BURST", "20")),
+            max_attempts=int(os.getenv("OUTBOX_MAX_ATTEMPTS", "5")),
+            retry_delay=float(os.getenv("OUTBOX_RETRY_DELAY", "30")),
+        )
+
+    async def claim(self, limit: int) -> list[OutboxEmail]:
+        # Emails this worker still holds are skipped, even if renewing their lease failed
+        exclude = list(self.claimed)
+        start = time.monotonic()
+        async with self.session_factory() as session:
+            rows = (await session.execute(CLAIM_SQL, {"limit": limit, "lease": self.lease, "exclude": exclude})).all()
+            await session.commit()
+        self.stats["claimed"] += len(rows)
+        emails = [OutboxEmail(*row, lease_until=start + self.lease) for row in rows]
+        self.claimed.update((email.id, email) for email in emails)
+        return emails
+
+    async def renew_leases(self) -> None:
+        """
+        Extend the leases of the emails this worker holds. Emails another claim took over keep their
+        old lease, so they are not sent once it is nearly over.
+        """
+        emails = list(self.claimed.values())
+        for start in range(0, len(emails), self.batch_size):
+            batch = emails[start:start + self.batch_size]
+            renewed_at = time.monotonic()
+            async with self.session_factory() as session:
+                renewed = set((await session.execute(RENEW_SQL, {
+                    "ids": [email.id for email in batch],
+                    "attempts": [email.attempts for email in batch],
+                    "lease": self.lease,
+                })).scalars())
+                await session.commit()
+            for email in batch:
+                if email.id in renewed:
+                    email.lease_until = renewed_at + self.lease
+
+    async def write_results(self) -> None:
+        """
+        Write the outcomes of the finished deliveries. Once it returns, every earlier outcome is written.
+        Outcomes of a batch that fails are queued again, ahead of the ones that finished since.
+        """
+        async with self.write_lock:
+            results, self.results = self.results, []
+            for start in range(0, len(results), self.batch_size):
+                batch = results[start:start + self.batch_size]
+                try:
+                    async with self.session_factory() as session:
+                        await session.execute(RESULTS_SQL, {
+                            "ids": [result.id for result in batch],
+                            "attempts": [result.attempts for result in batch],
+                            "statuses": [result.status for result in batch],
+                            "errors": [result.error for result in batch],
+                            "retry_in": [result.retry_in for result in batch],
+                        })
+                        await session.commit()
+                except Exception:
+                    self.results[:0] = results[start:]
+                    raise
+                for result in batch:
+                    self.claimed.pop(result.id, None)
+
+    def backoff(self, attempts: int) -> float:
+        delay = min(self.max_retry_delay, self.retry_delay * 2 ** (attempts - 1))
+        return random.uniform(delay / 2, delay)
+
+    def failure(self, email: OutboxEmail, error: Exception) -> DeliveryResult:
+        message = f"{type(error).__name__}: {error}"
+        if is_permanent_failure(error) or email.attempts >= self.max_attempts:
+            return DeliveryResult(email.id, email.attempts, "bounced", message)
+        return DeliveryResult(email.id, email.attempts, "pending", message, self.backoff(email.attempts))
+
+    def complete(self, result: DeliveryResult) -> None:
+        self.results.append(result)
+        self.stats["retried" if result.status == "pending" else result.status] += 1
+        self.in_flight -= 1
+        self.progress.set()
+
+    def release(self, email: OutboxEmail) -> None:
+        """
+        Give up an email without sending it, its lease expires and it is claimed again.
+        """
+        self.claimed.pop(email.id, None)
+        self.stats["expired"] += 1
+        self.in_flight -= 1
+        self.progress.set()
+
+    async def deliver(self, email: OutboxEmail) -> None:
+        try:
+            async with self.pool.connection() as client:
+                # Once the lease is over another claim may send the email too
+                if time.monotonic() > email.lease_until - self.lease / 10:
+                    logger.warning("The lease of %s is nearly over, it will be claimed again", email.id)
+                    self.release(email)
+                    return
+                await client.sendmail(self.from_address, [email.address], build_message(email, self.from_address, self.tracking_url))
+        except Exception as e:
+            logger.debug("Could not deliver %s: %r", email.id, e)
+            self.complete(self.failure(email, e))
+        else:
+            self.complete(DeliveryResult(email.id, email.attempts, "sent"))
+
+    async def drain_domain(self, domain: str) -> None:
+        """
+        Start the deliveries to one domain at its rate, so a throttled domain never holds up the others.
+        """
+        bucket = self.buckets.setdefault(domain, TokenBucket(self.domain_rate, self.domain_burst))
+        queue = self.domain_queues[domain]
+        try:
+            while queue:
+                email = queue.popleft()
+                await bucket.acquire()
+                delivery = asyncio.create_task(self.deliver(email))
+                self.deliveries.add(delivery)
+                delivery.add_done_callback(self.deliveries.discard)
+        finally:
+            del self.domain_tasks[domain]
+
+    def dispatch(self, email: OutboxEmail) -> None:
+        self.in_flight += 1
+        if not email.address or "@" not in email.address:
+            self.complete(DeliveryResult(email.id, email.attempts, "bounced", "The customer has no email address."))
+            return
+        domain = email.address.rsplit("@", 1)[1].lower()
+        self.domain_queues.setdefault(domain, deque()).append(email)
+        if domain not in self.domain_tasks:
+            self.domain_tasks[domain] = asyncio.create_task(self.drain_domain(domain))
+
+    async def wait_for_progress(self, timeout: Optional[float] = None) -> None:
+        self.progress.clear()
+        try:
+            await asyncio.wait_for(self.progress.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+
+    async def run(self, drain: bool = False, stop: Optional[asyncio.Event] = None) -> dict:
+        """
+        Deliver emails until `stop` is set or, with `drain`, until no email is due and none is in flight.
+
+        Returns:
+            The number of emails claimed, sent, bounced and scheduled for a retry.
+        """
+        async def write_results_loop():
+            # Outcomes must keep being written, or the leases of delivered emails expire and they are sent again
+            while True:
+                await asyncio.sleep(0.2)
+                if not self.results:
+                    continue
+                try:
+                    await self.write_results()
+                except Exception as e:
+                    logger.warning("Could not write %d delivery outcomes, retrying: %r", len(self.results), e)
+                    await asyncio.sleep(self.poll_interval)
+
+        async def renew_leases_loop():
+            while True:
+                await asyncio.sleep(self.lease / 3)
+                try:
+                    await self.renew_leases()
+                except Exception as e:
+                    logger.warning("Could not renew the leases of %d emails: %r", len(self.claimed), e)
+
+        writer = asyncio.create_task(write_results_loop())
+        renewer = asyncio.create_task(renew_leases_loop())
+        flushed = False
+        try:
+            while stop is None or not stop.is_set():
+                free = self.max_in_flight - self.in_flight
+                if free < min(self.batch_size, self.max_in_flight):
+                    await self.wait_for_progress()
+                    continue
+                emails = await self.claim(min(free, self.batch_size))
+                for email in emails:
+                    self.dispatch(email)
+                if emails:
+                    flushed = False
+                elif drain and self.in_flight == 0:
+                    if flushed:
+                        break
+                    # Retries that are already due can only be claimed once their outcome is written
+                    try:
+                        await self.write_results()
+                    except Exception as e:
+                        logger.warning("Could not write %d delivery outcomes, retrying: %r", len(self.results), e)
+                        await asyncio.sleep(self.poll_interval)
+                        continue
+                    flushed = True
+                else:
+                    await self.wait_for_progress(self.poll_interval)
+            while self.in_flight:
+                await self.wait_for_progress()
+        finally:
+            renewer.cancel()
+            async with self.write_lock:
+                writer.cancel()
+            for task in [*self.domain_tasks.values(), *self.deliveries]:
+                task.cancel()
+            # Emails cancelled midway stay claimed until their lease expires, then they are claimed again
+            await self.write_results()
+            await self.pool.close()
+        return dict(self.stats)
+
+
+async def main():
+    load_dotenv()
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Deliver the campaign emails of the outbox.")
+    parser.add_argument("--drain", action="store_true", help="Exit once no email is due.")
+    args = parser.parse_args()
+
+    engine = create_db_engine(os.getenv("SUPABASE_URI"))
+    try:
+        stats = await OutboxWorker.from_env(create_session_factory(engine)).run(drain=args.drain)
+        logger.info("Outbox: %s", stats)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,84 @@
+"""
+This file reads how campaigns performed from the campaign_performance and
+campaign_segment_performance rollups, see db/migration-campaign-performance.sql.
+Triggers keep the rollups up to date, so a report is a primary key lookup rather
+than a scan of every email of the campaign.
+"""
+
+from typing import Optional
+from uuid import UUID
+from sqlalchemy import text
+
+
+COUNT_COLUMNS = ("emails", "pending", "delivered", "bounced", "opened", "clicked")
+
+# Max campaigns reported on at once
+MAX_CAMPAIGNS = 100
+
+
+def rate(numerator: int, denominator: int) -> Optional[float]:
+    return round(numerator / denominator, 4) if denominator else None
+
+
+def with_rates(counts: dict) -> dict:
+    """
+    Add the usual email rates to the counts of a campaign or segment. Rates are null until there is something to divide by.
+    """
+    return {
+        **counts,
+        "bounce_rate": rate(counts["bounced"], counts["delivered"] + counts["bounced"]),
+        "open_rate": rate(counts["opened"], counts["delivered"]),
+        "click_rate": rate(counts["clicked"], counts["delivered"]),
+        "click_to_open_rate": rate(counts["clicked"], counts["opened"]),
+    }
+
+
+async def get_campaign_performance(session, campaign_id: Optional[UUID] = None, limit: int = 20) -> Optional[dict | list[dict]]:
+    """
+    Get the performance of one campaign, by RFM segment, or of the most recent campaigns.
+
+    Args:
+        session: The database session.
+        campaign_id: The campaign to report on, or None for the most recent campaigns.
+        limit: The number of recent campaigns to report on when no campaign is given.
+
+    Returns:
+        The campaign with its counts, rates and segments, None if it does not exist,
+        or a list of the most recent campaigns with their counts and rates.
+    """
+    columns = ", ".join(f"coalesce(p.{column}, 0) AS {column}" for column in COUNT_COLUMNS)
+    if campaign_id is None:
+        rows = (await session.execute(
+            text(f"""
+                SELECT c.id AS campaign_id, c.name, c.type, c.created_at, {columns}, p.updated_at
+                FROM marketing_campaigns c
+                LEFT JOIN campaign_performance p ON p.campaign_id = c.id
+                ORDER BY c.created_at DESC
+                LIMIT :limit
+            """),
+            {"limit": max(1, min(limit, MAX_CAMPAIGNS))},
+        )).mappings().all()
+        return [with_rates(dict(row)) for row in rows]
+
+    campaign = (await session.execute(
+        text(f"""
+            SELECT c.id AS campaign_id, c.name, c.type, c.created_at, {columns}, p.updated_at
+            FROM marketing_campaigns c
+            LEFT JOIN campaign_performance p ON p.campaign_id = c.id
+            WHERE c.id = :campaign_id
+        """),
+        {"campaign_id": campaign_id},
+    )).mappings().first()
+    if campaign is None:
+        return None
+
+    segments = (await session.execute(
+        text(f"""
+            SELECT segment, {", ".join(COUNT_COLUMNS)}
+            FROM campaign_segment_performance
+            WHERE campaign_id = :campaign_id AND emails > 0
+            ORDER BY emails DESC, segment
+        """),
+        {"campaign_id": campaign_id},
+    )).mappings().all()
+    return {**with_rates(dict(campaign)), "segments": [with_rates(dict(segment)) for segment in segments]}
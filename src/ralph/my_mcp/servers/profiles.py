@@ -0,0 +1,112 @@
+"""
+This file builds compact customer profiles for writing personalised marketing emails.
+Profiles are cached in memory and the cache is cleared whenever one of the source tables changes.
+"""
+
+from collections import OrderedDict
+from sqlalchemy import text
+import json
+from ralph.my_mcp.servers.db import get_table_versions
+
+
+# Tables a profile is built from, a change to any of them invalidates the cache
+PROFILE_TABLES = ["customers", "transactions", "items", "rfm"]
+
+PROFILE_SQL = """
+WITH spend AS (
+    SELECT t."Customer ID" AS customer_id,
+           t."StockCode" AS stock_code,
+           SUM(t."TotalPrice") AS spend,
+           MAX(t."InvoiceDate") AS last_purchased
+    FROM transactions t
+    WHERE t."Customer ID" = ANY(:customer_ids)
+    GROUP BY t."Customer ID", t."StockCode"
+),
+ranked AS (
+    SELECT s.*,
+           ROW_NUMBER() OVER (PARTITION BY s.customer_id ORDER BY s.spend DESC) AS rank,
+           MAX(s.last_purchased) OVER (PARTITION BY s.customer_id) AS last_purchase_date
+    FROM spend s
+)
+SELECT c."Customer ID" AS customer_id,
+       c."Name" AS name,
+       c."Email" AS email,
+       c."Country" AS country,
+       MAX(k.last_purchase_date) AS last_purchase_date,
+       r.recency,
+       r.frequency,
+       r.monetary,
+       r."RFM_Score" AS rfm_score,
+       r."Segment" AS segment,
+       COALESCE(
+           json_agg(
+               json_build_object(
+                   'stock_code', k.stock_code,
+                   'description', i."Description",
+                   'spend', ROUND(k.spend::numeric, 2),
+                   'last_purchased', k.last_purchased::date
+               ) ORDER BY k.rank
+           ) FILTER (WHERE k.stock_code IS NOT NULL),
+           '[]'
+       )::text AS top_items
+FROM customers c
+LEFT JOIN rfm r ON r."Customer ID" = c."Customer ID"
+LEFT JOIN ranked k ON k.customer_id = c."Customer ID" AND k.rank <= :top_items
+LEFT JOIN items i ON i."StockCode" = k.stock_code
+WHERE c."Customer ID" = ANY(:customer_ids)
+GROUP BY c."Customer ID", r."Customer ID"
+"""
+
+
+class CustomerProfileCache:
+    """
+    In-memory LRU cache of customer profiles.
+
+    Each lookup checks the versions of the source tables with one small query
+    and drops every cached profile if any of them changed since the last lookup.
+    Only the customers missing from the cache are then fetched, in a single query.
+    Beyond `max_entries` profiles, the least recently used are dropped.
+    """
+
+    def __init__(self, top_items: int = 3, max_entries: int = 10_000):
+        self.top_items = top_items
+        self.max_entries = max_entries
+        self.profiles: OrderedDict[int, dict] = OrderedDict()
+        self.versions: dict[str, int] = {}
+
+    def clear(self) -> None:
+        self.profiles.clear()
+
+    async def get(self, session, customer_ids: list[int]) -> list[dict]:
+        """
+        Get the profiles of the given customers, in the order given.
+        Unknown customers are left out.
+        """
+        versions = await get_table_versions(session, PROFILE_TABLES)
+        if versions != self.versions:
+            self.clear()
+            self.versions = versions
+
+        # Kept apart from the cache, which may evict some of them when more customers are asked for than it holds
+        profiles = {}
+        for customer_id in customer_ids:
+            if customer_id in self.profiles:
+                self.profiles.move_to_end(customer_id)
+                profiles[customer_id] = self.profiles[customer_id]
+
+        missing = list({customer_id for customer_id in customer_ids if customer_id not in profiles})
+        if missing:
+            result = await session.execute(
+                text(PROFILE_SQL),
+                {"customer_ids": missing, "top_items": self.top_items},
+            )
+            for row in result.mappings():
+                profile = dict(row)
+                profile["top_items"] = json.loads(profile["top_items"])
+                if profile["last_purchase_date"] is not None:
+                    profile["last_purchase_date"] = profile["last_purchase_date"].date().isoformat()
+                profiles[profile["customer_id"]] = self.profiles[profile["customer_id"]] = profile
+            while len(self.profiles) > self.max_entries:
+                self.profiles.popitem(last=False)
+
+        return [profiles[customer_id] for customer_id in customer_ids if customer_id in profiles]
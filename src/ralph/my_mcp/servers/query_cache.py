@@ -0,0 +1,105 @@
+"""
+This file caches the results of read-only SQL queries.
+Queries are keyed by their normalised text and an entry is dropped when it expires
+or when one of the tables it reads from has changed since it was cached. The tables are
+taken from the plan of the query, so those read through views count too. Results that
+read a table or materialized view without a version can only expire, so they get a
+shorter time to live.
+"""
+
+from collections import OrderedDict
+import re
+import time
+
+
+# Tables whose changes are tracked by db/migration-table-versions.sql. campaign_emails, the
+# rollups and customer_summary are not, they are written too often or refreshed as a whole.
+VERSIONED_TABLES = ["customers", "transactions", "items", "rfm", "marketing_campaigns"]
+
+# String literals and quoted identifiers, or a run of whitespace and comments
+SQL_TOKEN_RE = re.compile(r"""('(?:[^']|'')*'|"(?:[^"]|"")*")|((?:\s|--[^\n]*|/\*.*?\*/)+)""", re.S)
+
+
+def normalize_sql(sql: str) -> str:
+    """
+    Normalise a query so trivially different spellings of it share a cache entry.
+    Comments and whitespace are collapsed, unquoted text is lowercased, as Postgres folds
+    unquoted identifiers, and trailing semicolons are removed. Literals and quoted identifiers are kept as is.
+    """
+    parts = []
+    position = 0
+    for match in SQL_TOKEN_RE.finditer(sql):
+        parts.append(sql[position:match.start()].lower())
+        parts.append(match.group(1) or " ")
+        position = match.end()
+    parts.append(sql[position:].lower())
+    return "".join(parts).strip().rstrip(";").strip()
+
+
+def plan_relations(plan: dict) -> frozenset[str]:
+    """
+    Find the tables and materialized views read by a plan from EXPLAIN (FORMAT JSON).
+    Views are expanded by the planner, so the tables they read are found instead.
+    """
+    relations = set()
+    nodes = [plan["Plan"]]
+    while nodes:
+        node = nodes.pop()
+        if "Relation Name" in node:
+            relations.add(node["Relation Name"])
+        nodes.extend(node.get("Plans", []))
+    return frozenset(relations)
+
+
+class QueryCache:
+    """
+    LRU cache of query results with a time to live.
+
+    Each entry records the versions of the tables its query reads. A lookup
+    is only a hit if none of those tables have changed since, so writes made by
+    the marketing server or the data scripts invalidate the affected results.
+    Entries may be given a shorter time to live than `ttl` when they are put.
+
+    The relations each query reads are remembered apart from the results, for
+    more queries, as they only change with the schema.
+    """
+
+    def __init__(self, max_entries: int = 64, ttl: float = 300.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.entries: OrderedDict[str, dict] = OrderedDict()
+        self.relations: OrderedDict[str, frozenset[str]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get_relations(self, sql: str) -> frozenset[str] | None:
+        relations = self.relations.get(sql)
+        if relations is not None:
+            self.relations.move_to_end(sql)
+        return relations
+
+    def put_relations(self, sql: str, relations: frozenset[str]) -> None:
+        self.relations[sql] = relations
+        while len(self.relations) > self.max_entries * 16:
+            self.relations.popitem(last=False)
+
+    def get(self, sql: str, versions: dict[str, int]) -> dict | None:
+        """
+        Get the cached result of a normalised query, given the current versions of the tables it mentions.
+        """
+        entry = self.entries.get(sql)
+        if entry is None or time.time() - entry["created_at"] > entry["ttl"] or entry["versions"] != versions:
+            self.entries.pop(sql, None)
+            self.misses += 1
+            return None
+
+        self.entries.move_to_end(sql)
+        self.hits += 1
+        return entry
+
+    def put(self, sql: str, versions: dict[str, int], result: dict, ttl: float | None = None) -> None:
+        ttl = self.ttl if ttl is None else min(ttl, self.ttl)
+        self.entries[sql] = {**result, "versions": versions, "created_at": time.time(), "ttl": ttl}
+        self.entries.move_to_end(sql)
+        while len(self.entries) > self.max_entries:
+            self.entries.popitem(last=False)
@@ -0,0 +1,230 @@
+from mcp.server.fastmcp import FastMCP
+from sqlalchemy import text
+from sqlalchemy.exc import DBAPIError
+import asyncpg
+import json
+import os
+from dotenv import load_dotenv
+from ralph.my_mcp.servers.db import create_db_engine, get_table_versions
+from ralph.my_mcp.servers.query_cache import VERSIONED_TABLES, QueryCache, normalize_sql, plan_relations
+
+load_dotenv()
+
+
+# ----------------------------
+# DB Engine
+# ----------------------------
+
+engine = create_db_engine(os.getenv("SUPABASE_URI"))
+
+# Max rows read from the database for a single query, the rest is never fetched
+QUERY_MAX_ROWS = int(os.getenv("QUERY_MAX_ROWS", "1000"))
+# Rows returned per page
+QUERY_PAGE_SIZE = int(os.getenv("QUERY_PAGE_SIZE", "100"))
+# Max size of a page of results in bytes of JSON
+QUERY_MAX_BYTES = int(os.getenv("QUERY_MAX_BYTES", "30000"))
+
+query_cache = QueryCache(
+    max_entries=int(os.getenv("QUERY_CACHE_SIZE", "64")),
+    ttl=float(os.getenv("QUERY_CACHE_TTL", "300")),
+)
+# Seconds results are cached when they read a table without a version, such as campaign_emails or customer_summary
+QUERY_CACHE_UNVERSIONED_TTL = float(os.getenv("QUERY_CACHE_UNVERSIONED_TTL", "10"))
+
+
+def escape_colons(sql: str) -> str:
+    # So SQLAlchemy doesn't mistake casts or literals for bind parameters
+    return sql.replace(":", r"\:")
+
+
+async def read_relations(conn, sql: str) -> frozenset[str]:
+    """
+    Find the tables and materialized views a query reads from its plan, without running it.
+    """
+    plan = (await conn.execute(text("EXPLAIN (FORMAT JSON) " + escape_colons(sql)))).scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return plan_relations(plan[0])
+
+
+async def run_read_only(sql: str, max_rows: int) -> dict:
+    """
+    Run a query in a read-only transaction, streaming at most `max_rows` rows from the server.
+    """
+    async with engine.connect() as conn:
+        await conn.execute(text("SET TRANSACTION READ ONLY"))
+        result = await conn.stream(text(escape_colons(sql)))
+        rows = await result.fetchmany(max_rows + 1)
+        columns = list(result.keys())
+        await result.close()
+        await conn.rollback()
+
+    return {
+        "columns": columns,
+        "rows": [dict(row._mapping) for row in rows[:max_rows]],
+        "complete": len(rows) <= max_rows,
+    }
+
+
+def build_page(result: dict, offset: int) -> dict:
+    """
+    Cut a page of rows out of a query result, starting at `offset`. The page ends early
+    when it grows too large, and the next offset picks up at the first row left out.
+    """
+    rows = result["rows"]
+    page_rows = rows[offset:offset + QUERY_PAGE_SIZE]
+    next_offset = offset + len(page_rows)
+
+    notes = []
+    size = 0
+    for i, row in enumerate(page_rows):
+        size += len(json.dumps(row, default=str))
+        if size > QUERY_MAX_BYTES:
+            if i == 0:
+                # Skipped, or the same row would be asked for again and again
+                notes.append(f"Row {offset} alone is larger than {QUERY_MAX_BYTES} bytes and was left out. Select fewer or shorter columns to see it.")
+                next_offset = offset + 1
+            else:
+                notes.append(f"Only {i} rows fit in {QUERY_MAX_BYTES} bytes. Select fewer or shorter columns to get more at once.")
+                next_offset = offset + i
+            page_rows = page_rows[:i]
+            break
+
+    if not result["complete"]:
+        notes.append(
+            f"The query returned more than {QUERY_MAX_ROWS} rows and was cut off. "
+            "Add a WHERE clause, aggregate or LIMIT to narrow it down."
+        )
+    if next_offset < len(rows):
+        notes.append(f"Request offset {next_offset} for more rows.")
+    else:
+        next_offset = None
+
+    return {
+        "columns": result["columns"],
+        "rows": page_rows,
+        "offset": offset,
+        "next_offset": next_offset,
+        "total_rows": len(rows) if result["complete"] else f"more than {QUERY_MAX_ROWS}",
+        "notes": notes,
+    }
+
+
+DESCRIBE_COLUMNS_SQL = text("""
+    SELECT quote_ident(a.attname) AS name, format_type(a.atttypid, a.atttypmod) AS type, a.attnotnull AS not_null
+    FROM pg_attribute a
+    JOIN pg_class c ON c.oid = a.attrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relname = :table AND c.relkind IN ('r', 'v', 'm', 'p')
+      AND a.attnum > 0 AND NOT a.attisdropped
+    ORDER BY a.attnum
+""")
+
+DESCRIBE_CONSTRAINTS_SQL = text("""
+    SELECT con.conname AS name, pg_get_constraintdef(con.oid) AS definition
+    FROM pg_constraint con
+    JOIN pg_class c ON c.oid = con.conrelid
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relname = :table
+    ORDER BY con.contype, con.conname
+""")
+
+LIST_TABLES_SQL = text("""
+    SELECT c.relname FROM pg_class c
+    JOIN pg_namespace n ON n.oid = c.relnamespace
+    WHERE n.nspname = 'public' AND c.relkind IN ('r', 'v', 'm', 'p')
+    ORDER BY c.relname
+""")
+
+# Table descriptions by name, the schema only changes with a migration and a server restart
+table_descriptions: dict[str, str] = {}
+
+
+async def describe(conn, table: str) -> str | None:
+    """
+    Describe a table in the public schema as a CREATE TABLE statement, or return None if there is no such table.
+    """
+    columns = (await conn.execute(DESCRIBE_COLUMNS_SQL, {"table": table})).all()
+    if not columns:
+        return None
+    constraints = (await conn.execute(DESCRIBE_CONSTRAINTS_SQL, {"table": table})).all()
+
+    lines = [f"  {column.name} {column.type}{' not null' if column.not_null else ''}" for column in columns]
+    lines += [f"  constraint {constraint.name} {constraint.definition}" for constraint in constraints]
+    return f"create table public.{table} (\n" + ",\n".join(lines) + "\n);"
+
+
+# ----------------------------
+# MCP Server
+# ----------------------------
+
+mcp = FastMCP("postgres")
+
+
+@mcp.tool()
+async def query(sql: str, offset: int = 0) -> str:
+    """Run a read-only SQL query against the CRM database.
+
+    Results are paginated. Prefer aggregating in SQL over fetching many rows.
+
+    Args:
+        sql: The SELECT query to run.
+        offset: The number of rows to skip. Pass the next_offset of the previous result to continue it.
+
+    Returns:
+        A JSON object with the column names, a page of rows from the offset, the offset
+        of the next page if there are more rows, the total number of rows and notes on any truncation.
+    """
+    normalized = normalize_sql(sql)
+    offset = max(offset, 0)
+
+    try:
+        async with engine.connect() as conn:
+            relations = query_cache.get_relations(normalized)
+            if relations is None:
+                relations = await read_relations(conn, sql)
+                query_cache.put_relations(normalized, relations)
+            versions = await get_table_versions(conn, sorted(relations.intersection(VERSIONED_TABLES)))
+        result = query_cache.get(normalized, versions)
+        if result is None:
+            result = await run_read_only(sql, QUERY_MAX_ROWS)
+            # Results of tables without a version would be stale until they expire
+            ttl = None if relations.issubset(VERSIONED_TABLES) else QUERY_CACHE_UNVERSIONED_TTL
+            query_cache.put(normalized, versions, result, ttl)
+    except DBAPIError as e:
+        return f"Query failed: {e.orig}"
+    except asyncpg.PostgresError as e:
+        # Errors raised while streaming rows come straight from the driver
+        return f"Query failed: {e}"
+
+    return json.dumps(build_page(result, offset), default=str)
+
+
+@mcp.tool()
+async def describe_table(table: str) -> str:
+    """Get the columns, types and constraints of a table in the CRM database.
+
+    Args:
+        table: The name of the table or view, e.g. customers.
+
+    Returns:
+        The table as a CREATE TABLE statement, with column names quoted as they must be in queries.
+    """
+    if table in table_descriptions:
+        return table_descriptions[table]
+
+    try:
+        async with engine.connect() as conn:
+            description = await describe(conn, table)
+            if description is None:
+                tables = (await conn.execute(LIST_TABLES_SQL)).scalars().all()
+                return f"There is no table named {table}. The tables are: {', '.join(tables)}."
+    except DBAPIError as e:
+        return f"Describe failed: {e.orig}"
+
+    table_descriptions[table] = description
+    return description
+
+
+if __name__ == "__main__":
+    mcp.run(transport="stdio")
@@ -0,0 +1,235 @@
+"""
+This file renders campaign emails from templates, so the LLM writes one template per
+campaign instead of a full email per customer.
+
+Templates are plain text or HTML with placeholders such as `{{ first_name }}`, or
+`{{ recommendation | our new arrivals }}` with a fallback for customers without a value.
+Compiled templates are cached, and rendering a compiled template is a single string format.
+"""
+
+from datetime import date
+from functools import lru_cache
+from html import escape
+from typing import Mapping, Optional
+from sqlalchemy import text
+import json
+import re
+from ralph.my_mcp.servers.db import get_table_versions
+
+
+# The placeholders a template can use
+TEMPLATE_VARIABLES = {
+    "name": "The customer's full name.",
+    "first_name": "The customer's first name.",
+    "email": "The customer's email address.",
+    "country": "The customer's country.",
+    "segment": "The customer's RFM segment.",
+    "favourite_item": "The item the customer spent the most on.",
+    "last_item": "The most recently bought of the customer's favourite items.",
+    "last_purchase_date": "The date of the customer's last purchase, e.g. 5 March 2011.",
+    "recommendation": "A best seller in the customer's segment that they have not bought.",
+}
+
+PLACEHOLDER_RE = re.compile(r"\{\{\s*(\w+)\s*(?:\|\s*(.*?)\s*)?\}\}", re.S)
+
+
+class TemplateError(ValueError):
+    pass
+
+
+class EmailTemplate:
+    """
+    A compiled template.
+
+    The text between placeholders is turned into a format string once, with one positional
+    field per placeholder, so rendering doesn't parse the template again.
+    """
+
+    __slots__ = ("source", "format_string", "slots")
+
+    def __init__(self, source: str):
+        self.source = source
+        self.slots: list[tuple[str, str]] = []
+        parts = []
+        position = 0
+        for match in PLACEHOLDER_RE.finditer(source):
+            name, fallback = match.group(1), match.group(2) or ""
+            if name not in TEMPLATE_VARIABLES:
+                raise TemplateError(f"Unknown placeholder {{{{ {name} }}}}. Use one of: {', '.join(TEMPLATE_VARIABLES)}.")
+            parts.append(escape_braces(source[position:match.start()]))
+            parts.append(f"{{{len(self.slots)}}}")
+            self.slots.append((name, fallback))
+            position = match.end()
+        parts.append(escape_braces(source[position:]))
+        self.format_string = "".join(parts)
+
+    def render(self, variables: Mapping[str, str], html: bool = False) -> str:
+        """
+        Fill in the placeholders. With `html`, values are HTML-escaped, fallbacks are part of the template and are not.
+        """
+        if html:
+            return self.format_string.format(*[
+                escape(value) if (value := variables.get(name)) else fallback for name, fallback in self.slots
+            ])
+        return self.format_string.format(*[variables.get(name) or fallback for name, fallback in self.slots])
+
+
+def escape_braces(literal: str) -> str:
+    if "{{" in literal:
+        raise TemplateError(f"Malformed placeholder near {literal[:40]!r}. Placeholders look like {{{{ first_name }}}}.")
+    return literal.replace("{", "{{").replace("}", "}}")
+
+
+@lru_cache(maxsize=256)
+def compile_template(source: str) -> EmailTemplate:
+    """
+    Compile a template, reusing the compiled template if the same source was compiled before.
+
+    Raises:
+        TemplateError: If the template uses an unknown or malformed placeholder.
+    """
+    return EmailTemplate(source)
+
+
+@lru_cache(maxsize=4096)
+def format_date(value: Optional[str]) -> str:
+    if not value:
+        return ""
+    day = date.fromisoformat(value[:10])
+    return f"{day.day} {day:%B %Y}"
+
+
+# Only what the placeholders need. Transactions are found through the index on ("Customer ID", "InvoiceDate").
+RECIPIENTS_SQL = """
+WITH bought AS (
+    SELECT t."Customer ID" AS customer_id,
+           t."StockCode" AS stock_code,
+           SUM(t."TotalPrice") AS spend,
+           MAX(t."InvoiceDate") AS last_purchased
+    FROM transactions t
+    WHERE t."Customer ID" = ANY(:customer_ids)
+    GROUP BY t."Customer ID", t."StockCode"
+),
+ranked AS (
+    SELECT b.customer_id,
+           b.stock_code,
+           b.last_purchased,
+           ROW_NUMBER() OVER (PARTITION BY b.customer_id ORDER BY b.spend DESC) AS rank,
+           MAX(b.last_purchased) OVER (PARTITION BY b.customer_id) AS last_purchase_date
+    FROM bought b
+)
+SELECT c."Customer ID" AS customer_id,
+       c."Name" AS name,
+       c."Email" AS email,
+       c."Country" AS country,
+       r."Segment" AS segment,
+       MAX(k.last_purchase_date)::date::text AS last_purchase_date,
+       COALESCE(
+           json_agg(
+               json_build_object('description', i."Description", 'last_purchased', k.last_purchased::date)
+               ORDER BY k.rank
+           ) FILTER (WHERE k.stock_code IS NOT NULL),
+           '[]'
+       )::text AS top_items
+FROM customers c
+LEFT JOIN rfm r ON r."Customer ID" = c."Customer ID"
+LEFT JOIN ranked k ON k.customer_id = c."Customer ID" AND k.rank <= :top_items
+LEFT JOIN items i ON i."StockCode" = k.stock_code
+WHERE c."Customer ID" = ANY(:customer_ids)
+GROUP BY c."Customer ID", r."Segment"
+"""
+
+
+async def fetch_recipients(session, customer_ids: list[int], top_items: int = 3) -> dict[int, dict]:
+    """
+    Fetch what `customer_variables` needs for each customer, in a single query.
+
+    Unlike `CustomerProfileCache`, nothing is cached: a campaign emails each customer once,
+    so caching their data would only evict the profiles the agent is looking at.
+
+    Returns:
+        The data of each known customer, by ID.
+    """
+    result = await session.execute(text(RECIPIENTS_SQL), {"customer_ids": customer_ids, "top_items": top_items})
+    recipients = {}
+    for row in result.mappings():
+        recipient = dict(row)
+        recipient["top_items"] = json.loads(recipient["top_items"])
+        recipients[recipient["customer_id"]] = recipient
+    return recipients
+
+
+def customer_variables(profile: dict, best_sellers: Mapping[str, list[str]]) -> dict[str, str]:
+    """
+    Get the values of the placeholders for a customer from their data, see `fetch_recipients`.
+    Profiles from `CustomerProfileCache` have the same fields.
+    """
+    top_items = profile.get("top_items") or []
+    last_items = sorted(top_items, key=lambda item: item.get("last_purchased") or "", reverse=True)
+    bought = {item["description"] for item in top_items}
+    recommendation = next((item for item in best_sellers.get(profile.get("segment"), []) if item not in bought), "")
+    name = profile.get("name") or ""
+
+    return {
+        "name": name,
+        "first_name": name.split()[0] if name.strip() else "",
+        "email": profile.get("email") or "",
+        "country": profile.get("country") or "",
+        "segment": profile.get("segment") or "",
+        "favourite_item": top_items[0]["description"] if top_items else "",
+        "last_item": last_items[0]["description"] if last_items else "",
+        "last_purchase_date": format_date(profile.get("last_purchase_date")),
+        "recommendation": recommendation,
+    }
+
+
+def render_email(subject: EmailTemplate, body: EmailTemplate, variables: Mapping[str, str]) -> tuple[str, str]:
+    """
+    Render the subject and HTML body of an email. Values are HTML-escaped in the body only.
+    """
+    return subject.render(variables), body.render(variables, html=True)
+
+
+# Tables the best sellers are computed from, a change to any of them invalidates the cache
+BEST_SELLER_TABLES = ["transactions", "items", "rfm"]
+
+BEST_SELLERS_SQL = """
+WITH sales AS (
+    SELECT r."Segment" AS segment, t."StockCode" AS stock_code, SUM(t."Quantity") AS quantity
+    FROM transactions t
+    JOIN rfm r ON r."Customer ID" = t."Customer ID"
+    GROUP BY r."Segment", t."StockCode"
+),
+ranked AS (
+    SELECT s.*, ROW_NUMBER() OVER (PARTITION BY s.segment ORDER BY s.quantity DESC) AS rank
+    FROM sales s
+)
+SELECT k.segment, i."Description" AS description
+FROM ranked k
+JOIN items i ON i."StockCode" = k.stock_code
+WHERE k.rank <= :per_segment
+ORDER BY k.segment, k.rank
+"""
+
+
+class BestSellerCache:
+    """
+    In-memory cache of the best selling items of each RFM segment, used for recommendations.
+    The best sellers are computed with one aggregate query and recomputed when a source table changes.
+    """
+
+    def __init__(self, per_segment: int = 10):
+        self.per_segment = per_segment
+        self.best_sellers: Optional[dict[str, list[str]]] = None
+        self.versions: dict[str, int] = {}
+
+    async def get(self, session) -> dict[str, list[str]]:
+        versions = await get_table_versions(session, BEST_SELLER_TABLES)
+        if self.best_sellers is None or versions != self.versions:
+            result = await session.execute(text(BEST_SELLERS_SQL), {"per_segment": self.per_segment})
+            best_sellers = {}
+            for row in result.mappings():
+                best_sellers.setdefault(row["segment"], []).append(row["description"])
+            self.best_sellers = best_sellers
+            self.versions = versions
+        return self.best_sellers
@@ -0,0 +1,126 @@
+"""
+This file limits the rate and the concurrency of requests to the LLM endpoint.
+
+The token bucket caps requests per second. The concurrency limiter adapts the number of
+requests in flight to what the endpoint accepts: it grows slowly while requests succeed
+and halves when many requests are answered with 429 Too Many Requests.
+"""
+
+from contextlib import asynccontextmanager
+from typing import AsyncIterator
+import asyncio
+import time
+
+
+class TokenBucket:
+    """
+    Token bucket that allows `rate` requests per second on average and bursts of up to `burst` requests.
+
+    Waiters are served in order. A rate of 0 or less disables the limit.
+    """
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self.tokens = float(self.burst)
+        self.updated_at = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    def refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self) -> bool:
+        """
+        Take a token if one is available right away.
+        """
+        if self.rate <= 0:
+            return True
+        self.refill()
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        return False
+
+    async def acquire(self) -> None:
+        """
+        Wait for a token.
+        """
+        if self.rate <= 0:
+            return
+        async with self.lock:
+            self.refill()
+            if self.tokens < 1:
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+                self.refill()
+            self.tokens -= 1
+
+
+class AdaptiveConcurrencyLimiter:
+    """
+    Limits the requests in flight, adapting the limit with additive increase and multiplicative decrease.
+
+    The limit is adjusted once per round, i.e. once as many requests as the limit have finished.
+    If more than `tolerance` of them were rejected as overloaded, the limit is cut by `backoff`,
+    otherwise it grows by one. The tolerance keeps occasional 429s, which most endpoints send
+    now and then regardless of load, from collapsing the limit.
+
+    Args:
+        initial: The starting limit.
+        minimum: The lowest limit.
+        maximum: The highest limit.
+        backoff: The factor the limit is multiplied by when the endpoint is overloaded.
+        tolerance: The share of overloaded requests in a round that is still accepted.
+    """
+
+    def __init__(
+            self,
+            initial: int = 8,
+            minimum: int = 1,
+            maximum: int = 64,
+            backoff: float = 0.5,
+            tolerance: float = 0.1
+            ):
+        self.limit = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.in_flight = 0
+        self.succeeded = 0
+        self.overloaded = 0
+        self.condition = asyncio.Condition()
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Hold a slot for one request.
+        """
+        async with self.condition:
+            await self.condition.wait_for(lambda: self.in_flight < self.limit)
+            self.in_flight += 1
+        try:
+            yield
+        finally:
+            async with self.condition:
+                self.in_flight -= 1
+                self.condition.notify_all()
+
+    def on_success(self) -> None:
+        self.succeeded += 1
+        self.adjust()
+
+    def on_overload(self) -> None:
+        self.overloaded += 1
+        self.adjust()
+
+    def adjust(self) -> None:
+        finished = self.succeeded + self.overloaded
+        if finished < self.limit:
+            return
+        if self.overloaded > finished * self.tolerance:
+            self.limit = max(self.minimum, int(self.limit * self.backoff))
+        else:
+            self.limit = min(self.maximum, self.limit + 1)
+        self.succeeded = self.overloaded = 0
@@ -0,0 +1,271 @@
+"""
+This file turns a graph run into a stream of typed events for the frontends.
+
+The LLM streams text and tool call arguments a few characters at a time. `coalesce` merges
+consecutive deltas until a size or time window is reached, so the frontends write fewer,
+larger chunks to the terminal or the network without delaying the reply noticeably.
+"""
+
+from dataclasses import asdict, dataclass
+from typing import Any, AsyncIterator, ClassVar, Optional, Union
+from langchain_core.messages import AIMessage, AIMessageChunk, ToolMessage
+import asyncio
+import json
+
+
+@dataclass
+class TextDelta:
+    """
+    A piece of the text of the reply.
+    """
+    event: ClassVar[str] = "text"
+    text: str
+
+
+@dataclass
+class ToolCallStart:
+    """
+    The LLM started a tool call. Parallel tool calls are told apart by their index.
+    """
+    event: ClassVar[str] = "tool_call"
+    index: int
+    id: Optional[str]
+    name: str
+
+
+@dataclass
+class ToolCallArgsDelta:
+    """
+    A piece of the JSON arguments of the tool call with the given index.
+    """
+    event: ClassVar[str] = "tool_call_args"
+    index: int
+    args: str
+
+
+@dataclass
+class ToolResult:
+    """
+    The result of a tool call, or the feedback given instead of running it.
+    """
+    event: ClassVar[str] = "tool_result"
+    tool_call_id: str
+    name: Optional[str]
+    content: str
+    status: str
+
+
+@dataclass
+class InterruptEvent:
+    """
+    The run stopped to wait for human input, e.g. the approval of a protected tool call.
+    """
+    event: ClassVar[str] = "interrupt"
+    value: Any
+
+
+StreamEvent = Union[TextDelta, ToolCallStart, ToolCallArgsDelta, ToolResult, InterruptEvent]
+
+
+def event_data(event: StreamEvent) -> Any:
+    """
+    Get the JSON-serialisable payload of an event.
+    """
+    if isinstance(event, InterruptEvent):
+        return event.value
+    return asdict(event)
+
+
+def message_text(content: Union[str, list]) -> str:
+    if isinstance(content, str):
+        return content
+    # Content blocks, only the text ones are streamed
+    return "".join(
+        block if isinstance(block, str) else block.get("text", "")
+        for block in content
+        if isinstance(block, str) or block.get("type") == "text"
+    )
+
+
+def message_events(message: Any) -> list[StreamEvent]:
+    """
+    Convert a message emitted by the graph into events.
+    """
+    events = []
+    if isinstance(message, AIMessageChunk):
+        for position, tool_call_chunk in enumerate(message.tool_call_chunks):
+            index = tool_call_chunk.get("index")
+            if index is None:
+                index = position
+            if tool_call_chunk.get("name"):
+                events.append(ToolCallStart(index=index, id=tool_call_chunk.get("id"), name=tool_call_chunk["name"]))
+            if tool_call_chunk.get("args"):
+                events.append(ToolCallArgsDelta(index=index, args=tool_call_chunk["args"]))
+        if text := message_text(message.content):
+            events.insert(0, TextDelta(text=text))
+
+    elif isinstance(message, AIMessage):
+        # A reply that was not streamed, e.g. a cache hit, arrives in one piece
+        if text := message_text(message.content):
+            events.append(TextDelta(text=text))
+        for index, tool_call in enumerate(message.tool_calls):
+            events.append(ToolCallStart(index=index, id=tool_call["id"], name=tool_call["name"]))
+            events.append(ToolCallArgsDelta(index=index, args=json.dumps(tool_call["args"], ensure_ascii=False)))
+
+    elif isinstance(message, ToolMessage):
+        events.append(ToolResult(
+            tool_call_id=message.tool_call_id,
+            name=message.name,
+            content=message_text(message.content),
+            status=message.status,
+        ))
+
+    return events
+
+
+async def graph_events(input: Any, graph, **kwargs) -> AsyncIterator[StreamEvent]:
+    """
+    Stream the events of a graph run as they happen, without coalescing.
+
+    Args:
+        input: The input to the graph, or a `Command` to resume it.
+        graph: The compiled graph.
+        **kwargs: Additional keyword arguments for `graph.astream`, e.g. the config.
+    """
+    async for mode, chunk in graph.astream(input=input, stream_mode=["messages", "updates"], **kwargs):
+        if mode == "messages":
+            message, _metadata = chunk
+            for event in message_events(message):
+                yield event
+        elif "__interrupt__" in chunk:
+            for interrupt in chunk["__interrupt__"]:
+                yield InterruptEvent(value=interrupt.value)
+
+
+def merge(pending: StreamEvent, event: StreamEvent) -> Optional[StreamEvent]:
+    """
+    Merge two consecutive deltas, or return None if they can't be merged.
+    """
+    if isinstance(pending, TextDelta) and isinstance(event, TextDelta):
+        return TextDelta(text=pending.text + event.text)
+    if isinstance(pending, ToolCallArgsDelta) and isinstance(event, ToolCallArgsDelta) and pending.index == event.index:
+        return ToolCallArgsDelta(index=pending.index, args=pending.args + event.args)
+    return None
+
+
+def delta_size(event: StreamEvent) -> Optional[int]:
+    if isinstance(event, TextDelta):
+        return len(event.text)
+    if isinstance(event, ToolCallArgsDelta):
+        return len(event.args)
+    return None
+
+
+_END = object()
+
+
+async def coalesce(
+        events: AsyncIterator[StreamEvent],
+        max_delay: float = 0.05,
+        max_chars: int = 1024
+        ) -> AsyncIterator[StreamEvent]:
+    """
+    Merge consecutive text or tool call argument deltas.
+
+    A merged delta is emitted once it is `max_chars` long, once `max_delay` seconds have
+    passed since its first piece arrived, or as soon as an event of another kind arrives.
+    The very first delta and all other events are passed through right away, in order.
+
+    Args:
+        events: The events to coalesce.
+        max_delay: The longest a delta is held back, in seconds. 0 disables coalescing.
+        max_chars: The size at which a merged delta is emitted right away.
+    """
+    if max_delay <= 0:
+        async for event in events:
+            yield event
+        return
+
+    # The source is read by its own task, so a delta can be flushed while the next event is awaited
+    queue: asyncio.Queue = asyncio.Queue(maxsize=256)
+
+    async def read_events():
+        try:
+            async for event in events:
+                await queue.put(event)
+        except Exception as e:
+            await queue.put(e)
+        else:
+            await queue.put(_END)
+
+    loop = asyncio.get_running_loop()
+    reader = asyncio.create_task(read_events())
+    pending = None
+    deadline = 0.0
+    first_delta = True
+    try:
+        while True:
+            if pending is None:
+                item = await queue.get()
+            else:
+                try:
+                    item = await asyncio.wait_for(queue.get(), timeout=max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    yield pending
+                    pending = None
+                    continue
+
+            if item is _END:
+                break
+            if isinstance(item, Exception):
+                if pending is not None:
+                    yield pending
+                    pending = None
+                raise item
+
+            if pending is not None:
+                merged = merge(pending, item)
+                if merged is not None:
+                    pending = merged
+                else:
+                    yield pending
+                    pending = None
+
+            if pending is None:
+                if delta_size(item) is None or first_delta:
+                    # The first delta is not held back, so coalescing doesn't delay the first token
+                    first_delta = first_delta and delta_size(item) is None
+                    yield item
+                    continue
+                pending = item
+                deadline = loop.time() + max_delay
+
+            if delta_size(pending) >= max_chars:
+                yield pending
+                pending = None
+
+        if pending is not None:
+            yield pending
+    finally:
+        # Stops the graph run too if the consumer went away early
+        reader.cancel()
+
+
+def stream_graph_events(
+        input: Any,
+        graph,
+        max_delay: float = 0.05,
+        max_chars: int = 1024,
+        **kwargs
+        ) -> AsyncIterator[StreamEvent]:
+    """
+    Stream the events of a graph run, coalescing small deltas.
+
+    Args:
+        input: The input to the graph, or a `Command` to resume it.
+        graph: The compiled graph.
+        max_delay: The longest a delta is held back, in seconds. 0 disables coalescing.
+        max_chars: The size at which a merged delta is emitted right away.
+        **kwargs: Additional keyword arguments for `graph.astream`, e.g. the config.
+    """
+    return coalesce(graph_events(input, graph, **kwargs), max_delay=max_delay, max_chars=max_chars)
@@ -0,0 +1,106 @@
+"""
+This file defines the node that executes the tool calls requested by the assistant.
+Independent tool calls from a single AI message are run concurrently.
+"""
+
+import asyncio
+from typing import Sequence
+from langchain_core.messages import AIMessage, BaseMessage, ToolMessage
+from langchain_core.runnables import RunnableConfig
+from langchain_core.tools import BaseTool
+from ralph.metrics import record_tool_payload, span
+
+
+def get_pending_tool_calls(messages: Sequence[BaseMessage]) -> list[dict]:
+    """
+    Find the tool calls of the last AI message that have not been answered yet.
+    A tool call is answered once a ToolMessage with its ID follows the AI message,
+    e.g. when a human reviewer sent feedback instead of running the tool.
+    """
+    answered = set()
+    for message in reversed(messages):
+        if isinstance(message, ToolMessage):
+            answered.add(message.tool_call_id)
+        elif isinstance(message, AIMessage):
+            return [tool_call for tool_call in message.tool_calls if tool_call["id"] not in answered]
+    return []
+
+
+async def run_tool_call(
+        tool: BaseTool | None,
+        tool_call: dict,
+        timeout: float,
+        config: RunnableConfig | None = None
+        ) -> ToolMessage:
+    """
+    Run a single tool call, turning errors and timeouts into error ToolMessages
+    so the assistant can see what went wrong and recover.
+    """
+    if tool is None:
+        return ToolMessage(
+            content=f"Error: {tool_call['name']} is not a valid tool.",
+            name=tool_call["name"],
+            tool_call_id=tool_call["id"],
+            status="error"
+        )
+
+    try:
+        result = await asyncio.wait_for(
+            tool.ainvoke({**tool_call, "type": "tool_call"}, config),
+            timeout=timeout
+        )
+    except asyncio.TimeoutError:
+        return ToolMessage(
+            content=f"Error: {tool_call['name']} timed out after {timeout} seconds.",
+            name=tool_call["name"],
+            tool_call_id=tool_call["id"],
+            status="error"
+        )
+    except Exception as e:
+        return ToolMessage(
+            content=f"Error: {repr(e)}\n Please fix your mistakes.",
+            name=tool_call["name"],
+            tool_call_id=tool_call["id"],
+            status="error"
+        )
+
+    if isinstance(result, ToolMessage):
+        return result
+    return ToolMessage(content=str(result), name=tool_call["name"], tool_call_id=tool_call["id"])
+
+
+def make_tool_executor_node(tools: Sequence[BaseTool], max_concurrency: int = 16, timeout: float = 120.0):
+    """
+    Build a graph node that runs all pending tool calls of the last AI message.
+
+    Unlike LangGraph's ToolNode, which starts every call at once, calls beyond `max_concurrency`
+    wait for a slot, so a turn with more calls than that takes more than one round of tool latency.
+    The default matches the 15 connections an MCP server opens by default (DB_POOL_SIZE plus
+    DB_MAX_OVERFLOW), beyond which calls to one server would wait for a connection anyway.
+    See benchmarks/tool_execution.py.
+
+    Args:
+        tools: The tools available to the assistant.
+        max_concurrency: The maximum number of tool calls running at the same time.
+        timeout: The number of seconds a single tool call may take.
+
+    Returns:
+        An async node function that returns one ToolMessage per tool call, in the order they were requested.
+    """
+    tools_by_name = {tool.name: tool for tool in tools}
+
+    async def tool_executor_node(state, config: RunnableConfig) -> dict:
+        semaphore = asyncio.Semaphore(max_concurrency)
+
+        async def run(tool_call: dict) -> ToolMessage:
+            async with semaphore:
+                with span("tool", tool_call["name"]) as attributes:
+                    message = await run_tool_call(tools_by_name.get(tool_call["name"]), tool_call, timeout, config)
+                    attributes["status"] = "error" if message.status == "error" else "ok"
+                    record_tool_payload(attributes, tool_call["name"], tool_call["args"], message.content)
+                    return message
+
+        tool_messages = await asyncio.gather(*(run(tool_call) for tool_call in get_pending_tool_calls(state.messages)))
+        return {"messages": list(tool_messages)}
+
+    return tool_executor_node